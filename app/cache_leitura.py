@@ -0,0 +1,331 @@
+"""
+Cache em disco dos arquivos já lidos (carteira, balancete e mapeamento), sem dependência do Streamlit
+A chave é o hash do conteúdo do arquivo: o mesmo arquivo enviado de novo (em outro rerun da página
+ou em outra sessão) é carregado do cache em vez de ser lido outra vez
+Cada entrada guarda os DataFrames em formato colunar binário (Arrow IPC/feather) e o restante do valor
+(tuplas, relatórios) em JSON; nada é desserializado como código (sem pickle)
+O diretório é privado do usuário (0700) e o cache não é usado se ele pertencer a outro usuário ou
+puder ser alterado por outros; quando passa do tamanho máximo, as entradas usadas há mais tempo são apagadas
+"""
+import datetime
+import hashlib
+import io
+import json
+import os
+import stat
+import struct
+import tempfile
+
+import pandas as pd
+
+# Diretório (um por usuário) e tamanho máximo do cache (em MB)
+_USUARIO = os.getuid() if hasattr(os, 'getuid') else os.getenv("USERNAME", "usuario")
+DIRETORIO_CACHE = os.getenv("CACHE_LEITURA_DIR", os.path.join(tempfile.gettempdir(), f"conciliador_cache_{_USUARIO}"))
+TAMANHO_MAXIMO_MB = float(os.getenv("CACHE_LEITURA_MAX_MB", "1024"))
+
+# Mudar sempre que o formato devolvido pelos leitores mudar (invalida as entradas antigas)
+VERSAO_CACHE = 5
+
+EXTENSAO = '.cache'
+ASSINATURA = b'CONCCACHE'
+TAMANHO_BLOCO_HASH = 8 * 1024 * 1024
+
+
+class ErroCache(Exception):
+    """
+    Valor que não pode ser guardado no cache ou entrada em formato inesperado
+    """
+
+
+def hash_conteudo(arquivo):
+    """
+    Hash (BLAKE2b) do conteúdo de um arquivo binário (ex.: UploadedFile do Streamlit ou arquivo aberto)
+    O arquivo volta para o início ao final
+    """
+    hash_arquivo = hashlib.blake2b(digest_size=20)
+
+    if hasattr(arquivo, 'getbuffer'):
+        # BytesIO (UploadedFile): o buffer é usado sem cópia
+        with arquivo.getbuffer() as buffer:
+            hash_arquivo.update(buffer)
+    else:
+        arquivo.seek(0)
+        for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO_HASH), b''):
+            hash_arquivo.update(bloco)
+
+    arquivo.seek(0)
+    return hash_arquivo.hexdigest()
+
+
+def _caminho_entrada(tipo, chave, diretorio, variante=None):
+    if variante is not None:
+        # Ex.: a aba do Excel lida; entra na chave pelo hash, já que pode ter qualquer caractere
+        chave = f"{chave}_{hashlib.blake2b(str(variante).encode('utf-8'), digest_size=8).hexdigest()}"
+    return os.path.join(diretorio, f"{tipo}_v{VERSAO_CACHE}_{chave}{EXTENSAO}")
+
+
+def _para_json(valor, dataframes):
+    """
+    Converte o valor em uma estrutura JSON; os DataFrames vão para a lista dataframes e ficam
+    representados pela posição nela
+    """
+    if isinstance(valor, pd.DataFrame):
+        dataframes.append(valor)
+        return {'__dataframe__': len(dataframes) - 1}
+    if isinstance(valor, tuple):
+        return {'__tupla__': [_para_json(item, dataframes) for item in valor]}
+    if isinstance(valor, list):
+        return [_para_json(item, dataframes) for item in valor]
+    if isinstance(valor, dict):
+        if not all(isinstance(chave, str) for chave in valor) or any(chave.startswith('__') for chave in valor):
+            raise ErroCache("dicionário com chaves que não são texto")
+        return {chave: _para_json(item, dataframes) for chave, item in valor.items()}
+    if valor is None or isinstance(valor, (bool, int, float, str)):
+        return valor
+    if hasattr(valor, 'item'):
+        # Escalares do numpy
+        return _para_json(valor.item(), dataframes)
+    raise ErroCache(f"tipo não suportado no cache: {type(valor).__name__}")
+
+
+def _de_json(estrutura, dataframes):
+    if isinstance(estrutura, list):
+        return [_de_json(item, dataframes) for item in estrutura]
+    if isinstance(estrutura, dict):
+        if '__dataframe__' in estrutura:
+            return dataframes[estrutura['__dataframe__']]
+        if '__tupla__' in estrutura:
+            return tuple(_de_json(item, dataframes) for item in estrutura['__tupla__'])
+        return {chave: _de_json(item, dataframes) for chave, item in estrutura.items()}
+    return estrutura
+
+
+def _celula_para_json(valor):
+    if hasattr(valor, 'item') and not isinstance(valor, (datetime.date, datetime.datetime)):
+        valor = valor.item()
+    if isinstance(valor, (datetime.date, datetime.datetime)):
+        return json.dumps({'__data__': valor.isoformat(), 'hora': isinstance(valor, datetime.datetime)})
+    if valor is None or isinstance(valor, (bool, int, float, str)):
+        return json.dumps(valor)
+    raise ErroCache(f"tipo não suportado em coluna mista: {type(valor).__name__}")
+
+
+def _celula_de_json(texto):
+    valor = json.loads(texto)
+    if isinstance(valor, dict):
+        if valor['hora']:
+            return pd.Timestamp(valor['__data__'])
+        return datetime.date.fromisoformat(valor['__data__'])
+    return valor
+
+
+def _coluna_mista(serie):
+    """
+    Coluna object com valores de mais de um tipo (ex.: 'Conta' do mapeamento com 112, '1.1.2' e '112*'),
+    que o Arrow não converte
+    """
+    if serie.dtype != object:
+        return False
+    tipos = {type(valor) for valor in serie if valor is not None and not (isinstance(valor, float) and valor != valor)}
+    return len(tipos) > 1
+
+
+def _dataframe_para_bytes(df):
+    """
+    DataFrame em Arrow IPC (feather); nomes e índice vão nos metadados JSON
+    Colunas com tipos misturados são gravadas célula a célula em JSON (o tipo de cada valor é
+    preservado) e marcadas nos metadados
+    Retorna: (bytes, metadados)
+    """
+    colunas = list(df.columns)
+    if not all(coluna is None or isinstance(coluna, (str, int, float, bool)) for coluna in colunas):
+        raise ErroCache("nomes de coluna que não são texto ou número")
+
+    indice = None
+    if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+        indice = '__indice__'
+    tabela = df.copy(deep=False)
+    tabela.columns = [f"c{posicao}" for posicao in range(len(colunas))]
+    mistas = [posicao for posicao in range(len(colunas)) if _coluna_mista(tabela.iloc[:, posicao])]
+    for posicao in mistas:
+        tabela[f"c{posicao}"] = [_celula_para_json(valor) for valor in tabela[f"c{posicao}"]]
+    if indice is not None:
+        tabela.index.name = indice
+        tabela = tabela.reset_index()
+
+    buffer = io.BytesIO()
+    tabela.to_feather(buffer)
+    return buffer.getvalue(), {'colunas': colunas, 'indice': indice, 'mistas': mistas}
+
+
+def _dataframe_de_bytes(dados, metadados):
+    df = pd.read_feather(io.BytesIO(dados))
+    if metadados['indice'] is not None:
+        df = df.set_index(metadados['indice'])
+        df.index.name = None
+    for posicao in metadados['mistas']:
+        coluna = f"c{posicao}"
+        df[coluna] = pd.Series([_celula_de_json(texto) for texto in df[coluna]], index=df.index, dtype=object)
+    df.columns = metadados['colunas']
+    return df
+
+
+def _serializar(valor):
+    """
+    Formato da entrada: ASSINATURA, tamanho do JSON (8 bytes), JSON e, para cada DataFrame,
+    tamanho (8 bytes) e o conteúdo em Arrow IPC
+    """
+    dataframes = []
+    estrutura = _para_json(valor, dataframes)
+    blocos = [_dataframe_para_bytes(df) for df in dataframes]
+
+    cabecalho = json.dumps(
+        {'valor': estrutura, 'dataframes': [metadados for _, metadados in blocos]},
+        ensure_ascii=False
+    ).encode('utf-8')
+
+    partes = [ASSINATURA, struct.pack('<Q', len(cabecalho)), cabecalho]
+    for dados, _ in blocos:
+        partes.extend([struct.pack('<Q', len(dados)), dados])
+    return partes
+
+
+def _desserializar(arquivo):
+    if arquivo.read(len(ASSINATURA)) != ASSINATURA:
+        raise ErroCache("assinatura inválida")
+
+    def ler_bloco():
+        tamanho_bytes = arquivo.read(8)
+        if len(tamanho_bytes) != 8:
+            raise ErroCache("entrada truncada")
+        (tamanho,) = struct.unpack('<Q', tamanho_bytes)
+        dados = arquivo.read(tamanho)
+        if len(dados) != tamanho:
+            raise ErroCache("entrada truncada")
+        return dados
+
+    cabecalho = json.loads(ler_bloco().decode('utf-8'))
+    dataframes = [_dataframe_de_bytes(ler_bloco(), metadados) for metadados in cabecalho['dataframes']]
+    return _de_json(cabecalho['valor'], dataframes)
+
+
+def preparar_diretorio(diretorio=DIRETORIO_CACHE):
+    """
+    Cria o diretório do cache só com acesso do usuário (0700) e confere que ele pertence ao usuário
+    e não pode ser alterado por outros (ex.: diretório criado antes por outro usuário em /tmp)
+    Lança PermissionError quando o diretório não é seguro
+    """
+    os.makedirs(diretorio, mode=0o700, exist_ok=True)
+
+    estado = os.lstat(diretorio)
+    if not stat.S_ISDIR(estado.st_mode):
+        raise PermissionError(f"{diretorio} não é um diretório")
+    if hasattr(os, 'getuid') and estado.st_uid != os.getuid():
+        raise PermissionError(f"{diretorio} pertence a outro usuário")
+    if estado.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{diretorio} pode ser alterado por outros usuários")
+
+
+def _carregar_entrada(caminho):
+    """
+    Carrega uma entrada do cache e marca o uso (data de modificação) para a remoção por antiguidade
+    Retorna: (encontrado, valor) - entradas ausentes ou corrompidas contam como não encontradas
+    """
+    try:
+        with open(caminho, 'rb') as arquivo:
+            valor = _desserializar(arquivo)
+        os.utime(caminho)
+        return True, valor
+    except FileNotFoundError:
+        return False, None
+    except Exception as e:
+        print(f"Entrada do cache inválida, será lida de novo ({caminho}): {e}")
+        _remover(caminho)
+        return False, None
+
+
+def _salvar_entrada(caminho, valor, diretorio):
+    """
+    Grava a entrada em um arquivo temporário e o renomeia, para outra sessão nunca ler uma entrada pela metade
+    Lança ErroCache quando o valor não pode ser guardado
+    """
+    partes = _serializar(valor)
+    descritor, caminho_temporario = tempfile.mkstemp(dir=diretorio, suffix='.tmp')
+    try:
+        with os.fdopen(descritor, 'wb') as arquivo:
+            for parte in partes:
+                arquivo.write(parte)
+        os.replace(caminho_temporario, caminho)
+    except Exception:
+        _remover(caminho_temporario)
+        raise
+
+
+def _remover(caminho):
+    try:
+        os.remove(caminho)
+    except OSError:
+        pass
+
+
+def limitar_tamanho(diretorio=DIRETORIO_CACHE, tamanho_maximo_mb=TAMANHO_MAXIMO_MB):
+    """
+    Apaga as entradas usadas há mais tempo até o cache caber no tamanho máximo
+    Retorna: quantidade de entradas apagadas
+    """
+    entradas = []
+    try:
+        with os.scandir(diretorio) as itens:
+            for item in itens:
+                if item.name.endswith(EXTENSAO):
+                    try:
+                        estado = item.stat()
+                    except FileNotFoundError:
+                        continue  # Apagada por outra sessão
+                    entradas.append((estado.st_mtime, estado.st_size, item.path))
+    except FileNotFoundError:
+        return 0
+
+    excesso = sum(tamanho for _, tamanho, _ in entradas) - tamanho_maximo_mb * 1024 * 1024
+    apagadas = 0
+    for _, tamanho, caminho in sorted(entradas):
+        if excesso <= 0:
+            break
+        _remover(caminho)
+        excesso -= tamanho
+        apagadas += 1
+
+    return apagadas
+
+
+def ler_com_cache(arquivo, tipo, leitor, variante=None, diretorio=DIRETORIO_CACHE, chave=None):
+    """
+    Devolve leitor(arquivo), usando o cache quando o mesmo conteúdo já foi lido pelo mesmo tipo de leitor
+    (e com a mesma variante, ex.: a aba escolhida do Excel)
+    chave é o hash_conteudo do arquivo, quando quem chamou já o calculou
+    Erros do leitor (ex.: ErroLeitura) não são guardados e chegam a quem chamou
+    Falhas do próprio cache (disco cheio, permissão) não impedem a leitura
+    """
+    try:
+        preparar_diretorio(diretorio)
+    except OSError as e:
+        print(f"Cache de leitura desativado: {e}")
+        return leitor(arquivo)
+    
+    if chave is None:
+        chave = hash_conteudo(arquivo)
+    caminho = _caminho_entrada(tipo, chave, diretorio, variante)
+
+    encontrado, valor = _carregar_entrada(caminho)
+    if encontrado:
+        return valor
+
+    valor = leitor(arquivo)
+
+    try:
+        _salvar_entrada(caminho, valor, diretorio)
+        limitar_tamanho(diretorio)
+    except Exception as e:
+        print(f"Não foi possível gravar no cache de leitura: {e}")
+
+    return valor
@@ -0,0 +1,590 @@
+"""
+Motor de conciliação entre carteira, balancete e mapeamento (sem dependência do Streamlit)
+"""
+import hashlib
+import numpy as np
+import pandas as pd
+
+from valores import centavos_para_reais, valores_em_centavos, valores_invalidos
+
+COLUNAS_RESULTADO = [
+    'Ativo Carteira',
+    'Conta Balancete',
+    'Valor Carteira',
+    'Saldo Balancete',
+    'Diferença',
+    'Numero de Registros',
+    'Status'
+]
+
+# Contas do mapeamento terminadas com o marcador valem para toda a subárvore (ex.: '112*')
+MARCADOR_PREFIXO = '*'
+
+# Versão do formato do mapeamento compilado (mudar quando a normalização das contas mudar)
+VERSAO_MAPEAMENTO_COMPILADO = 1
+
+# Maior caractere unicode: prefixo + FIM_UNICODE é maior que qualquer conta que começa com o prefixo
+FIM_UNICODE = '\U0010FFFF'
+
+
+class ErroConciliacao(ValueError):
+    """
+    Erro nos dados de entrada da conciliação, com uma dica opcional para o usuário
+    """
+    def __init__(self, mensagem, dica=None):
+        super().__init__(mensagem)
+        self.dica = dica
+
+
+def detectar_colunas_mapeamento(df_mapeamento):
+    """
+    Detecta as colunas de conta e de ativo da carteira no mapeamento
+    Retorna: (conta_col, ativo_col) - None quando a coluna não for encontrada
+    """
+    conta_col = None
+    ativo_col = None
+
+    for col in df_mapeamento.columns:
+        col_lower = str(col).lower()
+        if 'conta' in col_lower:
+            conta_col = col
+        elif 'ativo' in col_lower and 'carteira' in col_lower:
+            ativo_col = col
+
+    return conta_col, ativo_col
+
+
+def detectar_colunas_balancete(df_balancete):
+    """
+    Detecta as colunas de conta e de saldo do balancete
+    Retorna: (conta_col, saldo_col) - None quando a coluna não for encontrada
+    """
+    conta_col = None
+    if 'Conta' in df_balancete.columns:
+        conta_col = 'Conta'
+    elif 'Nome' in df_balancete.columns:
+        conta_col = 'Nome'
+
+    saldo_col = None
+    if 'SldAtu' in df_balancete.columns:
+        saldo_col = 'SldAtu'
+    elif 'SldAnt' in df_balancete.columns:
+        saldo_col = 'SldAnt'
+
+    return conta_col, saldo_col
+
+
+def calcular_impressao_digital(*dfs):
+    """
+    Calcula uma impressão digital do conteúdo dos DataFrames (colunas, tipos, índice e valores)
+    DataFrames com o mesmo conteúdo geram a mesma impressão digital, mesmo sendo objetos diferentes
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for df in dfs:
+        digest.update(repr(list(df.columns)).encode('utf-8'))
+        digest.update(repr([str(dtype) for dtype in df.dtypes]).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def normalizar_conta(conta):
+    """
+    Normaliza um código de conta (tanto do mapeamento quanto do balancete)
+    """
+    if pd.isna(conta):
+        return ''
+    conta_str = str(conta).strip()
+    # Converter vírgula para ponto para padronizar
+    conta_str = conta_str.replace(',', '.')
+    # Tentar converter para float e depois para int se for número inteiro
+    try:
+        conta_float = float(conta_str)
+        if conta_float.is_integer():
+            return str(int(conta_float))
+        else:
+            return str(conta_float)
+    except ValueError:
+        return conta_str
+
+
+def agrupar_mapeamento(df_mapeamento, conta_col, ativo_col):
+    """
+    Explode o mapeamento em pares ativo -> conta, um por linha
+    O mapeamento é lido de baixo para cima: a ordem das contas de cada ativo segue
+    a última linha em que aparecem, e pares repetidos são descartados
+    Contas terminadas com MARCADOR_PREFIXO são marcadas como prefixo e a chave é o próprio prefixo
+    Retorna: DataFrame com as colunas 'ativo', 'conta', 'ordem', 'prefixo' e 'chave' (conta normalizada)
+    """
+    # Inverter o DataFrame do mapeamento (de baixo para cima)
+    df_invertido = df_mapeamento.iloc[::-1]
+    contas = df_invertido[conta_col]
+    ativos = df_invertido[ativo_col]
+
+    # Verificar se ambos os valores são válidos
+    validos = contas.notna() & ativos.notna()
+    contas = contas[validos].astype(str).str.strip()
+    ativos = ativos[validos].astype(str).str.strip()
+    validos = (contas != '') & (ativos != '')
+
+    pares = pd.DataFrame({
+        'ativo': ativos[validos].to_numpy(dtype=object),
+        'conta': contas[validos].to_numpy(dtype=object)
+    })
+
+    # Evitar duplicatas mantendo a primeira ocorrência (a linha mais abaixo no arquivo)
+    pares = pares.drop_duplicates(subset=['ativo', 'conta'], keep='first').reset_index(drop=True)
+    pares['ordem'] = range(len(pares))
+
+    # Conta normalizada de cada par, no mesmo formato das contas do balancete
+    codigos, dicionario = codificar_contas(pares['conta'])
+    chaves = dicionario.take(codigos).to_numpy()
+
+    # Prefixos são comparados com o texto das contas normalizadas do balancete
+    pares['prefixo'] = pares['conta'].str.endswith(MARCADOR_PREFIXO) & (pares['conta'].str.len() > 1)
+    prefixos = pares['conta'].str[:-1].str.strip().str.replace(',', '.', regex=False)
+    pares['chave'] = np.where(pares['prefixo'], prefixos.to_numpy(dtype=object), chaves)
+
+    return pares
+
+
+def compilar_mapeamento(df_mapeamento):
+    """
+    Compila o mapeamento na forma usada pela conciliação: ativo -> contas sem duplicatas, já
+    normalizadas e na ordem de precedência (de baixo para cima)
+    Lança ErroConciliacao quando o mapeamento não tem as colunas necessárias
+    Retorna: {'versao': ..., 'ativos': {ativo: [[conta, chave, prefixo], ...]}} (serializável em JSON)
+    """
+    conta_col, ativo_col = detectar_colunas_mapeamento(df_mapeamento)
+
+    if conta_col is None or ativo_col is None:
+        raise ErroConciliacao(
+            "❌ Mapeamento não contém as colunas necessárias:",
+            "Colunas necessárias: 'Conta' e 'Ativo Carteira'"
+        )
+
+    pares = agrupar_mapeamento(df_mapeamento, conta_col, ativo_col)
+
+    ativos = {}
+    for ativo, conta, chave, prefixo in zip(pares['ativo'], pares['conta'], pares['chave'], pares['prefixo']):
+        ativos.setdefault(ativo, []).append([conta, chave, bool(prefixo)])
+
+    return {'versao': VERSAO_MAPEAMENTO_COMPILADO, 'ativos': ativos}
+
+
+def mapeamento_compilado_valido(mapeamento_compilado):
+    """
+    Verifica se o mapeamento compilado existe e está na versão atual do formato
+    """
+    return isinstance(mapeamento_compilado, dict) and mapeamento_compilado.get('versao') == VERSAO_MAPEAMENTO_COMPILADO
+
+
+def pares_do_mapeamento_compilado(mapeamento_compilado):
+    """
+    Reconstrói os pares ativo -> conta a partir do mapeamento compilado, sem reagrupar
+    Retorna: DataFrame no mesmo formato de agrupar_mapeamento
+    """
+    linhas = [
+        (ativo, conta, chave, prefixo)
+        for ativo, contas in mapeamento_compilado['ativos'].items()
+        for conta, chave, prefixo in contas
+    ]
+
+    pares = pd.DataFrame(linhas, columns=['ativo', 'conta', 'chave', 'prefixo']).astype(
+        {'ativo': object, 'conta': object, 'chave': object, 'prefixo': bool}
+    )
+    pares['ordem'] = range(len(pares))
+
+    return pares[['ativo', 'conta', 'ordem', 'prefixo', 'chave']]
+
+
+def mapeamento_compilado_para_dataframe(mapeamento_compilado):
+    """
+    Gera um DataFrame 'Conta'/'Ativo Carteira' equivalente ao mapeamento compilado (para exibição)
+    As linhas ficam na ordem inversa da precedência, como no arquivo original
+    """
+    linhas = [
+        (conta, ativo)
+        for ativo, contas in mapeamento_compilado['ativos'].items()
+        for conta, _, _ in contas
+    ]
+
+    return pd.DataFrame(linhas[::-1], columns=['Conta', 'Ativo Carteira'])
+
+
+def _normalizar_valores_unicos(valores):
+    """
+    Normaliza em bloco os valores únicos de uma coluna de contas
+    Segue a mesma regra de normalizar_conta: vírgula vira ponto, números inteiros perdem
+    as casas decimais e textos livres são mantidos como estão
+    """
+    textos = pd.Series(valores, dtype=object).astype(str).str.strip().str.replace(',', '.', regex=False)
+    numeros = pd.to_numeric(textos, errors='coerce').astype(float).to_numpy()
+
+    normalizados = textos.to_numpy(dtype=object).copy()
+
+    # Códigos com cara de inteiro (o caso comum) são convertidos sem passar por Python
+    with np.errstate(invalid='ignore'):
+        inteiros = np.isfinite(numeros) & (numeros == np.floor(numeros)) & (np.abs(numeros) < 2 ** 63)
+    normalizados[inteiros] = numeros[inteiros].astype(np.int64).astype(str).astype(object)
+
+    # Decimais e grafias numéricas que o parser vetorizado não aceita seguem a regra original
+    restantes = ~inteiros & (~np.isnan(numeros) | textos.str.contains(r'\d|inf|nan', case=False, regex=True).to_numpy())
+    normalizados[restantes] = [normalizar_conta(texto) for texto in normalizados[restantes]]
+
+    return normalizados
+
+
+def codificar_contas(contas):
+    """
+    Normaliza as contas de forma vetorizada e as codifica como inteiros (dicionário)
+    A normalização só é feita uma vez por valor distinto
+    Retorna: (codigos, dicionario) - codigos[i] é a posição em dicionario da conta normalizada da linha i
+    """
+    codigos_brutos, valores = pd.factorize(contas)
+    normalizados = _normalizar_valores_unicos(valores)
+
+    # Valores nulos (código -1) são normalizados como texto vazio
+    if (codigos_brutos < 0).any():
+        normalizados = np.append(normalizados, '').astype(object)
+
+    codigos_normalizados, dicionario = pd.factorize(normalizados)
+    codigos = codigos_normalizados[codigos_brutos]
+
+    return codigos, pd.Index(dicionario, dtype=object)
+
+
+def agregar_balancete(df_balancete, conta_col, saldo_col):
+    """
+    Agrega o balancete uma única vez por conta normalizada
+    Retorna: DataFrame indexado pela conta normalizada com 'saldo' (em centavos, int64) e 'registros'
+    A posição de cada conta no índice é o seu código inteiro
+    """
+    codigos, dicionario = codificar_contas(df_balancete[conta_col])
+
+    # Valores inválidos (NaN ou não numéricos) não somam no saldo
+    saldos = valores_em_centavos(df_balancete, saldo_col).to_numpy()
+
+    # Soma inteira exata (bincount com pesos somaria em float)
+    saldo_por_conta = np.zeros(len(dicionario), dtype=np.int64)
+    np.add.at(saldo_por_conta, codigos, saldos)
+
+    return pd.DataFrame({
+        'saldo': saldo_por_conta,
+        'registros': np.bincount(codigos, minlength=len(dicionario))
+    }, index=dicionario)
+
+
+def indexar_prefixos(df_agregado):
+    """
+    Índice de prefixos do balancete agregado: contas em ordem lexicográfica com saldo e
+    registros acumulados, de forma que o total de uma subárvore sai de duas buscas binárias
+    """
+    chaves = df_agregado.index.to_numpy(dtype=str)
+    ordem = np.argsort(chaves, kind='stable')
+
+    return {
+        'chaves': chaves[ordem],
+        'saldo': np.concatenate(([0], np.cumsum(df_agregado['saldo'].to_numpy()[ordem]))).astype(np.int64),
+        'registros': np.concatenate(([0], np.cumsum(df_agregado['registros'].to_numpy()[ordem])))
+    }
+
+
+def _intervalo_prefixos(chaves_ordenadas, prefixos):
+    """
+    Para cada prefixo, o intervalo [inicio, fim) das chaves ordenadas que começam com ele
+    """
+    prefixos = np.asarray(prefixos, dtype=str)
+    inicio = np.searchsorted(chaves_ordenadas, prefixos, side='left')
+    fim = np.searchsorted(chaves_ordenadas, np.char.add(prefixos, FIM_UNICODE), side='left')
+    return inicio, fim
+
+
+def totais_por_prefixo(indice_prefixos, prefixos):
+    """
+    Soma o saldo e a quantidade de registros das contas de cada prefixo
+    Retorna: (saldos, registros) - arrays alinhados com os prefixos
+    """
+    inicio, fim = _intervalo_prefixos(indice_prefixos['chaves'], prefixos)
+    saldos = indice_prefixos['saldo'][fim] - indice_prefixos['saldo'][inicio]
+    registros = indice_prefixos['registros'][fim] - indice_prefixos['registros'][inicio]
+    return saldos, registros
+
+
+def calcular_totais_prefixos(df_agregado, chaves_prefixos):
+    """
+    Saldo e registros da subárvore de cada prefixo do mapeamento
+    Retorna: DataFrame indexado pela chave do prefixo com 'saldo' e 'registros'
+    """
+    chaves = pd.Index(pd.unique(np.asarray(chaves_prefixos, dtype=object)), dtype=object)
+    if len(chaves) == 0:
+        return pd.DataFrame({'saldo': np.zeros(0, dtype=np.int64), 'registros': np.zeros(0, dtype=np.int64)}, index=chaves)
+
+    saldos, registros = totais_por_prefixo(indexar_prefixos(df_agregado), chaves)
+    return pd.DataFrame({'saldo': saldos, 'registros': registros}, index=chaves)
+
+
+def _descrever_contas(pares_encontrados):
+    """
+    Monta a descrição exibida em 'Conta Balancete' para cada ativo encontrado
+    """
+    posicao = pares_encontrados.groupby('ativo', sort=False).cumcount()
+    primeira = pares_encontrados.loc[posicao == 0].set_index('ativo')['conta']
+    segunda = pares_encontrados.loc[posicao == 1].set_index('ativo')['conta']
+    quantidade = pares_encontrados.groupby('ativo', sort=False).size()
+
+    segunda = segunda.reindex(primeira.index)
+    quantidade = quantidade.reindex(primeira.index)
+
+    # Textos em object: com o tipo 'str' do pandas, concatenar com object (mesmo vazio) lança TypeError
+    primeira = primeira.astype(object)
+    segunda = segunda.astype(object)
+    descricao = primeira.copy()
+
+    multiplos = segunda.notna()
+    if multiplos.any():
+        descricao[multiplos] = 'MÚLTIPLOS: ' + primeira[multiplos] + ', ' + segunda[multiplos]
+
+    outros = quantidade > 2
+    if outros.any():
+        descricao[outros] = descricao[outros] + ' + ' + (quantidade[outros] - 2).astype(str).astype(object) + ' outros'
+
+    return descricao
+
+
+def _montar_resultado(df_carteira, pares, df_agregado, totais_prefixos=None):
+    """
+    Monta o resultado da conciliação a partir dos pares do mapeamento e do balancete agregado
+    totais_prefixos (ver calcular_totais_prefixos) evita somar de novo as subárvores dos prefixos
+    """
+    exatos = pares[~pares['prefixo']]
+
+    # Traduzir as contas do mapeamento para os códigos inteiros do balancete (busca exata)
+    codigos_mapeamento, dicionario_mapeamento = pd.factorize(exatos['chave'])
+    codigos = df_agregado.index.get_indexer(dicionario_mapeamento)[codigos_mapeamento]
+
+    # Juntar os pares com os saldos agregados comparando apenas inteiros
+    encontrados = exatos[codigos >= 0].copy()
+    codigos = codigos[codigos >= 0]
+    encontrados['saldo'] = df_agregado['saldo'].to_numpy()[codigos]
+    encontrados['registros'] = df_agregado['registros'].to_numpy()[codigos]
+
+    # Prefixos somam a subárvore inteira (totais já calculados por prefixo)
+    prefixos = pares[pares['prefixo']]
+    if len(prefixos) > 0:
+        if totais_prefixos is None:
+            totais_prefixos = calcular_totais_prefixos(df_agregado, prefixos['chave'])
+        totais = totais_prefixos.reindex(prefixos['chave'].to_numpy())
+        prefixos = prefixos.assign(
+            saldo=totais['saldo'].to_numpy(dtype=np.int64),
+            registros=totais['registros'].to_numpy(dtype=np.int64)
+        )
+        encontrados = pd.concat([encontrados, prefixos[prefixos['registros'] > 0]])
+
+    encontrados = encontrados.sort_values('ordem', kind='stable')
+
+    por_ativo = encontrados.groupby('ativo', sort=False).agg(
+        saldo=('saldo', 'sum'),
+        registros=('registros', 'sum')
+    )
+    por_ativo['descricao'] = _descrever_contas(encontrados)
+
+    ativos = df_carteira['ativo']
+    valores = valores_em_centavos(df_carteira, 'valor').to_numpy()
+    # Valores que não são números (0 em centavos) nunca contam como conciliados
+    invalidos = valores_invalidos(df_carteira, 'valor')
+
+    mapeado = ativos.isin(set(pares['ativo']))
+
+    # Posição de cada ativo da carteira nos totais (-1 cai no 0 acrescentado ao final)
+    posicoes = por_ativo.index.get_indexer(ativos)
+    encontrado = pd.Series(posicoes >= 0, index=df_carteira.index)
+
+    saldo = np.append(por_ativo['saldo'].to_numpy(dtype=np.int64), 0)[posicoes]
+    registros = np.append(por_ativo['registros'].to_numpy(dtype=np.int64), 0)[posicoes]
+    diferenca = np.where(encontrado, valores - saldo, valores)
+
+    conta = ativos.map(por_ativo['descricao']).astype(object)
+    conta[~mapeado] = 'NÃO MAPEADO'
+    conta[mapeado & ~encontrado] = 'NÃO ENCONTRADO'
+
+    # Valores em centavos: conciliado só quando a diferença é exatamente zero
+    status = pd.Series('DIVERGENTE', index=df_carteira.index, dtype=object)
+    status[encontrado & (diferenca == 0) & ~invalidos] = 'CONCILIADO'
+    status[~encontrado] = 'NÃO MAPEADO'
+
+    df_resultado = pd.DataFrame({
+        'Ativo Carteira': ativos,
+        'Conta Balancete': conta,
+        'Valor Carteira': np.where(invalidos, np.nan, centavos_para_reais(valores)),
+        'Saldo Balancete': centavos_para_reais(saldo),
+        'Diferença': np.where(invalidos, np.nan, centavos_para_reais(diferenca)),
+        'Numero de Registros': registros,
+        'Status': status
+    }, columns=COLUNAS_RESULTADO)
+
+    return df_resultado.reset_index(drop=True)
+
+
+def _detectar_colunas(df_balancete, df_mapeamento):
+    """
+    Detecta as colunas do mapeamento e do balancete usadas na conciliação
+    Sem df_mapeamento (mapeamento compilado), as colunas do mapeamento ficam como None
+    Lança ErroConciliacao quando alguma coluna necessária não existe
+    Retorna: (conta_map_col, ativo_map_col, conta_bal_col, saldo_bal_col)
+    """
+    # Tentar encontrar as colunas com diferentes variações de nome
+    conta_map_col, ativo_map_col = None, None
+    if df_mapeamento is not None:
+        conta_map_col, ativo_map_col = detectar_colunas_mapeamento(df_mapeamento)
+
+    if df_mapeamento is not None and (conta_map_col is None or ativo_map_col is None):
+        raise ErroConciliacao(
+            "❌ Mapeamento não contém as colunas necessárias:",
+            "Colunas necessárias: 'Conta' e 'Ativo Carteira'"
+        )
+
+    # Detectar quais colunas de conta e de saldo usar no balancete
+    conta_bal_col, saldo_bal_col = detectar_colunas_balancete(df_balancete)
+
+    if conta_bal_col is None:
+        raise ErroConciliacao(
+            "❌ Balancete não contém coluna 'Conta' nem 'Nome'",
+            f"Colunas disponíveis no balancete: {list(df_balancete.columns)}"
+        )
+
+    if saldo_bal_col is None:
+        raise ErroConciliacao(
+            "❌ Balancete não contém coluna 'SldAtu' nem 'SldAnt'",
+            f"Colunas disponíveis no balancete: {list(df_balancete.columns)}"
+        )
+
+    return conta_map_col, ativo_map_col, conta_bal_col, saldo_bal_col
+
+
+def contas_alteradas(df_agregado_anterior, df_agregado_novo):
+    """
+    Contas normalizadas cujo saldo ou quantidade de registros mudou entre duas revisões do balancete
+    Inclui contas que apareceram ou sumiram
+    """
+    return variacao_contas(df_agregado_anterior, df_agregado_novo).index
+
+
+def variacao_contas(df_agregado_anterior, df_agregado_novo):
+    """
+    Variação de saldo e de registros das contas que mudaram entre duas revisões do balancete
+    (contas que apareceram ou sumiram contam a partir de / até zero)
+    Retorna: DataFrame indexado pela conta normalizada com 'saldo' e 'registros', no formato de agregar_balancete
+    """
+    uniao = df_agregado_anterior.index.union(df_agregado_novo.index, sort=False)
+    anterior = df_agregado_anterior.reindex(uniao, fill_value=0)
+    novo = df_agregado_novo.reindex(uniao, fill_value=0)
+
+    variacao = (novo[['saldo', 'registros']] - anterior[['saldo', 'registros']]).astype(np.int64)
+    presente_antes = uniao.isin(df_agregado_anterior.index)
+    presente_agora = uniao.isin(df_agregado_novo.index)
+    alteradas = (variacao['saldo'] != 0).to_numpy() | (variacao['registros'] != 0).to_numpy() | (presente_antes != presente_agora)
+    return variacao[alteradas]
+
+
+def conciliar_com_estado(df_carteira, df_balancete, df_mapeamento, estado_anterior=None, mapeamento_compilado=None):
+    """
+    Realiza a conciliação e devolve também o estado usado para reconciliações incrementais
+    Com estado_anterior (gerado com a mesma carteira e o mesmo mapeamento), o balancete novo ainda é
+    agregado por conta (uma passada pelas linhas, inevitável para um arquivo novo), mas o mapeamento não é
+    reagrupado, os totais dos prefixos saem dos anteriores mais a variação das contas que mudaram (sem
+    reordenar o balancete) e só os ativos mapeados para essas contas são recalculados
+    Com mapeamento_compilado (ver compilar_mapeamento), df_mapeamento não é reagrupado
+    Retorna: (df_resultado, estado)
+    """
+    usar_compilado = mapeamento_compilado_valido(mapeamento_compilado)
+    colunas = _detectar_colunas(df_balancete, None if usar_compilado else df_mapeamento)
+    conta_map_col, ativo_map_col, conta_bal_col, saldo_bal_col = colunas
+
+    df_agregado = agregar_balancete(df_balancete, conta_bal_col, saldo_bal_col)
+
+    if estado_anterior is not None and estado_anterior['colunas'] == colunas:
+        pares = estado_anterior['pares']
+        totais_prefixos = estado_anterior.get('totais_prefixos')
+        if totais_prefixos is None:
+            totais_prefixos = calcular_totais_prefixos(estado_anterior['agregado'], pares.loc[pares['prefixo'], 'chave'])
+
+        # Ativos mapeados para alguma conta alterada (diretamente ou dentro de um prefixo)
+        variacao = variacao_contas(estado_anterior['agregado'], df_agregado)
+        afetados = (~pares['prefixo'] & pares['chave'].isin(variacao.index)).to_numpy()
+        if len(totais_prefixos) > 0 and len(variacao) > 0:
+            # Só a variação das contas alteradas é indexada e somada aos totais anteriores
+            indice_variacao = indexar_prefixos(variacao)
+            saldos, registros = totais_por_prefixo(indice_variacao, totais_prefixos.index)
+            totais_prefixos = pd.DataFrame({
+                'saldo': totais_prefixos['saldo'].to_numpy() + saldos,
+                'registros': totais_prefixos['registros'].to_numpy() + registros
+            }, index=totais_prefixos.index)
+            inicio, fim = _intervalo_prefixos(indice_variacao['chaves'], pares['chave'])
+            afetados = afetados | (pares['prefixo'].to_numpy() & (fim > inicio))
+        ativos_afetados = pares.loc[afetados, 'ativo'].unique()
+        linhas = df_carteira['ativo'].isin(ativos_afetados).to_numpy()
+
+        df_resultado = estado_anterior['resultado'].copy()
+        if linhas.any():
+            df_parcial = _montar_resultado(
+                df_carteira[linhas],
+                pares[pares['ativo'].isin(ativos_afetados)],
+                df_agregado,
+                totais_prefixos
+            )
+            posicoes = np.flatnonzero(linhas)
+            for col in COLUNAS_RESULTADO:
+                df_resultado.loc[posicoes, col] = df_parcial[col].to_numpy()
+
+        recalculados = int(linhas.sum())
+    else:
+        if usar_compilado:
+            pares = pares_do_mapeamento_compilado(mapeamento_compilado)
+        else:
+            pares = agrupar_mapeamento(df_mapeamento, conta_map_col, ativo_map_col)
+        totais_prefixos = calcular_totais_prefixos(df_agregado, pares.loc[pares['prefixo'], 'chave'])
+        df_resultado = _montar_resultado(df_carteira, pares, df_agregado, totais_prefixos)
+        recalculados = len(df_resultado)
+
+    estado = {
+        'colunas': colunas,
+        'pares': pares,
+        'agregado': df_agregado,
+        'totais_prefixos': totais_prefixos,
+        'resultado': df_resultado,
+        'recalculados': recalculados
+    }
+
+    return df_resultado, estado
+
+
+def conciliar_dataframes(df_carteira, df_balancete, df_mapeamento, mapeamento_compilado=None):
+    """
+    Detecta as colunas necessárias e realiza a conciliação
+    Lança ErroConciliacao quando o mapeamento ou o balancete não têm as colunas necessárias
+    Retorna: (df_resultado, conta_col_balancete, saldo_col_balancete)
+    """
+    df_resultado, estado = conciliar_com_estado(
+        df_carteira,
+        df_balancete,
+        df_mapeamento,
+        mapeamento_compilado=mapeamento_compilado
+    )
+    _, _, conta_bal_col, saldo_bal_col = estado['colunas']
+
+    return df_resultado, conta_bal_col, saldo_bal_col
+
+
+def comparar_status(df_resultado_anterior, df_resultado_novo):
+    """
+    Compara dois resultados da mesma carteira e retorna as linhas cujo status mudou
+    """
+    mudou = df_resultado_anterior['Status'].to_numpy() != df_resultado_novo['Status'].to_numpy()
+
+    return pd.DataFrame({
+        'Ativo Carteira': df_resultado_novo['Ativo Carteira'].to_numpy()[mudou],
+        'Status Anterior': df_resultado_anterior['Status'].to_numpy()[mudou],
+        'Status Atual': df_resultado_novo['Status'].to_numpy()[mudou],
+        'Diferença Anterior': df_resultado_anterior['Diferença'].to_numpy()[mudou],
+        'Diferença Atual': df_resultado_novo['Diferença'].to_numpy()[mudou]
+    })
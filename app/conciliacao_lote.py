@@ -0,0 +1,210 @@
+"""
+Conciliação em lote (sem Streamlit) de vários fundos em paralelo
+
+Uso:
+    python conciliacao_lote.py DIRETORIO [FUNDO ...] [--todos] [--saida DIR] [--processos N] [--mapeamento NOME]
+
+Cada fundo é identificado pelo ID, slug, CNPJ (government_id) ou nome. No DIRETORIO, os arquivos
+de cada fundo devem se chamar '<identificador>_carteira.csv' e '<identificador>_balancete.csv',
+onde o identificador é qualquer um dos anteriores.
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from conciliacao import conciliar_dataframes
+from database import get_funds_list, get_fund_by_identifier, get_mappings_by_fund, load_compiled_mapping_from_db
+from leitura import ler_balancete, ler_carteira
+
+ARQUIVO_RESUMO = "resumo_conciliacao.csv"
+
+
+def _identificadores_do_fundo(fund_info):
+    """
+    Lista os identificadores aceitos no nome dos arquivos de um fundo
+    """
+    candidatos = [fund_info['slug'], fund_info['government_id'], fund_info['id'], fund_info['name']]
+    return [str(c).strip() for c in candidatos if c is not None and str(c).strip() != '']
+
+
+def _localizar_arquivo(diretorio, fund_info, tipo):
+    """
+    Procura o arquivo '<identificador>_<tipo>.csv' do fundo no diretório
+    """
+    for identificador in _identificadores_do_fundo(fund_info):
+        caminho = os.path.join(diretorio, f"{identificador}_{tipo}.csv")
+        if os.path.exists(caminho):
+            return caminho
+    return None
+
+
+def _nome_arquivo_resultado(fund_info):
+    """
+    Gera um nome de arquivo seguro para o resultado do fundo
+    """
+    base = fund_info['slug'] or f"fundo_{fund_info['id']}"
+    return re.sub(r'[^A-Za-z0-9_-]', '_', str(base)) + "_conciliacao.csv"
+
+
+def _carregar_mapeamento(fund_info, nome_mapeamento=None):
+    """
+    Carrega o mapeamento compilado do fundo pelo nome ou, se não informado, o mais recente
+    """
+    mappings = get_mappings_by_fund(fund_info['id'])
+    if nome_mapeamento:
+        mappings = [m for m in mappings if m['name'] == nome_mapeamento]
+
+    if not mappings:
+        return None, None
+
+    # get_mappings_by_fund já retorna do mais recente para o mais antigo
+    return load_compiled_mapping_from_db(mappings[0]['id'])
+
+
+def _conciliar_fundo(tarefa):
+    """
+    Lê os arquivos de um fundo, concilia e grava o resultado (executado nos processos do pool)
+    Nunca lança exceção: erros são devolvidos no resumo
+    """
+    resumo = {
+        'Fundo': tarefa['fundo'],
+        'ID': tarefa['fund_id'],
+        'Mapeamento': tarefa['mapeamento'],
+        'Arquivo Resultado': None,
+        'Total de Itens': 0,
+        'Conciliados': 0,
+        'Divergentes': 0,
+        'Não Mapeados': 0,
+        'Tempo (s)': 0.0,
+        'Erro': None
+    }
+    inicio = time.perf_counter()
+
+    try:
+        with open(tarefa['carteira'], 'rb') as carteira_file:
+            df_carteira, _ = ler_carteira(carteira_file)
+
+        with open(tarefa['balancete'], 'rb') as balancete_file:
+            df_balancete = ler_balancete(balancete_file)
+
+        df_resultado, _, _ = conciliar_dataframes(
+            df_carteira,
+            df_balancete,
+            None,
+            mapeamento_compilado=tarefa['mapeamento_compilado']
+        )
+
+        df_resultado.to_csv(tarefa['saida'], sep=';', decimal=',', index=False, encoding='iso-8859-15', errors='replace')
+
+        resumo['Arquivo Resultado'] = tarefa['saida']
+        resumo['Total de Itens'] = len(df_resultado)
+        resumo['Conciliados'] = int((df_resultado['Status'] == 'CONCILIADO').sum())
+        resumo['Divergentes'] = int((df_resultado['Status'] == 'DIVERGENTE').sum())
+        resumo['Não Mapeados'] = int((df_resultado['Status'] == 'NÃO MAPEADO').sum())
+
+    except Exception as e:
+        resumo['Erro'] = str(e)
+
+    resumo['Tempo (s)'] = round(time.perf_counter() - inicio, 3)
+    return resumo
+
+
+def preparar_tarefas(diretorio, identificadores, saida, nome_mapeamento=None):
+    """
+    Resolve os fundos, localiza os arquivos e carrega os mapeamentos do banco (no processo principal)
+    Retorna: (tarefas, erros) - erros já no formato do resumo
+    """
+    tarefas = []
+    erros = []
+    fundos_vistos = set()
+
+    for identificador in identificadores:
+        fund_info = get_fund_by_identifier(identificador)
+        if fund_info is None:
+            erros.append({'Fundo': identificador, 'Erro': "Fundo não encontrado ou inativo"})
+            continue
+
+        # Identificadores diferentes podem apontar para o mesmo fundo
+        if fund_info['id'] in fundos_vistos:
+            continue
+        fundos_vistos.add(fund_info['id'])
+
+        carteira = _localizar_arquivo(diretorio, fund_info, 'carteira')
+        balancete = _localizar_arquivo(diretorio, fund_info, 'balancete')
+        if carteira is None or balancete is None:
+            faltando = [tipo for tipo, caminho in (('carteira', carteira), ('balancete', balancete)) if caminho is None]
+            erros.append({'Fundo': fund_info['name'], 'ID': fund_info['id'], 'Erro': f"Arquivo(s) não encontrado(s): {', '.join(faltando)}"})
+            continue
+
+        mapeamento_compilado, mapping_name = _carregar_mapeamento(fund_info, nome_mapeamento)
+        if mapeamento_compilado is None:
+            erros.append({'Fundo': fund_info['name'], 'ID': fund_info['id'], 'Erro': "Nenhum mapeamento salvo para o fundo"})
+            continue
+
+        tarefas.append({
+            'fundo': fund_info['name'],
+            'fund_id': fund_info['id'],
+            'mapeamento': mapping_name,
+            'carteira': carteira,
+            'balancete': balancete,
+            'mapeamento_compilado': mapeamento_compilado,
+            'saida': os.path.join(saida, _nome_arquivo_resultado(fund_info))
+        })
+
+    return tarefas, erros
+
+
+def conciliar_lote(diretorio, identificadores, saida, processos=None, nome_mapeamento=None):
+    """
+    Concilia vários fundos em paralelo e grava um arquivo por fundo mais o resumo
+    Os processos são iniciados com 'spawn': a consulta aos fundos já iniciou a escuta de alterações
+    (thread) e abriu conexões do pool, que um fork copiaria para os processos
+    Retorna: DataFrame do resumo
+    """
+    os.makedirs(saida, exist_ok=True)
+
+    tarefas, resumos = preparar_tarefas(diretorio, identificadores, saida, nome_mapeamento)
+    print(f"📋 {len(tarefas)} fundo(s) prontos para conciliar, {len(resumos)} com problema(s)")
+
+    if tarefas:
+        with ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futuros = [executor.submit(_conciliar_fundo, tarefa) for tarefa in tarefas]
+            for futuro in as_completed(futuros):
+                resumo = futuro.result()
+                if resumo['Erro']:
+                    print(f"❌ {resumo['Fundo']}: {resumo['Erro']}")
+                else:
+                    print(f"✅ {resumo['Fundo']}: {resumo['Total de Itens']} itens em {resumo['Tempo (s)']}s")
+                resumos.append(resumo)
+
+    df_resumo = pd.DataFrame(resumos)
+    df_resumo.to_csv(os.path.join(saida, ARQUIVO_RESUMO), sep=';', decimal=',', index=False, encoding='iso-8859-15', errors='replace')
+
+    return df_resumo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Conciliação em lote de vários fundos")
+    parser.add_argument("diretorio", help="Diretório com os arquivos <identificador>_carteira.csv e <identificador>_balancete.csv")
+    parser.add_argument("fundos", nargs="*", help="Identificadores dos fundos (ID, slug, CNPJ ou nome)")
+    parser.add_argument("--todos", action="store_true", help="Conciliar todos os fundos ativos")
+    parser.add_argument("--saida", default=None, help="Diretório de saída (padrão: <diretorio>/resultados)")
+    parser.add_argument("--processos", type=int, default=None, help="Quantidade de processos (padrão: núcleos da CPU)")
+    parser.add_argument("--mapeamento", default=None, help="Nome do mapeamento salvo (padrão: o mais recente de cada fundo)")
+    args = parser.parse_args()
+
+    identificadores = get_funds_list() if args.todos else args.fundos
+    if not identificadores:
+        parser.error("Informe ao menos um fundo ou use --todos")
+
+    saida = args.saida or os.path.join(args.diretorio, "resultados")
+
+    print("🚀 Iniciando conciliação em lote...")
+    inicio = time.perf_counter()
+    df_resumo = conciliar_lote(args.diretorio, identificadores, saida, args.processos, args.mapeamento)
+    print(f"🎉 {len(df_resumo)} fundo(s) processados em {time.perf_counter() - inicio:.1f}s. Resumo em {os.path.join(saida, ARQUIVO_RESUMO)}")
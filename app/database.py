@@ -1,10 +1,17 @@
+import copy
 import os
+import select
+import threading
+import time
+from datetime import datetime
 import pandas as pd
 import json  
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 import streamlit as st
 from typing import Optional
 
+from conciliacao import VERSAO_MAPEAMENTO_COMPILADO, ErroConciliacao, agrupar_mapeamento, detectar_colunas_mapeamento, mapeamento_compilado_para_dataframe, normalizar_conta
+
 def get_database_url():
     """Constrói a URL do banco de dados usando variáveis de ambiente"""
     db_host = os.getenv("DB_HOST", "postgres")
@@ -15,13 +22,218 @@ def get_database_url():
     
     return f"postgresql://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
 
+# Configuração do pool de conexões (um engine por processo, compartilhado pelas threads do Streamlit)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "sim", "yes")
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+_pool_counters = {"checkouts": 0, "new_connections": 0}
+_counters_lock = threading.Lock()
+
+def _count(counter):
+    with _counters_lock:
+        _pool_counters[counter] += 1
+
+def get_engine():
+    """
+    Retorna o engine do processo (criado na primeira chamada), com pool de conexões
+    Processos filhos (ex.: pool da conciliação em lote) criam o próprio engine em vez de
+    reutilizar as conexões herdadas do processo pai
+    """
+    global _engine, _engine_pid
+    
+    if _engine is not None and _engine_pid == os.getpid():
+        return _engine
+    
+    with _engine_lock:
+        if _engine is None or _engine_pid != os.getpid():
+            if _engine is not None:
+                # Engine herdado de outro processo: descartar sem fechar as conexões do pai
+                _engine.dispose(close=False)
+            
+            engine = create_engine(
+                get_database_url(),
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_pre_ping=DB_POOL_PRE_PING,
+                pool_recycle=DB_POOL_RECYCLE
+            )
+            event.listen(engine, "connect", lambda *args: _count("new_connections"))
+            event.listen(engine, "checkout", lambda *args: _count("checkouts"))
+            
+            with _counters_lock:
+                _pool_counters.update({"checkouts": 0, "new_connections": 0})
+            _engine, _engine_pid = engine, os.getpid()
+    
+    return _engine
+
+def get_pool_stats():
+    """
+    Contadores do pool de conexões deste processo
+    Retorna: dicionário com checkouts (conexões entregues), new_connections (conexões abertas no
+    Postgres), pool_hits (checkouts atendidos por conexões já abertas) e o status do pool
+    """
+    with _counters_lock:
+        stats = dict(_pool_counters)
+    stats["pool_hits"] = stats["checkouts"] - stats["new_connections"]
+    stats["status"] = _engine.pool.status() if _engine is not None else "Engine ainda não criado"
+    return stats
+
+# Cache de leitura dos metadados (fundos, cotas e lista de mapeamentos), compartilhado por todas as
+# sessões do processo. As entradas são invalidadas pelos avisos (NOTIFY) que os gatilhos das tabelas
+# enviam no canal abaixo; sem a escuta ativa, o cache não é usado e as consultas vão direto ao banco
+METADATA_CHANNEL = "metadata_changes"
+METADATA_TABLES = ("funds", "fund_quotas", "mappings")
+METADATA_TRIGGER = "notify_metadata_change"
+METADATA_CACHE_ENABLED = os.getenv("METADATA_CACHE", "true").lower() in ("1", "true", "sim", "yes")
+LISTENER_RETRY_SECONDS = int(os.getenv("METADATA_LISTENER_RETRY", "30"))
+
+_metadata_cache = {}
+_metadata_generation = 0
+_metadata_lock = threading.Lock()
+_listener_ready = threading.Event()
+_listener_pid = None
+_listener_lock = threading.Lock()
+_cache_counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+def invalidate_metadata_cache(table: Optional[str] = None):
+    """
+    Remove do cache as entradas que dependem da tabela (ou todas, sem tabela ou com tabela desconhecida)
+    """
+    global _metadata_generation
+    
+    with _metadata_lock:
+        _metadata_generation += 1
+        _cache_counters["invalidations"] += 1
+        if table not in METADATA_TABLES:
+            _metadata_cache.clear()
+            return
+        for key in [key for key, (tables, _) in _metadata_cache.items() if table in tables]:
+            del _metadata_cache[key]
+
+def _listen_for_changes():
+    """
+    Escuta o canal de avisos em uma conexão própria (fora do pool) e invalida o cache a cada aviso
+    Se a conexão cair, o cache é esvaziado e deixa de ser usado até a escuta voltar
+    """
+    while True:
+        connection = None
+        try:
+            # detach() não retorna a conexão: o proxy continua sendo usado (e fechado), só fora do pool
+            connection = get_engine().raw_connection()
+            connection.detach()
+            dbapi_connection = connection.driver_connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                # Sem os gatilhos (banco ainda não atualizado pelo populate_tables) nada avisaria das alterações
+                cursor.execute(
+                    "SELECT count(DISTINCT tgrelid) FROM pg_trigger WHERE tgname = %s AND NOT tgisinternal",
+                    (METADATA_TRIGGER,)
+                )
+                if cursor.fetchone()[0] < len(METADATA_TABLES):
+                    raise RuntimeError("gatilhos de aviso das tabelas de metadados não encontrados")
+                cursor.execute(f"LISTEN {METADATA_CHANNEL}")
+            
+            # Avisos perdidos antes do LISTEN: começar com o cache vazio
+            invalidate_metadata_cache()
+            _listener_ready.set()
+            
+            while True:
+                if select.select([dbapi_connection], [], [], 60) == ([], [], []):
+                    # Sem avisos: confirmar que a conexão continua viva (uma conexão perdida não avisaria nada)
+                    with dbapi_connection.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    invalidate_metadata_cache(dbapi_connection.notifies.pop(0).payload)
+                    
+        except Exception as e:
+            print(f"Escuta de alterações dos metadados interrompida: {e}")
+        finally:
+            _listener_ready.clear()
+            invalidate_metadata_cache()
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+        
+        time.sleep(LISTENER_RETRY_SECONDS)
+
+def _ensure_listener():
+    """
+    Inicia a escuta de alterações (uma por processo) na primeira leitura
+    Retorna True quando o cache pode ser usado
+    """
+    global _listener_pid
+    
+    if not METADATA_CACHE_ENABLED:
+        return False
+    
+    if _listener_pid != os.getpid():
+        with _listener_lock:
+            if _listener_pid != os.getpid():
+                # Processo filho: o cache e a escuta herdados do pai não valem aqui
+                _listener_ready.clear()
+                with _metadata_lock:
+                    _metadata_cache.clear()
+                threading.Thread(target=_listen_for_changes, name="metadata-listener", daemon=True).start()
+                _listener_pid = os.getpid()
+    
+    return _listener_ready.is_set()
+
+def _cache_lookup(key):
+    """
+    Retorna: (encontrado, valor, geração) - a geração deve ser passada a _cache_store após a consulta,
+    para que um resultado lido antes de uma invalidação não seja guardado
+    """
+    if not _ensure_listener():
+        return False, None, None
+    
+    with _metadata_lock:
+        entry = _metadata_cache.get(key)
+        _cache_counters["hits" if entry is not None else "misses"] += 1
+        generation = _metadata_generation
+    
+    if entry is not None:
+        # Cópia para que alterações feitas por quem chamou não cheguem às outras sessões
+        return True, copy.deepcopy(entry[1]), generation
+    return False, None, generation
+
+def _cache_store(key, tables, value, generation):
+    if generation is None:
+        return
+    with _metadata_lock:
+        if generation == _metadata_generation and _listener_ready.is_set():
+            _metadata_cache[key] = (tables, copy.deepcopy(value))
+
+def get_metadata_cache_stats():
+    """
+    Contadores do cache de metadados deste processo
+    Retorna: dicionário com hits, misses, invalidations, entries e listening (escuta ativa)
+    """
+    with _metadata_lock:
+        stats = dict(_cache_counters)
+        stats["entries"] = len(_metadata_cache)
+    stats["listening"] = _listener_ready.is_set()
+    return stats
+
 def get_funds_list():
     """
     Busca a lista de fundos ativos do banco de dados
     Retorna uma lista com os nomes dos fundos
     """
+    cache_key = ("funds_list",)
+    found, cached, generation = _cache_lookup(cache_key)
+    if found:
+        return cached
+    
     try:
-        engine = create_engine(get_database_url())
+        engine = get_engine()
         
         query = """
         SELECT DISTINCT name 
@@ -34,6 +246,7 @@ def get_funds_list():
             result = connection.execute(text(query))
             funds = [row[0] for row in result.fetchall()]
             
+        _cache_store(cache_key, ("funds",), funds, generation)
         return funds
         
     except Exception as e:
@@ -44,8 +257,13 @@ def get_fund_info(fund_name: str):
     """
     Busca informações detalhadas de um fundo específico
     """
+    cache_key = ("fund_info", fund_name)
+    found, cached, generation = _cache_lookup(cache_key)
+    if found:
+        return cached
+    
     try:
-        engine = create_engine(get_database_url())
+        engine = get_engine()
         
         query = """
         SELECT id, name, slug, government_id, is_active 
@@ -57,78 +275,277 @@ def get_fund_info(fund_name: str):
             result = connection.execute(text(query), {"fund_name": fund_name})
             fund_data = result.fetchone()
             
+        fund = None
         if fund_data:
-            return {
+            fund = {
                 "id": fund_data[0],
                 "name": fund_data[1],
                 "slug": fund_data[2],
                 "government_id": fund_data[3],
                 "is_active": fund_data[4]
             }
-        else:
-            return None
+        
+        _cache_store(cache_key, ("funds",), fund, generation)
+        return fund
             
     except Exception as e:
         print(f"Erro ao buscar informações do fundo: {e}")
         return None
 
+def get_fund_details(fund_name: str):
+    """
+    Busca um fundo ativo pelo nome junto com suas cotas e os cabeçalhos dos seus mapeamentos,
+    em uma única consulta
+    Retorna: {"fund", "quotas", "mappings"} no formato de get_fund_info, get_fund_quotas e
+    get_mappings_by_fund, ou None se o fundo não for encontrado
+    """
+    cache_key = ("fund_details", fund_name)
+    found, cached, generation = _cache_lookup(cache_key)
+    if found:
+        return cached
+    
+    try:
+        engine = get_engine()
+        
+        # Cotas e mapeamentos agregados em JSON (created_at com formato fixo, convertido de volta abaixo)
+        query = """
+        SELECT f.id, f.name, f.slug, f.government_id, f.is_active,
+            COALESCE((
+                SELECT json_agg(json_build_array(q.id, q.type, q.quota_name, q.wallet_external_id)
+                                ORDER BY q.type, q.quota_name)
+                FROM public.fund_quotas q
+                WHERE q.fund_id = f.id AND q.is_active
+            ), '[]'::json) AS quotas,
+            COALESCE((
+                SELECT json_agg(json_build_object(
+                           'id', m.id, 'name', m.name, 'filename', m.filename, 'sheet_name', m.sheet_name,
+                           'created_at', to_char(m.created_at, 'YYYY-MM-DD"T"HH24:MI:SS.US'))
+                       ORDER BY m.created_at DESC)
+                FROM public.mappings m
+                WHERE m.fund_id = f.id
+            ), '[]'::json) AS mappings
+        FROM public.funds f
+        WHERE f.name = :fund_name AND f.is_active = true
+        """
+        
+        with engine.begin() as connection:
+            result = connection.execute(text(query), {"fund_name": fund_name})
+            fund_data = result.fetchone()
+            
+        details = None
+        if fund_data:
+            quotas = fund_data[5]
+            mappings = fund_data[6]
+            if isinstance(quotas, str):
+                quotas = json.loads(quotas)
+            if isinstance(mappings, str):
+                mappings = json.loads(mappings)
+            
+            fund = {
+                "id": fund_data[0],
+                "name": fund_data[1],
+                "slug": fund_data[2],
+                "government_id": fund_data[3],
+                "is_active": fund_data[4]
+            }
+            quotas = [tuple(quota) for quota in quotas]
+            for mapping in mappings:
+                mapping["created_at"] = datetime.fromisoformat(mapping["created_at"])
+            details = {"fund": fund, "quotas": quotas, "mappings": mappings}
+            
+            # As consultas individuais do mesmo fundo também passam a vir do cache
+            _cache_store(("fund_info", fund_name), ("funds",), fund, generation)
+            _cache_store(("fund_quotas", fund["id"]), ("fund_quotas",), quotas, generation)
+            _cache_store(("mappings_by_fund", fund["id"]), ("mappings",), mappings, generation)
+        
+        _cache_store(cache_key, METADATA_TABLES, details, generation)
+        return details
+        
+    except Exception as e:
+        print(f"Erro ao buscar detalhes do fundo: {e}")
+        return None
+
+def get_fund_by_identifier(identifier: str):
+    """
+    Busca um fundo ativo pelo ID, slug, CNPJ (government_id) ou nome
+    """
+    cache_key = ("fund_by_identifier", str(identifier).strip())
+    found, cached, generation = _cache_lookup(cache_key)
+    if found:
+        return cached
+    
+    try:
+        engine = get_engine()
+        
+        query = """
+        SELECT id, name, slug, government_id, is_active 
+        FROM public.funds 
+        WHERE is_active = true
+          AND (CAST(id AS text) = :identifier OR slug = :identifier 
+               OR government_id = :identifier OR name = :identifier)
+        ORDER BY id
+        LIMIT 1
+        """
+        
+        with engine.begin() as connection:
+            result = connection.execute(text(query), {"identifier": str(identifier).strip()})
+            fund_data = result.fetchone()
+            
+        fund = None
+        if fund_data:
+            fund = {
+                "id": fund_data[0],
+                "name": fund_data[1],
+                "slug": fund_data[2],
+                "government_id": fund_data[3],
+                "is_active": fund_data[4]
+            }
+        
+        _cache_store(cache_key, ("funds",), fund, generation)
+        return fund
+            
+    except Exception as e:
+        print(f"Erro ao buscar fundo pelo identificador: {e}")
+        return None
+
+
+def get_active_funds():
+    """
+    Busca todos os fundos ativos com ID, nome, slug e CNPJ (government_id)
+    Retorna uma lista de dicionários ordenada pelo nome
+    """
+    cache_key = ("active_funds",)
+    found, cached, generation = _cache_lookup(cache_key)
+    if found:
+        return cached
+    
+    try:
+        engine = get_engine()
+        
+        query = """
+        SELECT id, name, slug, government_id, is_active 
+        FROM public.funds 
+        WHERE is_active = true 
+        ORDER BY name
+        """
+        
+        with engine.begin() as connection:
+            result = connection.execute(text(query))
+            funds = [
+                {
+                    "id": row[0],
+                    "name": row[1],
+                    "slug": row[2],
+                    "government_id": row[3],
+                    "is_active": row[4]
+                }
+                for row in result.fetchall()
+            ]
+            
+        _cache_store(cache_key, ("funds",), funds, generation)
+        return funds
+            
+    except Exception as e:
+        print(f"Erro ao buscar fundos ativos: {e}")
+        return []
+
 
 def get_fund_quotas(fund_id: int):
     """
-    Busca todas as cotas de um fundo específico
+    Busca todas as cotas ativas de um fundo específico
+    Retorna uma lista de tuplas (id, type, quota_name, wallet_external_id)
     """
+    cache_key = ("fund_quotas", fund_id)
+    found, cached, generation = _cache_lookup(cache_key)
+    if found:
+        return cached
+    
     try:
-        engine = create_engine(get_database_url())
+        engine = get_engine()
         
         query = """
         SELECT id, type, quota_name, wallet_external_id 
         FROM public.fund_quotas 
-        WHERE fund_id = :fund_id
+        WHERE fund_id = :fund_id AND is_active = true
         ORDER BY type, quota_name
         """
         
         with engine.begin() as connection:
             result = connection.execute(text(query), {"fund_id": fund_id})
-            quotas = result.fetchall()
+            quotas = [tuple(row) for row in result.fetchall()]
             
+        _cache_store(cache_key, ("fund_quotas",), quotas, generation)
         return quotas
         
     except Exception as e:
         print(f"Erro ao buscar cotas do fundo: {e}")
         return []
     
+def _mapping_entries_params(mapping_id: int, mapping_df: pd.DataFrame):
+    """
+    Pares ativo -> conta do mapeamento (na ordem de precedência, com a conta normalizada) como arrays
+    para a inserção em mapping_entries com um único comando
+    Lança ErroConciliacao quando o mapeamento não tem as colunas necessárias
+    """
+    conta_col, ativo_col = detectar_colunas_mapeamento(mapping_df)
+    if conta_col is None or ativo_col is None:
+        raise ErroConciliacao(
+            "❌ Mapeamento não contém as colunas necessárias:",
+            "Colunas necessárias: 'Conta' e 'Ativo Carteira'"
+        )
+    
+    pares = agrupar_mapeamento(mapping_df, conta_col, ativo_col)
+    return {
+        "mapping_id": mapping_id,
+        "precedences": [int(ordem) for ordem in pares['ordem']],
+        "ativos": [str(ativo) for ativo in pares['ativo']],
+        "contas": [str(conta) for conta in pares['conta']],
+        "chaves": [str(chave) for chave in pares['chave']],
+        "prefixos": [bool(prefixo) for prefixo in pares['prefixo']]
+    }
+
+def _replace_mapping_entries(connection, mapping_id: int, mapping_df: pd.DataFrame):
+    """
+    Substitui as linhas do mapeamento em mapping_entries (na transação da conexão)
+    Retorna a quantidade de pares gravados
+    """
+    params = _mapping_entries_params(mapping_id, mapping_df)
+    
+    connection.execute(text("DELETE FROM public.mapping_entries WHERE mapping_id = :mapping_id"), {"mapping_id": mapping_id})
+    connection.execute(text("""
+    INSERT INTO public.mapping_entries (mapping_id, precedence, ativo, conta, chave, prefixo)
+    SELECT :mapping_id, e.precedence, e.ativo, e.conta, e.chave, e.prefixo
+    FROM unnest(
+        CAST(:precedences AS integer[]), CAST(:ativos AS text[]), CAST(:contas AS text[]),
+        CAST(:chaves AS text[]), CAST(:prefixos AS boolean[])
+    ) AS e(precedence, ativo, conta, chave, prefixo)
+    """), params)
+    connection.execute(
+        text("UPDATE public.mappings SET entries_version = :entries_version WHERE id = :mapping_id"),
+        {"entries_version": VERSAO_MAPEAMENTO_COMPILADO, "mapping_id": mapping_id}
+    )
+    
+    return len(params["precedences"])
+
 def save_mapping_to_db(fund_id: int, mapping_df: pd.DataFrame, name: str, filename: Optional[str] = None, sheet_name: Optional[str] = None):
     """
     Salva um mapeamento no banco de dados
+    Só os pares ativo -> conta usados na conciliação são gravados (em mapping_entries), na mesma transação
     """
     try:
-        engine = create_engine(get_database_url())
+        engine = get_engine()
         
-        # Converter DataFrame para JSON de forma mais robusta
-        try:
-            # Limpar dados problemáticos
-            df_clean = mapping_df.copy()
-            
-            # Substituir NaN por None para melhor serialização JSON
-            df_clean = df_clean.where(pd.notna(df_clean), None)
-            
-            # Converter para JSON
-            mapping_json = df_clean.to_json(orient='records', force_ascii=False, date_format='iso')
-            
-            print(f"DEBUG: Salvando mapeamento '{name}' para fund_id {fund_id}")
-            print(f"DEBUG: DataFrame shape: {mapping_df.shape}")
-            print(f"DEBUG: JSON length: {len(mapping_json)}")
-            
-        except Exception as df_error:
-            print(f"Erro ao converter DataFrame para JSON: {df_error}")
-            return None
+        print(f"DEBUG: Salvando mapeamento '{name}' para fund_id {fund_id}")
+        print(f"DEBUG: DataFrame shape: {mapping_df.shape}")
         
+        # Os JSONs antigos (planilha inteira e forma compilada) deixam de ser gravados
         query = """
-        INSERT INTO public.mappings (fund_id, mapping_data, name, filename, sheet_name)
-        VALUES (:fund_id, :mapping_data, :name, :filename, :sheet_name)
+        INSERT INTO public.mappings (fund_id, mapping_data, mapping_compiled, name, filename, sheet_name)
+        VALUES (:fund_id, NULL, NULL, :name, :filename, :sheet_name)
         ON CONFLICT (name, fund_id) 
         DO UPDATE SET 
-            mapping_data = EXCLUDED.mapping_data,
+            mapping_data = NULL,
+            mapping_compiled = NULL,
             filename = EXCLUDED.filename,
             sheet_name = EXCLUDED.sheet_name,
             updated_at = CURRENT_TIMESTAMP
@@ -138,15 +555,16 @@ def save_mapping_to_db(fund_id: int, mapping_df: pd.DataFrame, name: str, filena
         with engine.begin() as connection:
             result = connection.execute(text(query), {
                 "fund_id": fund_id,
-                "mapping_data": mapping_json,
                 "name": name,
                 "filename": filename,
                 "sheet_name": sheet_name
             })
-            row = result.fetchone()
-            mapping_id = row[0] if row else None
+            mapping_id = result.fetchone()[0]
+            entries = _replace_mapping_entries(connection, mapping_id, mapping_df)
             
-        print(f"DEBUG: Mapeamento salvo com ID: {mapping_id}")
+        # O aviso do gatilho também chega, mas esta sessão já vê a alteração no próximo rerun
+        invalidate_metadata_cache("mappings")
+        print(f"DEBUG: Mapeamento salvo com ID: {mapping_id} ({entries} pares)")
         return mapping_id
         
     except Exception as e:
@@ -159,8 +577,13 @@ def get_mappings_by_fund(fund_id: int):
     """
     Busca todos os mapeamentos de um fundo específico
     """
+    cache_key = ("mappings_by_fund", fund_id)
+    found, cached, generation = _cache_lookup(cache_key)
+    if found:
+        return cached
+    
     try:
-        engine = create_engine(get_database_url())
+        engine = get_engine()
         
         query = """
         SELECT id, name, filename, sheet_name, created_at 
@@ -173,72 +596,192 @@ def get_mappings_by_fund(fund_id: int):
             result = connection.execute(text(query), {"fund_id": fund_id})
             mappings = result.fetchall()
             
-        return [{"id": row[0], "name": row[1], "filename": row[2], 
-                "sheet_name": row[3], "created_at": row[4]} for row in mappings]
+        mappings = [{"id": row[0], "name": row[1], "filename": row[2], 
+                     "sheet_name": row[3], "created_at": row[4]} for row in mappings]
+        _cache_store(cache_key, ("mappings",), mappings, generation)
+        return mappings
         
     except Exception as e:
         print(f"Erro ao buscar mapeamentos do fundo: {e}")
         return []
 
+def _compiled_from_entries(rows):
+    """
+    Monta o mapeamento compilado a partir das linhas de mapping_entries (na ordem de precedência)
+    """
+    ativos = {}
+    for ativo, conta, chave, prefixo in rows:
+        ativos.setdefault(ativo, []).append([conta, chave, bool(prefixo)])
+    
+    return {'versao': VERSAO_MAPEAMENTO_COMPILADO, 'ativos': ativos}
+
+def _select_mapping_entries(connection, mapping_id: int):
+    return connection.execute(text("""
+    SELECT ativo, conta, chave, prefixo 
+    FROM public.mapping_entries 
+    WHERE mapping_id = :mapping_id
+    ORDER BY precedence
+    """), {"mapping_id": mapping_id}).fetchall()
+
+def _legacy_mapping_dataframe(mapping_json):
+    """
+    Converte o JSON da planilha inteira (mapeamentos salvos antes de mapping_entries) em DataFrame
+    """
+    mapping_data = json.loads(mapping_json) if isinstance(mapping_json, str) else mapping_json
+    
+    if isinstance(mapping_data, list) and len(mapping_data) > 0:
+        return pd.DataFrame(mapping_data)
+    if isinstance(mapping_data, dict):
+        return pd.DataFrame([mapping_data])
+    raise ValueError(f"Formato de dados inesperado: {type(mapping_data)}")
+
+def _outdated_mapping_dataframe(connection, mapping_id: int, entries_version):
+    """
+    Planilha 'Conta'/'Ativo Carteira' de um mapeamento ainda não convertido para a versão atual de
+    mapping_entries: do JSON da planilha (salvo antes da tabela) ou das linhas gravadas em versão
+    antiga da normalização das contas
+    """
+    if entries_version is None:
+        mapping_json = connection.execute(
+            text("SELECT mapping_data FROM public.mappings WHERE id = :mapping_id"), {"mapping_id": mapping_id}
+        ).scalar()
+        return _legacy_mapping_dataframe(mapping_json)
+    
+    return mapeamento_compilado_para_dataframe(_compiled_from_entries(_select_mapping_entries(connection, mapping_id)))
+
+def _load_mapping_entries(connection, mapping_id: int):
+    """
+    Lê os pares do mapeamento na ordem de precedência (somente leitura)
+    Mapeamentos ainda não convertidos por migrate_mapping_entries (populate_tables) são convertidos
+    em memória a cada leitura, sem gravar nada
+    Retorna: (linhas (ativo, conta, chave, prefixo), name) ou (None, None) se o mapeamento não existir
+    """
+    mapping_row = connection.execute(
+        text("SELECT name, entries_version FROM public.mappings WHERE id = :mapping_id"),
+        {"mapping_id": mapping_id}
+    ).fetchone()
+    
+    if not mapping_row:
+        return None, None
+    
+    name, entries_version = mapping_row
+    if entries_version != VERSAO_MAPEAMENTO_COMPILADO:
+        print(f"Mapeamento '{name}' (ID {mapping_id}) convertido em memória; execute o populate_tables.py para gravar a conversão")
+        params = _mapping_entries_params(mapping_id, _outdated_mapping_dataframe(connection, mapping_id, entries_version))
+        rows = sorted(zip(params["precedences"], params["ativos"], params["contas"], params["chaves"], params["prefixos"]))
+        return [row[1:] for row in rows], name
+    
+    return _select_mapping_entries(connection, mapping_id), name
+
+def migrate_mapping_entries(engine):
+    """
+    Grava em mapping_entries os mapeamentos salvos antes da tabela ou em versão antiga da normalização
+    das contas, um mapeamento por transação (executado pelo populate_tables)
+    Retorna a quantidade de mapeamentos convertidos
+    """
+    with engine.begin() as connection:
+        pending = connection.execute(
+            text("SELECT id, name, entries_version FROM public.mappings WHERE entries_version IS DISTINCT FROM :version ORDER BY id"),
+            {"version": VERSAO_MAPEAMENTO_COMPILADO}
+        ).fetchall()
+    
+    migrated = 0
+    for mapping_id, name, entries_version in pending:
+        try:
+            with engine.begin() as connection:
+                mapping_df = _outdated_mapping_dataframe(connection, mapping_id, entries_version)
+                _replace_mapping_entries(connection, mapping_id, mapping_df)
+            migrated += 1
+        except Exception as e:
+            print(f"⚠️ Mapeamento '{name}' (ID {mapping_id}) não convertido: {e}")
+    
+    return migrated
+
 def load_mapping_from_db(mapping_id: int):
     """
     Carrega um mapeamento específico do banco de dados
+    Retorna: (DataFrame 'Conta'/'Ativo Carteira' na ordem do arquivo original, name) ou (None, None)
+    """
+    mapeamento_compilado, name = load_compiled_mapping_from_db(mapping_id)
+    if mapeamento_compilado is None:
+        return None, None
+    
+    return mapeamento_compilado_para_dataframe(mapeamento_compilado), name
+
+def load_compiled_mapping_from_db(mapping_id: int):
+    """
+    Carrega a forma compilada de um mapeamento (pronta para a conciliação, sem reagrupar)
+    Retorna: (mapeamento_compilado, name) ou (None, None)
+    """
+    try:
+        engine = get_engine()
+        
+        with engine.connect() as connection:
+            rows, name = _load_mapping_entries(connection, mapping_id)
+            
+        if rows is None:
+            print(f"Mapeamento com ID {mapping_id} não encontrado")
+            return None, None
+        
+        return _compiled_from_entries(rows), name
+        
+    except Exception as e:
+        print(f"Erro ao carregar mapeamento compilado do banco: {e}")
+        return None, None
+
+def get_funds_mapping_account(conta: str):
+    """
+    Busca os mapeamentos (de todos os fundos) que levam uma conta do balancete a algum ativo,
+    pela conta exata ou por um prefixo que a contenha (ex.: '112*')
+    Retorna uma lista de dicionários com fund_id, fund_name, mapping_id, mapping_name, ativo e conta
+    (como escrita no mapeamento), ordenada pelo nome do fundo
     """
     try:
-        engine = create_engine(get_database_url())
+        engine = get_engine()
+        
+        # A conta é normalizada como no balancete e expandida nos seus prefixos ('', '1', '11', '112', ...),
+        # para que as duas partes do UNION busquem por igualdade nos índices parciais de chave
+        chave = normalizar_conta(conta)
+        prefixos = [chave[:tamanho] for tamanho in range(len(chave) + 1)]
         
         query = """
-        SELECT mapping_data, name 
-        FROM public.mappings 
-        WHERE id = :mapping_id
+        SELECT f.id, f.name, m.id, m.name, e.ativo, e.conta
+        FROM (
+            SELECT mapping_id, ativo, conta FROM public.mapping_entries
+            WHERE chave = :chave AND NOT prefixo
+            UNION ALL
+            SELECT mapping_id, ativo, conta FROM public.mapping_entries
+            WHERE prefixo AND chave = ANY(:prefixos)
+        ) e
+        JOIN public.mappings m ON m.id = e.mapping_id
+        JOIN public.funds f ON f.id = m.fund_id
+        ORDER BY f.name, m.name, e.ativo
         """
         
         with engine.begin() as connection:
-            result = connection.execute(text(query), {"mapping_id": mapping_id})
-            mapping_row = result.fetchone()
-            
-        if mapping_row:
-            mapping_json = mapping_row[0]
-            name = mapping_row[1]
-            
-            try:
-                # Converter JSON de volta para DataFrame
-                if isinstance(mapping_json, str):
-                    # Se for string, fazer parse do JSON
-                    import json
-                    mapping_data = json.loads(mapping_json)
-                else:
-                    # Se já for objeto Python (dict/list)
-                    mapping_data = mapping_json
-                
-                # Criar DataFrame a partir dos dados
-                if isinstance(mapping_data, list) and len(mapping_data) > 0:
-                    df = pd.DataFrame(mapping_data)
-                elif isinstance(mapping_data, dict):
-                    df = pd.DataFrame([mapping_data])
-                else:
-                    print(f"Formato de dados inesperado: {type(mapping_data)}")
-                    return None, None
-                    
-                return df, name
-                
-            except Exception as json_error:
-                print(f"Erro ao processar JSON do mapeamento {mapping_id}: {json_error}")
-                return None, None
-        else:
-            print(f"Mapeamento com ID {mapping_id} não encontrado")
-            return None, None
+            result = connection.execute(text(query), {"chave": chave, "prefixos": prefixos})
+            return [
+                {
+                    "fund_id": row[0],
+                    "fund_name": row[1],
+                    "mapping_id": row[2],
+                    "mapping_name": row[3],
+                    "ativo": row[4],
+                    "conta": row[5]
+                }
+                for row in result.fetchall()
+            ]
             
     except Exception as e:
-        print(f"Erro ao carregar mapeamento do banco: {e}")
-        return None, None
+        print(f"Erro ao buscar mapeamentos da conta: {e}")
+        return []
 
 def check_mapping_exists(fund_id: int, name: str):
     """
     Verifica se um mapeamento com esse nome já existe para o fundo
     """
     try:
-        engine = create_engine(get_database_url())
+        engine = get_engine()
         
         query = """
         SELECT EXISTS (
@@ -262,7 +805,7 @@ def delete_mapping_from_db(mapping_id: int):
     Exclui um mapeamento do banco de dados
     """
     try:
-        engine = create_engine(get_database_url())
+        engine = get_engine()
         
         query = """
         DELETE FROM public.mappings 
@@ -272,6 +815,8 @@ def delete_mapping_from_db(mapping_id: int):
         with engine.begin() as connection:
             result = connection.execute(text(query), {"mapping_id": mapping_id})
             
+        invalidate_metadata_cache("mappings")
+        
         # Retornar True se alguma linha foi afetada (deletada)
         return result.rowcount > 0
         
@@ -284,7 +829,7 @@ def delete_all_mappings_from_fund(fund_id: int):
     Exclui todos os mapeamentos de um fundo específico
     """
     try:
-        engine = create_engine(get_database_url())
+        engine = get_engine()
         
         query = """
         DELETE FROM public.mappings 
@@ -294,6 +839,8 @@ def delete_all_mappings_from_fund(fund_id: int):
         with engine.begin() as connection:
             result = connection.execute(text(query), {"fund_id": fund_id})
             
+        invalidate_metadata_cache("mappings")
+        
         # Retornar o número de linhas deletadas
         return result.rowcount
         
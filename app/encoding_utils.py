@@ -1,40 +1,207 @@
 """
-Módulo para correção de problemas de encoding em dados CSV
+Módulo para detecção de encoding e separador de arquivos CSV
+O arquivo é amostrado uma única vez (início, meio e fim) e decodificado uma única vez com o encoding escolhido
 """
+import os
+import re
+
 import pandas as pd
 
-def load_csv_with_encoding_fix(csv_path, encoding='iso-8859-15'):
+# Tamanho de cada trecho amostrado (início, meio e fim do arquivo)
+TAMANHO_AMOSTRA = 64 * 1024
+
+SEPARADORES_CANDIDATOS = [';', ',', '\t', '|']
+
+# Caracteres não ASCII esperados em textos em português (letras acentuadas e símbolos comuns),
+# usados para pontuar os encodings de 1 byte
+CARACTERES_PORTUGUES = set('áàâãéêíóôõúüçÁÀÂÃÉÊÍÓÔÕÚÜÇºª°§€“”‘’–—•…«»·²³')
+
+# Bytes 0x80-0x9F são caracteres de controle no ISO-8859 e caracteres visíveis (€, aspas curvas, travessão) no cp1252
+BYTES_CP1252 = set(range(0x80, 0xA0)) - {0x81, 0x8D, 0x8F, 0x90, 0x9D}
+
+# Abaixo desta confiança, quem lê o arquivo deve avisar o usuário
+CONFIANCA_MINIMA = 0.8
+
+
+def amostrar_bytes(dados, tamanho_amostra=TAMANHO_AMOSTRA):
+    """
+    Trechos do início, do meio e do fim de um buffer de bytes (ex.: arquivo mapeado em memória)
+    Arquivos pequenos são amostrados inteiros
+    Retorna: (trechos, completo) - completo indica que os trechos cobrem o arquivo todo
+    """
+    tamanho = len(dados)
+    if tamanho <= 3 * tamanho_amostra:
+        return [bytes(dados)], True
+
+    meio = (tamanho - tamanho_amostra) // 2
+    inicios = [0, meio, tamanho - tamanho_amostra]
+    return [bytes(dados[inicio:inicio + tamanho_amostra]) for inicio in inicios], False
+
+
+def _amostrar_arquivo(caminho_ou_arquivo, tamanho_amostra=TAMANHO_AMOSTRA):
+    """
+    Amostra um arquivo (caminho ou arquivo binário aberto) sem lê-lo inteiro
+    """
+    if isinstance(caminho_ou_arquivo, (str, os.PathLike)):
+        with open(caminho_ou_arquivo, 'rb') as arquivo:
+            return _amostrar_arquivo(arquivo, tamanho_amostra)
+
+    arquivo = caminho_ou_arquivo
+    tamanho = arquivo.seek(0, os.SEEK_END)
+    if tamanho <= 3 * tamanho_amostra:
+        arquivo.seek(0)
+        trechos, completo = [arquivo.read()], True
+    else:
+        trechos = []
+        for inicio in [0, (tamanho - tamanho_amostra) // 2, tamanho - tamanho_amostra]:
+            arquivo.seek(inicio)
+            trechos.append(arquivo.read(tamanho_amostra))
+        completo = False
+
+    arquivo.seek(0)
+    return trechos, completo
+
+
+def _aparar_utf8(trecho, inicio_cortado, fim_cortado):
+    """
+    Remove os caracteres UTF-8 cortados nas bordas de um trecho amostrado do meio do arquivo
+    """
+    if inicio_cortado:
+        inicio = 0
+        while inicio < min(3, len(trecho)) and 0x80 <= trecho[inicio] <= 0xBF:
+            inicio += 1
+        trecho = trecho[inicio:]
+    if fim_cortado:
+        # Último byte que inicia um caractere; se a sequência estiver incompleta, ela sai
+        for recuo in range(1, min(4, len(trecho)) + 1):
+            byte = trecho[-recuo]
+            if byte < 0x80:
+                break
+            if byte >= 0xC0:
+                necessarios = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+                if recuo < necessarios:
+                    trecho = trecho[:-recuo]
+                break
+    return trecho
+
+
+def _detectar_encoding(trechos, completo, encoding_padrao):
+    """
+    Escolhe o encoding pelos trechos amostrados
+    Retorna: (encoding, confianca)
+    """
+    if trechos and trechos[0].startswith(b'\xef\xbb\xbf'):
+        return 'utf-8-sig', 1.0
+
+    if all(trecho.isascii() for trecho in trechos):
+        # Só ASCII: qualquer encoding serve para a amostra; fica o padrão
+        return encoding_padrao, 1.0 if completo else 0.9
+
+    # UTF-8 válido com caracteres acentuados quase nunca acontece por acaso em textos de 1 byte
+    try:
+        for indice, trecho in enumerate(trechos):
+            _aparar_utf8(trecho, indice > 0, not completo and indice < len(trechos) - 1).decode('utf-8')
+        return 'utf-8', 0.99
+    except UnicodeDecodeError:
+        pass
+
+    # Encodings de 1 byte: cp1252 quando aparecem seus caracteres da faixa 0x80-0x9F
+    bytes_altos = set().union(*(set(trecho) for trecho in trechos)) - set(range(0x80))
+    if bytes_altos & BYTES_CP1252:
+        encoding = 'cp1252'
+    elif encoding_padrao.replace('_', '-').lower() in ('cp1252', 'windows-1252', 'latin-1', 'iso-8859-1', 'iso-8859-15'):
+        encoding = encoding_padrao
+    else:
+        encoding = 'iso-8859-15'
+
+    # Confiança: fração dos caracteres não ASCII esperados em português
+    texto = ''.join(trecho.decode(encoding, errors='replace') for trecho in trechos)
+    especiais = [caractere for caractere in texto if ord(caractere) > 127]
+    esperados = sum(1 for caractere in especiais if caractere in CARACTERES_PORTUGUES)
+    confianca = esperados / len(especiais) if especiais else 0.5
+
+    return encoding, round(confianca, 3)
+
+
+def _detectar_separador(trechos, encoding, separador_padrao):
+    """
+    Escolhe o separador que aparece a mesma quantidade de vezes (e pelo menos uma) no maior número de linhas
+    Retorna: (separador, confianca) - confianca é a fração das linhas com essa quantidade
+    """
+    linhas = []
+    for trecho in trechos:
+        partes = trecho.decode(encoding, errors='replace').splitlines()
+        if len(trechos) > 1:
+            # A primeira e a última linha de cada trecho podem estar cortadas
+            partes = partes[1:-1]
+        # Separadores dentro de aspas não contam
+        linhas.extend(re.sub(r'"[^"]*"', '', linha) for linha in partes if linha.strip())
+
+    if not linhas:
+        return separador_padrao, 0.0
+
+    melhor = (separador_padrao, 0.0)
+    for separador in SEPARADORES_CANDIDATOS:
+        contagens = pd.Series([linha.count(separador) for linha in linhas])
+        contagens = contagens[contagens > 0]
+        if contagens.empty:
+            continue
+        confianca = float(contagens.value_counts().iloc[0]) / len(linhas)
+        # Empate: fica o padrão (ou o primeiro candidato)
+        if confianca > melhor[1] or (confianca == melhor[1] and separador == separador_padrao):
+            melhor = (separador, round(confianca, 3))
+
+    return melhor
+
+
+def detectar_formato(trechos, completo=True, encoding_padrao='iso-8859-15', separador_padrao=';'):
     """
-    Carrega um CSV usando Latin-9 (ISO-8859-15) que suporta caracteres acentuados portugueses
-    
+    Detecta encoding e separador a partir dos trechos amostrados (ver amostrar_bytes)
+    Retorna: {'encoding', 'separador', 'confianca_encoding', 'confianca_separador', 'confianca'}
+    - 'confianca' (0 a 1) é a menor das duas
+    """
+    encoding, confianca_encoding = _detectar_encoding(trechos, completo, encoding_padrao)
+    separador, confianca_separador = _detectar_separador(trechos, encoding, separador_padrao)
+
+    return {
+        'encoding': encoding,
+        'separador': separador,
+        'confianca_encoding': confianca_encoding,
+        'confianca_separador': confianca_separador,
+        'confianca': min(confianca_encoding, confianca_separador)
+    }
+
+
+def detectar_formato_arquivo(caminho_ou_arquivo, encoding_padrao='iso-8859-15', separador_padrao=';'):
+    """
+    Detecta encoding e separador de um CSV (caminho ou arquivo binário aberto) lendo só as amostras
+    Retorna: ver detectar_formato
+    """
+    trechos, completo = _amostrar_arquivo(caminho_ou_arquivo)
+    return detectar_formato(trechos, completo, encoding_padrao, separador_padrao)
+
+
+def load_csv_with_encoding_fix(csv_path, encoding='iso-8859-15', sep=','):
+    """
+    Carrega um CSV detectando encoding e separador em uma única amostragem e lendo o arquivo uma única vez
+
     Args:
         csv_path (str): Caminho para o arquivo CSV
-        encoding (str): Encoding a ser usado (padrão: iso-8859-15 / latin-9)
-        
+        encoding (str): Encoding usado quando a amostra não o define (ex.: só ASCII)
+        sep (str): Separador usado quando a amostra não o define
+
     Returns:
         pandas.DataFrame: DataFrame com dados carregados
     """
     try:
-        # Tenta latin-9 primeiro (melhor suporte para português)
-        encodings_to_try = ['iso-8859-15', 'latin-1', 'cp1252', 'utf-8']
-        
-        df = None
-        encoding_used = None
-        
-        for enc in encodings_to_try:
-            try:
-                df = pd.read_csv(csv_path, encoding=enc)
-                encoding_used = enc
-                print(f"✅ CSV carregado com sucesso usando encoding: {enc}")
-                break
-            except UnicodeDecodeError:
-                continue
-        
-        if df is None:
-            raise Exception("Não foi possível ler o arquivo CSV com nenhum encoding testado")
-        
+        formato = detectar_formato_arquivo(csv_path, encoding, sep)
+        df = pd.read_csv(csv_path, encoding=formato['encoding'], sep=formato['separador'])
+        print(
+            f"✅ CSV carregado usando encoding {formato['encoding']} e separador {formato['separador']!r} "
+            f"(confiança {formato['confianca']:.0%})"
+        )
         return df
-        
+
     except Exception as e:
         print(f"❌ Erro ao carregar CSV: {e}")
         raise
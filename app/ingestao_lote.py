@@ -0,0 +1,229 @@
+"""
+Leitura em lote de um arquivo .zip com carteiras e balancetes de vários fundos (sem dependência do Streamlit)
+Os arquivos são lidos direto do .zip, sem extração para o disco, e processados em paralelo, com no máximo
+um arquivo em andamento por processo (o conteúdo descompactado não se acumula no processo principal)
+Cada arquivo é associado a um fundo pelo nome (ID, slug, CNPJ ou nome do fundo) e a um tipo
+('carteira' ou 'balancete')
+"""
+import io
+import multiprocessing
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+from cache_leitura import ler_com_cache
+from leitura import ler_balancete_com_relatorio, ler_carteira_com_relatorio
+from memoria import compactar_balancete, compactar_carteira
+from sugestoes import normalizar_texto
+
+TIPOS_ARQUIVO = ('carteira', 'balancete')
+
+COLUNAS_RESUMO = ['Arquivo', 'Tipo', 'Fundo', 'ID', 'Registros', 'Linhas Inválidas', 'Valores Inválidos', 'Tempo (s)', 'Erro']
+
+
+def listar_membros_csv(arquivo_zip):
+    """
+    Lista os CSVs do .zip (ignorando diretórios e metadados do macOS)
+    Retorna: lista de zipfile.ZipInfo
+    """
+    membros = []
+    for info in arquivo_zip.infolist():
+        nome = info.filename
+        if info.is_dir() or nome.startswith('__MACOSX/') or os.path.basename(nome).startswith('.'):
+            continue
+        if nome.lower().endswith('.csv'):
+            membros.append(info)
+    return membros
+
+
+def _tipo_do_arquivo(nome):
+    nome = nome.lower()
+    tipos = [tipo for tipo in TIPOS_ARQUIVO if tipo in nome]
+    return tipos[0] if len(tipos) == 1 else None
+
+
+def _apenas_digitos(texto):
+    return re.sub(r'\D', '', str(texto))
+
+
+def identificar_fundo(nome_arquivo, fundos):
+    """
+    Associa um arquivo a um fundo pelo nome
+    Primeiro o formato da conciliação em lote ('<identificador>_<tipo>.csv', com o ID, slug, CNPJ ou nome);
+    depois o CNPJ (só os dígitos), o slug ou o nome do fundo contidos no caminho do arquivo dentro do .zip,
+    inclusive no nome das pastas (vence o mais longo)
+    Retorna: o fundo (dicionário de get_active_funds) ou None quando nenhum ou mais de um fundo corresponde
+    """
+    base = os.path.splitext(os.path.basename(nome_arquivo))[0]
+
+    # Formato exato '<identificador>_<tipo>'
+    identificador, _, tipo = base.rpartition('_')
+    if identificador and tipo.lower() in TIPOS_ARQUIVO:
+        exatos = [
+            fundo for fundo in fundos
+            if identificador.strip() in {str(fundo[campo]).strip() for campo in ('id', 'slug', 'government_id', 'name') if fundo[campo] is not None}
+        ]
+        if len(exatos) == 1:
+            return exatos[0]
+
+    caminho = os.path.splitext(nome_arquivo)[0]
+    digitos = _apenas_digitos(caminho)
+    caminho_minusculo = caminho.lower()
+    caminho_normalizado = f" {normalizar_texto(caminho)} "
+
+    candidatos = {}
+    for fundo in fundos:
+        tamanho = 0
+        cnpj = _apenas_digitos(fundo['government_id'] or '')
+        if len(cnpj) >= 8 and cnpj in digitos:
+            tamanho = max(tamanho, len(cnpj))
+        slug = str(fundo['slug'] or '').lower()
+        if slug and slug in caminho_minusculo:
+            tamanho = max(tamanho, len(slug))
+        nome = normalizar_texto(fundo['name'] or '')
+        if nome and f" {nome} " in caminho_normalizado:
+            tamanho = max(tamanho, len(nome))
+        if tamanho > 0:
+            candidatos.setdefault(tamanho, []).append(fundo)
+
+    if not candidatos:
+        return None
+
+    melhores = candidatos[max(candidatos)]
+    return melhores[0] if len(melhores) == 1 else None
+
+
+def _ler_membro(tarefa):
+    """
+    Lê um CSV do .zip (executado nos processos do pool): direto do arquivo .zip em disco, quando a tarefa
+    traz o caminho, ou do conteúdo já descompactado enviado pelo processo principal (upload em memória)
+    Nunca lança exceção: erros são devolvidos no resultado
+    """
+    resultado = {
+        'arquivo': tarefa['arquivo'],
+        'tipo': tarefa['tipo'],
+        'fundo': tarefa['fundo'],
+        'df': None,
+        'relatorio': None,
+        'tempo': 0.0,
+        'erro': None
+    }
+    inicio = time.perf_counter()
+
+    try:
+        if tarefa.get('caminho_zip') is not None:
+            with zipfile.ZipFile(tarefa['caminho_zip']) as arquivo_zip:
+                arquivo = io.BytesIO(arquivo_zip.read(tarefa['arquivo']))
+        else:
+            arquivo = io.BytesIO(tarefa['dados'])
+        if tarefa['tipo'] == 'carteira':
+            df, _, relatorio = ler_com_cache(arquivo, 'carteira', ler_carteira_com_relatorio)
+        else:
+            df, relatorio = ler_com_cache(arquivo, 'balancete', ler_balancete_com_relatorio)
+        resultado['df'] = df
+        resultado['relatorio'] = relatorio
+    except Exception as e:
+        resultado['erro'] = str(e)
+
+    resultado['tempo'] = round(time.perf_counter() - inicio, 3)
+    return resultado
+
+
+def _resultado_com_erro(arquivo, tipo, fundo, erro):
+    return {'arquivo': arquivo, 'tipo': tipo, 'fundo': fundo, 'df': None, 'relatorio': None, 'tempo': 0.0, 'erro': erro}
+
+
+def ler_zip_de_fundos(arquivo, fundos, processos=None):
+    """
+    Lê as carteiras e balancetes de um .zip (caminho ou arquivo binário, ex.: UploadedFile) em paralelo
+    Os processos são iniciados com 'spawn' (o processo do Streamlit tem threads, e um fork as copiaria
+    em estado inconsistente) e recebem no máximo um arquivo cada por vez
+    Os arquivos que não correspondem a um fundo ou a um tipo voltam com erro, sem serem lidos
+    Retorna: gerador de (resultado, concluidos, total), na ordem em que cada arquivo termina - resultado
+    é {'arquivo', 'tipo', 'fundo', 'df', 'relatorio', 'tempo', 'erro'}
+    """
+    with zipfile.ZipFile(arquivo) as arquivo_zip:
+        membros = listar_membros_csv(arquivo_zip)
+        total = len(membros)
+        concluidos = 0
+
+        identificados = []
+        for info in membros:
+            tipo = _tipo_do_arquivo(os.path.basename(info.filename))
+            fundo = identificar_fundo(info.filename, fundos)
+            if tipo is None or fundo is None:
+                erro = "Tipo do arquivo não identificado (carteira ou balancete)" if tipo is None else "Fundo não identificado pelo nome do arquivo"
+                concluidos += 1
+                yield _resultado_com_erro(info.filename, tipo, fundo, erro), concluidos, total
+            else:
+                identificados.append((info, tipo, fundo))
+
+        if not identificados:
+            return
+
+        processos = processos or os.cpu_count() or 1
+        caminho_zip = os.fspath(arquivo) if isinstance(arquivo, (str, os.PathLike)) else None
+        pendentes = iter(identificados)
+        em_andamento = set()
+
+        with ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context('spawn')) as executor:
+            while True:
+                # Janela limitada: um arquivo por processo; .zip em disco é lido pelo próprio processo do pool,
+                # upload em memória é descompactado aqui só quando o arquivo vai ser enviado
+                for info, tipo, fundo in pendentes:
+                    tarefa = {'arquivo': info.filename, 'tipo': tipo, 'fundo': fundo, 'caminho_zip': caminho_zip}
+                    if caminho_zip is None:
+                        tarefa['dados'] = arquivo_zip.read(info)
+                    em_andamento.add(executor.submit(_ler_membro, tarefa))
+                    if len(em_andamento) >= processos:
+                        break
+
+                if not em_andamento:
+                    break
+
+                prontos, em_andamento = wait(em_andamento, return_when=FIRST_COMPLETED)
+                for futuro in prontos:
+                    concluidos += 1
+                    yield futuro.result(), concluidos, total
+
+    if hasattr(arquivo, 'seek'):
+        arquivo.seek(0)
+
+
+def agrupar_por_fundo(resultados):
+    """
+    Junta os resultados da leitura do .zip por fundo
+    Retorna: (fundos, df_resumo) - fundos é {fund_id: {'fundo', 'carteira', 'balancete'}}, com os
+    DataFrames lidos em formato compacto (com dois arquivos do mesmo tipo, vale o último em ordem alfabética), e
+    df_resumo tem uma linha por arquivo
+    """
+    fundos = {}
+    linhas = []
+
+    for resultado in sorted(resultados, key=lambda r: r['arquivo']):
+        fundo = resultado['fundo']
+        relatorio = resultado['relatorio'] or {}
+        linhas.append({
+            'Arquivo': resultado['arquivo'],
+            'Tipo': resultado['tipo'],
+            'Fundo': fundo['name'] if fundo else None,
+            'ID': fundo['id'] if fundo else None,
+            'Registros': len(resultado['df']) if resultado['df'] is not None else 0,
+            'Linhas Inválidas': relatorio.get('linhas_invalidas', 0),
+            'Valores Inválidos': relatorio.get('valores_invalidos', 0),
+            'Tempo (s)': resultado['tempo'],
+            'Erro': resultado['erro']
+        })
+
+        if resultado['df'] is not None:
+            entrada = fundos.setdefault(fundo['id'], {'fundo': fundo, 'carteira': None, 'balancete': None})
+            compactar = compactar_carteira if resultado['tipo'] == 'carteira' else compactar_balancete
+            entrada[resultado['tipo']] = compactar(resultado['df'])
+
+    df_resumo = pd.DataFrame(linhas, columns=COLUNAS_RESUMO)
+    df_resumo['ID'] = df_resumo['ID'].astype('Int64')
+    return fundos, df_resumo
@@ -0,0 +1,532 @@
+"""
+Leitura dos arquivos de carteira, balancete e mapeamento (sem dependência do Streamlit)
+Os CSVs usam iso-8859-15, separador ';' e o header na última linha
+"""
+import csv
+import io
+import mmap
+import os
+import zipfile
+import xml.etree.ElementTree as ElementTree
+from contextlib import contextmanager
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from conciliacao import detectar_colunas_mapeamento
+from encoding_utils import amostrar_bytes, detectar_formato
+from valores import centavos_para_reais, coluna_centavos, converter_numeros_brasileiros
+
+ENCODING_PADRAO = 'iso-8859-15'
+SEPARADOR_PADRAO = ';'
+
+# Tamanho de cada bloco da seção de dados passado ao leitor de CSV
+TAMANHO_BLOCO = 8 * 1024 * 1024
+
+# Bytes ignorados no fim das linhas ao procurar o header
+ESPACOS = b' \t\r\n\x0b\x0c'
+
+# Tipos das colunas de saída do leitor
+TIPO_TEXTO = 'texto'
+TIPO_VALOR = 'valor'
+
+# Colunas do balancete usadas pelo app e seus tipos
+COLUNAS_BALANCETE = {'Conta': TIPO_TEXTO, 'Nome': TIPO_TEXTO, 'SldAnt': TIPO_VALOR, 'SldAtu': TIPO_VALOR}
+
+# Quantidade de linhas inválidas guardadas como exemplo no relatório (o total é sempre contado)
+LIMITE_EXEMPLOS_INVALIDAS = 1000
+
+
+class ErroLeitura(ValueError):
+    """
+    Erro de formato em um arquivo enviado, com uma dica opcional para o usuário
+    """
+    def __init__(self, mensagem, dica=None):
+        super().__init__(mensagem)
+        self.dica = dica
+
+
+@contextmanager
+def _mapear_arquivo(arquivo):
+    """
+    Dá acesso ao conteúdo do arquivo sem lê-lo para a memória: memory-map quando o arquivo está em
+    disco (inclusive o temporário de um upload grande) ou o próprio buffer de um upload em memória
+    Retorna (no with): objeto com len(), rfind() e fatias (bytes ou mmap)
+    """
+    if isinstance(arquivo, io.BytesIO):
+        # getvalue() não copia enquanto o buffer não é alterado
+        yield arquivo.getvalue()
+        return
+
+    try:
+        fileno = arquivo.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        fileno = None
+
+    if fileno is None or os.fstat(fileno).st_size == 0:
+        arquivo.seek(0)
+        yield arquivo.read()
+        return
+
+    mapa = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    try:
+        yield mapa
+    finally:
+        try:
+            mapa.close()
+        except BufferError:
+            # Ainda há fatias em uso (ex.: exceção no meio da leitura); o coletor fecha depois
+            pass
+
+
+def _fim_sem_espacos(dados, fim):
+    """
+    Recua 'fim' sobre espaços e quebras de linha
+    """
+    while fim > 0 and dados[fim - 1] in ESPACOS:
+        fim -= 1
+    return fim
+
+
+def _localizar_header(dados, encoding=ENCODING_PADRAO):
+    """
+    Procura, de trás para frente, a última linha não vazia (o header) sem ler o restante do arquivo
+    Retorna: (header_line, inicio_header) - inicio_header é a posição em bytes onde o header começa
+    (header_line é None em arquivos vazios)
+    """
+    fim = _fim_sem_espacos(dados, len(dados))
+
+    while fim > 0:
+        inicio = dados.rfind(b'\n', 0, fim) + 1
+        header_line = dados[inicio:fim].decode(encoding, errors='replace').strip()
+        if header_line:
+            return header_line, inicio
+        fim = _fim_sem_espacos(dados, inicio)
+
+    return None, 0
+
+
+def _colunas_do_header(header_line, separator=SEPARADOR_PADRAO):
+    """
+    Divide o header usando o separador (nomes entre aspas podem conter o separador)
+    """
+    return [col.strip() for col in next(csv.reader([header_line], delimiter=separator))]
+
+
+def _blocos_de_linhas(dados, fim, tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Divide os bytes [0, fim) em blocos de linhas inteiras, sem copiar (fatias de memoryview)
+    """
+    visao = memoryview(dados)
+    inicio = 0
+
+    while inicio < fim:
+        corte = min(inicio + tamanho_bloco, fim)
+        if corte < fim:
+            quebra = dados.rfind(b'\n', inicio, corte)
+            if quebra < 0:
+                # Linha maior que o bloco
+                quebra = dados.find(b'\n', corte, fim)
+            corte = fim if quebra < 0 else quebra + 1
+
+        yield visao[inicio:corte]
+        inicio = corte
+
+
+def _contar_campos_com_aspas(linha, separator=SEPARADOR_PADRAO):
+    """
+    Quantidade de campos de uma linha com aspas, seguindo as regras do leitor de CSV
+    (separadores dentro de aspas não contam)
+    Retorna -1 quando as aspas não fecham na própria linha ou estão malformadas
+    """
+    try:
+        return len(next(csv.reader([linha], delimiter=separator, strict=True)))
+    except csv.Error:
+        return -1
+
+
+def _linhas_fora_do_formato(bloco, quantidade_colunas, encoding=ENCODING_PADRAO, separator=SEPARADOR_PADRAO):
+    """
+    Localiza as linhas do bloco cuja quantidade de campos difere do header
+    A contagem é vetorizada; só as linhas com aspas são contadas uma a uma
+    Retorna: (indices, campos, inicios, fins) - índice (a partir de 0), quantidade de campos e
+    posições em bytes de cada linha do bloco (campos, inicios e fins de todas as linhas)
+    """
+    bytes_bloco = np.frombuffer(bloco, dtype=np.uint8)
+    fins = np.flatnonzero(bytes_bloco == ord('\n'))
+    if len(bytes_bloco) > 0 and bytes_bloco[-1] != ord('\n'):
+        fins = np.append(fins, len(bytes_bloco))
+    inicios = np.concatenate(([0], fins[:-1] + 1)).astype(fins.dtype)
+
+    separadores = np.flatnonzero(bytes_bloco == ord(separator))
+    campos = np.searchsorted(separadores, fins) - np.searchsorted(separadores, inicios) + 1
+
+    aspas = np.flatnonzero(bytes_bloco == ord('"'))
+    if len(aspas) > 0:
+        com_aspas = np.flatnonzero(np.searchsorted(aspas, fins) > np.searchsorted(aspas, inicios))
+        for indice in com_aspas:
+            linha = bytes(bloco[inicios[indice]:fins[indice]]).decode(encoding, errors='replace').rstrip('\r')
+            campos[indice] = _contar_campos_com_aspas(linha, separator)
+
+    indices = np.flatnonzero(campos != quantidade_colunas)
+    return indices, campos, inicios, fins
+
+
+def _sem_linhas(bloco, indices, inicios, fins):
+    """
+    Copia o bloco sem as linhas indicadas (linhas malformadas não podem chegar ao leitor de CSV,
+    que trataria aspas abertas nelas como o início de um campo de várias linhas)
+    """
+    if len(indices) == 0:
+        return bloco
+
+    partes = []
+    inicio = 0
+    for indice in indices:
+        partes.append(bloco[inicio:inicios[indice]])
+        inicio = fins[indice] + 1
+    partes.append(bloco[inicio:])
+    return b''.join(partes)
+
+
+def _tipar_bloco(df_bruto, tipos, linhas=None):
+    """
+    Converte as colunas lidas como texto para os tipos de saída
+    TIPO_TEXTO: texto sem espaços nas pontas; TIPO_VALOR: número no formato brasileiro, em reais
+    (float) e em centavos (int64, na coluna '<coluna>_centavos', acrescentada ao final)
+    Valores que não são números valem 0 em centavos, ficam vazios (NaN) em reais e são relatados com a
+    linha do arquivo (linhas[i], se informado)
+    Retorna: (df, valores_invalidos) - valores_invalidos é uma lista de {'Linha', 'Coluna', 'Valor'}
+    """
+    df = pd.DataFrame(index=df_bruto.index)
+    centavos_por_coluna = {}
+    valores_invalidos = []
+
+    for col, tipo in tipos.items():
+        if tipo == TIPO_VALOR:
+            centavos, invalidos = converter_numeros_brasileiros(df_bruto[col])
+            df[col] = centavos_para_reais(centavos).where(~invalidos)
+            centavos_por_coluna[coluna_centavos(col)] = centavos
+
+            for posicao in np.flatnonzero(invalidos):
+                valores_invalidos.append({
+                    'Linha': int(linhas[posicao]) if linhas is not None else None,
+                    'Coluna': col,
+                    'Valor': str(df_bruto[col].iat[posicao])[:200]
+                })
+        else:
+            df[col] = df_bruto[col].str.strip()
+
+    for col, centavos in centavos_por_coluna.items():
+        df[col] = centavos
+
+    return df, valores_invalidos
+
+
+def ler_dados_em_blocos(dados, columns, fim_dados, tipos, encoding=ENCODING_PADRAO, separator=SEPARADOR_PADRAO):
+    """
+    Lê a seção de dados (antes do header) em blocos pelo leitor de CSV em C do pandas
+    Só as colunas de 'tipos' ({coluna: tipo}) são convertidas e guardadas; as demais são descartadas
+    pelo próprio leitor. Campos entre aspas podem conter o separador
+    Linhas com quantidade de campos diferente do header são puladas e relatadas, sem interromper a leitura
+    Retorna: gerador de (df_bloco, linhas_invalidas, valores_invalidos) - linhas_invalidas é uma
+    lista de {'Linha', 'Motivo', 'Conteúdo'} e valores_invalidos de {'Linha', 'Coluna', 'Valor'},
+    com a numeração de linhas do arquivo
+    """
+    # Posição de cada coluna projetada no header (a primeira, se o nome se repetir)
+    posicoes = [columns.index(col) for col in tipos]
+
+    linha_inicial = 1
+    for bloco in _blocos_de_linhas(dados, fim_dados):
+        indices, campos, inicios, fins = _linhas_fora_do_formato(bloco, len(columns), encoding, separator)
+
+        linhas_invalidas = []
+        for indice in indices:
+            conteudo = bytes(bloco[inicios[indice]:fins[indice]]).decode(encoding, errors='replace').strip()
+            # Linhas em branco são ignoradas, como antes
+            if conteudo:
+                if campos[indice] < 0:
+                    motivo = "Aspas não fechadas ou malformadas"
+                else:
+                    motivo = f"{campos[indice]} campo(s), o header tem {len(columns)}"
+                linhas_invalidas.append({'Linha': linha_inicial + int(indice), 'Motivo': motivo, 'Conteúdo': conteudo[:200]})
+
+        try:
+            df_bruto = pd.read_csv(
+                io.BytesIO(_sem_linhas(bloco, indices, inicios, fins)),
+                sep=separator,
+                header=None,
+                names=range(len(columns)),
+                usecols=posicoes,
+                dtype=str,
+                na_filter=False,
+                quotechar='"',
+                lineterminator='\n',
+                encoding=encoding,
+                encoding_errors='replace'
+            )
+        except pd.errors.EmptyDataError:
+            # Nenhuma linha válida no bloco
+            df_bruto = pd.DataFrame({posicao: pd.Series(dtype=str) for posicao in posicoes})
+
+        df_bruto = df_bruto[posicoes]
+        df_bruto.columns = list(tipos)
+
+        # Linha do arquivo de cada registro lido (as linhas puladas saem da contagem)
+        linhas = linha_inicial + np.setdiff1d(np.arange(len(fins)), indices)
+        if len(linhas) != len(df_bruto):
+            linhas = None
+
+        linha_inicial += len(fins)
+        df_bloco, valores_invalidos = _tipar_bloco(df_bruto, tipos, linhas)
+        yield df_bloco, linhas_invalidas, valores_invalidos
+
+
+def ler_csv_header_no_final(arquivo, escolher_colunas, erro_arquivo_vazio, exigir_dados=False,
+                            encoding=None, separator=None):
+    """
+    Leitor único dos CSVs com header na última linha (carteira e balancete)
+    O header é localizado de trás para frente e escolher_colunas(columns) devolve {coluna: tipo}
+    com as colunas a ler (ou lança ErroLeitura) antes de qualquer linha de dados ser lida
+    Lança ErroLeitura(erro_arquivo_vazio) sem header ou, com exigir_dados, sem linhas de dados
+    Sem encoding ou separator, ambos são detectados em uma amostra do arquivo (ENCODING_PADRAO e
+    SEPARADOR_PADRAO quando a amostra não os define) e o arquivo é decodificado uma única vez
+    Retorna: (df, relatorio) - df só com as colunas escolhidas, já tipadas, e relatorio com o
+    'formato' detectado (ver encoding_utils.detectar_formato), o total de 'linhas_invalidas' e de
+    'valores_invalidos' e até LIMITE_EXEMPLOS_INVALIDAS exemplos de cada ('exemplos' e 'exemplos_valores')
+    """
+    with _mapear_arquivo(arquivo) as dados:
+        formato = detectar_formato(*amostrar_bytes(dados), ENCODING_PADRAO, SEPARADOR_PADRAO)
+        encoding = encoding or formato['encoding']
+        separator = separator or formato['separador']
+        formato.update({'encoding': encoding, 'separador': separator})
+
+        header_line, inicio_header = _localizar_header(dados, encoding)
+
+        if header_line is None or (exigir_dados and _fim_sem_espacos(dados, inicio_header) == 0):
+            raise ErroLeitura(erro_arquivo_vazio)
+
+        columns = _colunas_do_header(header_line, separator)
+        tipos = escolher_colunas(columns)
+
+        blocos = []
+        relatorio = {
+            'formato': formato,
+            'linhas_invalidas': 0,
+            'exemplos': [],
+            'valores_invalidos': 0,
+            'exemplos_valores': []
+        }
+
+        for df_bloco, linhas_invalidas, valores_invalidos in ler_dados_em_blocos(
+            dados, columns, inicio_header, tipos, encoding, separator
+        ):
+            blocos.append(df_bloco)
+            relatorio['linhas_invalidas'] += len(linhas_invalidas)
+            espaco = LIMITE_EXEMPLOS_INVALIDAS - len(relatorio['exemplos'])
+            relatorio['exemplos'].extend(linhas_invalidas[:espaco])
+            relatorio['valores_invalidos'] += len(valores_invalidos)
+            espaco = LIMITE_EXEMPLOS_INVALIDAS - len(relatorio['exemplos_valores'])
+            relatorio['exemplos_valores'].extend(valores_invalidos[:espaco])
+
+    if blocos:
+        df = pd.concat(blocos, ignore_index=True)
+    else:
+        df, _ = _tipar_bloco(pd.DataFrame({col: pd.Series(dtype=str) for col in tipos}), tipos)
+
+    return df, relatorio
+
+
+def _colunas_carteira(columns):
+    """
+    Escolhe as colunas de título e de valor no header da carteira
+    Lança ErroLeitura quando alguma delas não existe
+    Retorna: {col_titulo: TIPO_TEXTO, col_valor: TIPO_VALOR}
+    """
+    # Verificar se as colunas necessárias existem
+    col_titulo = None
+    col_valor = None
+
+    for col in columns:
+        col_lower = col.lower().strip()
+        if 'titulo' in col_lower:
+            col_titulo = col
+        elif 'vlmrc' in col_lower:
+            col_valor = col
+
+    if col_titulo is None:
+        raise ErroLeitura("❌ Coluna 'Titulo' não encontrada no header", f"Colunas disponíveis: {columns}")
+
+    if col_valor is None:
+        raise ErroLeitura("❌ Coluna 'VlMrc' não encontrada no header", f"Colunas disponíveis: {columns}")
+
+    return {col_titulo: TIPO_TEXTO, col_valor: TIPO_VALOR}
+
+
+def ler_carteira_com_relatorio(carteira_file):
+    """
+    Lê o arquivo CSV da carteira com header na última linha (só as colunas Titulo e VlMrc)
+    Agrupa títulos repetidos somando seus valores (em centavos, sem erro de arredondamento); títulos com
+    algum valor inválido ficam com 'valor' vazio (NaN), para a conciliação não tratá-los como 0
+    Retorna: (df_carteira_dados, total_registros_antes, relatorio) - df com as colunas 'ativo',
+    'valor' e 'valor_centavos' e relatorio das linhas e valores inválidos (ver ler_csv_header_no_final)
+    """
+    df_temp, relatorio = ler_csv_header_no_final(
+        carteira_file,
+        _colunas_carteira,
+        "Arquivo deve ter pelo menos 2 linhas (dados + header).",
+        exigir_dados=True
+    )
+    col_titulo, col_valor = df_temp.columns[:2]  # Na ordem devolvida por _colunas_carteira
+    col_centavos = coluna_centavos(col_valor)
+
+    # Remover linhas com títulos vazios ou nulos
+    df_temp = df_temp[
+        (df_temp[col_titulo].notna()) &
+        (df_temp[col_titulo] != '')
+    ]
+
+    # SALVAR O TOTAL DE REGISTROS ANTES DO AGRUPAMENTO
+    total_registros_antes = len(df_temp)
+
+    # AGRUPAR TÍTULOS REPETIDOS E SOMAR VALORES
+    df_agrupado = df_temp.assign(invalido=df_temp[col_valor].isna()).groupby(col_titulo).agg(
+        centavos=(col_centavos, 'sum'),
+        invalido=('invalido', 'any')
+    ).reset_index()
+
+    # Criar DataFrame final da carteira (valor em reais para exibição e em centavos para a conciliação)
+    df_carteira_dados = pd.DataFrame({
+        'ativo': df_agrupado[col_titulo],
+        'valor': centavos_para_reais(df_agrupado['centavos']).where(~df_agrupado['invalido']),
+        coluna_centavos('valor'): df_agrupado['centavos'].astype(np.int64)
+    })
+
+    return df_carteira_dados, total_registros_antes, relatorio
+
+
+def ler_carteira(carteira_file):
+    """
+    Lê o arquivo CSV da carteira com header na última linha (ver ler_carteira_com_relatorio)
+    Retorna: (df_carteira_dados, total_registros_antes) - colunas 'ativo', 'valor' e 'valor_centavos'
+    """
+    df_carteira_dados, total_registros_antes, _ = ler_carteira_com_relatorio(carteira_file)
+    return df_carteira_dados, total_registros_antes
+
+
+def _colunas_balancete(columns):
+    """
+    Escolhe as colunas usadas do balancete (conta, nome e saldos) e verifica as obrigatórias
+    Lança ErroLeitura quando falta a coluna de conta ou a de saldo
+    Retorna: {coluna: tipo} na ordem do header
+    """
+    # Verificar colunas obrigatórias (pelo menos uma das opções deve existir)
+    required_columns_conta = {"Conta", "Nome"}  # Pelo menos uma dessas
+    required_columns_saldo = {"SldAnt", "SldAtu"}  # Pelo menos uma dessas
+    df_columns = set(columns)
+
+    # Verificar se pelo menos uma coluna de conta existe
+    if not required_columns_conta.intersection(df_columns):
+        raise ErroLeitura(
+            f"O arquivo deve conter pelo menos uma das seguintes colunas de conta: {required_columns_conta}",
+            f"Colunas encontradas: {columns}"
+        )
+
+    # Verificar se pelo menos uma coluna de saldo existe
+    if not required_columns_saldo.intersection(df_columns):
+        raise ErroLeitura(
+            f"O arquivo deve conter pelo menos uma das seguintes colunas de saldo: {required_columns_saldo}",
+            f"Colunas encontradas: {columns}"
+        )
+
+    return {col: COLUNAS_BALANCETE[col] for col in dict.fromkeys(columns) if col in COLUNAS_BALANCETE}
+
+
+def ler_balancete_com_relatorio(balancete_file):
+    """
+    Lê o arquivo CSV do balancete com header na última linha, em blocos e com memória limitada
+    Só as colunas usadas (Conta, Nome, SldAnt e SldAtu) são lidas
+    Retorna: (df, relatorio) - df com as colunas de conta como texto e as de saldo em reais,
+    acompanhadas de SldAnt_centavos e SldAtu_centavos, e relatorio das linhas e valores
+    inválidos (ver ler_csv_header_no_final)
+    """
+    return ler_csv_header_no_final(
+        balancete_file,
+        _colunas_balancete,
+        "Arquivo vazio ou não foi possível ler as linhas."
+    )
+
+
+def ler_balancete(balancete_file):
+    """
+    Lê o arquivo CSV do balancete com header na última linha (ver ler_balancete_com_relatorio)
+    Retorna: DataFrame com as colunas Conta e Nome (texto) e SldAnt e SldAtu (em reais),
+    acompanhadas de SldAnt_centavos e SldAtu_centavos
+    """
+    df, _ = ler_balancete_com_relatorio(balancete_file)
+    return df
+
+
+def listar_abas_mapeamento(mapeamento_file):
+    """
+    Lista as abas do arquivo Excel de mapeamento só pelos metadados (xl/workbook.xml), sem ler as planilhas
+    Retorna: lista com os nomes das abas, na ordem do arquivo
+    """
+    try:
+        with zipfile.ZipFile(mapeamento_file) as pacote:
+            raiz = ElementTree.fromstring(pacote.read('xl/workbook.xml'))
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError):
+        raise ErroLeitura("❌ Arquivo de mapeamento não é um Excel (.xlsx) válido")
+    finally:
+        if hasattr(mapeamento_file, 'seek'):
+            mapeamento_file.seek(0)
+
+    return [aba.get('name') for aba in raiz.iterfind('.//{*}sheet')]
+
+
+def _valor_celula(valor):
+    # Como o pandas: números inteiros gravados como float (ex.: 112.0) viram int
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+
+def ler_aba_mapeamento(mapeamento_file, aba):
+    """
+    Lê uma aba do arquivo Excel de mapeamento em modo somente leitura, linha a linha
+    A primeira linha é o header; só as colunas de conta e de ativo da carteira são guardadas
+    Sem essas colunas, a aba é lida inteira (a conciliação aponta as colunas que faltam)
+    Retorna: DataFrame com as colunas de conta e de ativo da carteira
+    """
+    livro = openpyxl.load_workbook(mapeamento_file, read_only=True, data_only=True)
+    try:
+        planilha = livro[aba]
+        header = [str(valor) if valor is not None else '' for valor in next(planilha.iter_rows(max_row=1, values_only=True), ())]
+
+        conta_col, ativo_col = detectar_colunas_mapeamento(pd.DataFrame(columns=header))
+        if conta_col is None or ativo_col is None:
+            if hasattr(mapeamento_file, 'seek'):
+                mapeamento_file.seek(0)
+            return pd.read_excel(mapeamento_file, sheet_name=aba)
+
+        # Última ocorrência de cada nome, como em detectar_colunas_mapeamento, na ordem do header
+        posicoes = {col: len(header) - 1 - header[::-1].index(col) for col in (conta_col, ativo_col)}
+        posicoes = dict(sorted(posicoes.items(), key=lambda item: item[1]))
+        primeira, ultima = min(posicoes.values()), max(posicoes.values())
+        valores = {col: [] for col in posicoes}
+
+        # Só o intervalo de colunas usado vira células (as colunas são numeradas a partir de 1)
+        for linha in planilha.iter_rows(min_row=2, min_col=primeira + 1, max_col=ultima + 1, values_only=True):
+            celulas = [linha[posicao - primeira] if posicao - primeira < len(linha) else None for posicao in posicoes.values()]
+            # Linhas vazias nas colunas usadas são ignoradas
+            if all(celula is None for celula in celulas):
+                continue
+            for col, celula in zip(posicoes, celulas):
+                valores[col].append(_valor_celula(celula))
+    finally:
+        livro.close()
+        if hasattr(mapeamento_file, 'seek'):
+            mapeamento_file.seek(0)
+
+    return pd.DataFrame({col: pd.Series(lista, dtype=None if lista else object) for col, lista in valores.items()})
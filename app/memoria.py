@@ -0,0 +1,183 @@
+"""
+Representação compacta dos DataFrames guardados na sessão, impressão digital de cada um e medição
+da memória usada pela sessão (sem dependência do Streamlit)
+Textos repetidos viram categorias (dicionário + códigos inteiros), centavos usam o menor inteiro
+em que cabem e colunas que a conciliação não usa são descartadas
+"""
+import sys
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from cache_leitura import hash_conteudo
+from conciliacao import calcular_impressao_digital, detectar_colunas_balancete, detectar_colunas_mapeamento
+from valores import SUFIXO_CENTAVOS, coluna_centavos
+
+# Colunas de texto com até esta fração de valores distintos viram categorias
+FRACAO_MAXIMA_DISTINTOS = 0.5
+
+# Medições já feitas por DataFrame (os DataFrames da sessão são substituídos, não alterados), para
+# não percorrer os textos de novo a cada rerun: id -> (referência fraca, bytes)
+_medicoes = {}
+
+
+def _compactar_texto(serie):
+    """
+    Converte uma coluna de texto em categoria quando os valores se repetem o suficiente
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype) or len(serie) == 0:
+        return serie
+    if serie.nunique(dropna=False) <= FRACAO_MAXIMA_DISTINTOS * len(serie):
+        return serie.astype('category')
+    return serie
+
+
+def _compactar_centavos(serie):
+    """
+    Guarda os centavos no menor inteiro em que todos os valores cabem (os cálculos usam int64)
+    """
+    limites = np.iinfo(np.int32)
+    if len(serie) > 0 and serie.min() >= limites.min and serie.max() <= limites.max:
+        return serie.astype(np.int32)
+    return serie
+
+
+def _compactar_colunas(df, colunas_texto, colunas_centavos):
+    df = df.copy()
+    for col in colunas_texto:
+        df[col] = _compactar_texto(df[col])
+    for col in colunas_centavos:
+        df[col] = _compactar_centavos(df[col])
+    return df
+
+
+def compactar_balancete(df_balancete):
+    """
+    Mantém só as colunas usadas na conciliação e nas sugestões (conta, nome e a coluna de saldo usada,
+    em reais e em centavos), com contas e nomes como categorias
+    """
+    conta_col, saldo_col = detectar_colunas_balancete(df_balancete)
+    colunas = [conta_col, 'Nome', saldo_col, coluna_centavos(saldo_col) if saldo_col else None]
+    colunas = [col for col in dict.fromkeys(colunas) if col is not None and col in df_balancete.columns]
+
+    colunas_texto = [col for col in (conta_col, 'Nome') if col in colunas]
+    colunas_centavos = [col for col in colunas if col.endswith(SUFIXO_CENTAVOS)]
+    return _compactar_colunas(df_balancete[colunas], colunas_texto, colunas_centavos)
+
+
+def compactar_carteira(df_carteira):
+    """
+    Carteira com os centavos no menor inteiro possível (os ativos já são únicos e ficam como texto)
+    """
+    colunas_centavos = [col for col in df_carteira.columns if col == coluna_centavos('valor')]
+    return _compactar_colunas(df_carteira, [], colunas_centavos)
+
+
+def compactar_mapeamento(df_mapeamento):
+    """
+    Mantém só as colunas de conta e de ativo da carteira do mapeamento, como categorias
+    Sem essas colunas, o mapeamento volta sem mudanças (a conciliação aponta as colunas que faltam)
+    """
+    conta_col, ativo_col = detectar_colunas_mapeamento(df_mapeamento)
+    if conta_col is None or ativo_col is None:
+        return df_mapeamento
+
+    colunas = [col for col in df_mapeamento.columns if col in (conta_col, ativo_col)]
+    return _compactar_colunas(df_mapeamento[colunas], colunas, [])
+
+
+def registrar_impressao(estado, chave, df, impressao):
+    """
+    Associa ao DataFrame guardado em estado[chave] uma impressão digital já conhecida na leitura
+    (ex.: o hash do arquivo enviado), para que ele não precise ser percorrido a cada rerun
+    """
+    estado.setdefault('impressoes', {})[chave] = (weakref.ref(df), impressao)
+
+
+def impressao_da_sessao(estado, chave):
+    """
+    Impressão digital do DataFrame guardado em estado[chave]: a registrada na leitura ou, para
+    DataFrames guardados sem ela (ex.: dados de exemplo ou do banco), calculada uma única vez
+    """
+    df = estado[chave]
+    registro = estado.get('impressoes', {}).get(chave)
+    if registro is not None and registro[0]() is df:
+        return registro[1]
+
+    impressao = calcular_impressao_digital(df)
+    registrar_impressao(estado, chave, df, impressao)
+    return impressao
+
+
+def hash_do_upload(estado, arquivo):
+    """
+    hash_conteudo de um arquivo enviado (UploadedFile), calculado uma única vez por envio: os reruns
+    seguintes reconhecem o mesmo envio pelo file_id, nome e tamanho, sem percorrer os bytes de novo
+    Arquivos sem file_id (ex.: arquivo aberto do disco) têm o hash calculado a cada chamada
+    """
+    file_id = getattr(arquivo, 'file_id', None)
+    if file_id is None:
+        return hash_conteudo(arquivo)
+
+    identidade = (file_id, getattr(arquivo, 'name', None), getattr(arquivo, 'size', None))
+    hashes = estado.setdefault('hashes_upload', {})
+    if identidade not in hashes:
+        hashes[identidade] = hash_conteudo(arquivo)
+    return hashes[identidade]
+
+
+def _bytes_dataframe(df):
+    medicao = _medicoes.get(id(df))
+    if medicao is not None and medicao[0]() is df:
+        return medicao[1]
+
+    quantidade = int(df.memory_usage(index=True, deep=True).sum())
+    chave = id(df)
+    _medicoes[chave] = (weakref.ref(df, lambda _: _medicoes.pop(chave, None)), quantidade)
+    return quantidade
+
+
+def bytes_em_memoria(valor, _vistos=None):
+    """
+    Estimativa dos bytes ocupados por um valor da sessão, incluindo os textos dos DataFrames
+    Percorre dicionários, listas e tuplas; objetos repetidos são contados uma única vez
+    """
+    vistos = set() if _vistos is None else _vistos
+    if id(valor) in vistos:
+        return 0
+    vistos.add(id(valor))
+
+    if isinstance(valor, pd.DataFrame):
+        return _bytes_dataframe(valor)
+    if isinstance(valor, (pd.Series, pd.Index)):
+        return int(valor.memory_usage(deep=True))
+    if isinstance(valor, np.ndarray):
+        return int(valor.nbytes)
+    if isinstance(valor, dict):
+        return sum(bytes_em_memoria(chave, vistos) + bytes_em_memoria(item, vistos) for chave, item in valor.items())
+    if isinstance(valor, (list, tuple, set)):
+        return sum(bytes_em_memoria(item, vistos) for item in valor)
+    return sys.getsizeof(valor)
+
+
+def resumo_memoria(estado):
+    """
+    Memória usada por cada chave de um estado (ex.: st.session_state)
+    Retorna: DataFrame com 'Chave' e 'Bytes', do maior para o menor
+    """
+    vistos = set()
+    linhas = [{'Chave': str(chave), 'Bytes': bytes_em_memoria(valor, vistos)} for chave, valor in estado.items()]
+    df = pd.DataFrame(linhas, columns=['Chave', 'Bytes'])
+    return df.sort_values('Bytes', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def formatar_bytes(quantidade):
+    """
+    Formata uma quantidade de bytes (ex.: 1536 -> '1.5 KB')
+    """
+    for unidade in ('B', 'KB', 'MB'):
+        if abs(quantidade) < 1024:
+            return f"{quantidade:.1f} {unidade}" if unidade != 'B' else f"{quantidade} B"
+        quantidade /= 1024
+    return f"{quantidade:.1f} GB"
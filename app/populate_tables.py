@@ -1,9 +1,12 @@
+import csv
 import os
-import pandas as pd
 from sqlalchemy import create_engine, text
 import random
 import time
 
+from database import migrate_mapping_entries
+from encoding_utils import detectar_formato_arquivo
+
 POSTGRES_HOST = os.getenv("DB_HOST", "postgres")
 POSTGRES_DB = os.getenv("DB_NAME", "bautomation_db")
 POSTGRES_USER = os.getenv("DB_USER", "bautomation_user")
@@ -86,62 +89,252 @@ def create_fund_quotas_table_if_not_exists(engine):
         type TEXT NOT NULL,
         quota_name TEXT NOT NULL,
         wallet_external_id TEXT NOT NULL,
+        is_active boolean NOT NULL DEFAULT true,
         created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
         updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
     """
-    return create_table(
+    table_exists = create_table(
         engine, table_name="fund_quotas", table_definition=table_definition
     )
+
+    # Bancos criados antes da recarga por diferença não têm a coluna (cotas fora do CSV são desativadas)
+    if table_exists:
+        with engine.begin() as connection:
+            connection.execute(text(
+                "ALTER TABLE public.fund_quotas ADD COLUMN IF NOT EXISTS is_active boolean NOT NULL DEFAULT true"
+            ))
+
+    return table_exists
+
+
 def create_mappings_table_if_not_exists(engine):
     table_definition = """
         id SERIAL PRIMARY KEY,
         name TEXT NOT NULL,
         fund_id INTEGER NOT NULL REFERENCES public.funds(id),
-        mapping_data JSONB NOT NULL,
+        mapping_data JSONB NULL,
+        mapping_compiled JSONB NULL,
+        entries_version INTEGER NULL,
         filename TEXT,
         sheet_name TEXT,
         created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
         updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
         UNIQUE(name, fund_id)
     """
-    return create_table(
+    table_exists = create_table(
         engine, table_name="mappings", table_definition=table_definition
     )
 
-def insert_fund(engine, id: int, name: str, slug: str, government_id: str, is_active: bool):
-    insert_query = """
-    INSERT INTO public.funds (id, name, slug, government_id, is_active)
-    VALUES (:id, :name, :slug, :government_id, :is_active)
+    # Bancos criados antes do mapeamento compilado e de mapping_entries não têm as colunas
+    # (e exigem o JSON da planilha, que deixou de ser gravado)
+    if table_exists:
+        with engine.begin() as connection:
+            connection.execute(text(
+                "ALTER TABLE public.mappings ADD COLUMN IF NOT EXISTS mapping_compiled JSONB NULL"
+            ))
+            connection.execute(text(
+                "ALTER TABLE public.mappings ADD COLUMN IF NOT EXISTS entries_version INTEGER NULL"
+            ))
+            connection.execute(text(
+                "ALTER TABLE public.mappings ALTER COLUMN mapping_data DROP NOT NULL"
+            ))
+
+    return table_exists
+
+
+def create_mapping_entries_table_if_not_exists(engine):
     """
+    Pares ativo -> conta de cada mapeamento, na ordem de precedência (0 = maior precedência),
+    com a conta como escrita no mapeamento e normalizada (chave)
+    """
+    table_definition = """
+        mapping_id INTEGER NOT NULL REFERENCES public.mappings(id) ON DELETE CASCADE,
+        precedence INTEGER NOT NULL,
+        ativo TEXT NOT NULL,
+        conta TEXT NOT NULL,
+        chave TEXT NOT NULL,
+        prefixo BOOLEAN NOT NULL DEFAULT false,
+        PRIMARY KEY (mapping_id, precedence)
+    """
+    return create_table(
+        engine, table_name="mapping_entries", table_definition=table_definition
+    )
+
+def create_indexes(engine):
+    """
+    Índices das consultas do aplicativo: fundo ativo pelo nome (seleção e lista de fundos),
+    cotas por fundo (na ordem exibida), mapeamentos por fundo, do mais recente para o mais antigo,
+    e pares dos mapeamentos por conta normalizada (exata ou prefixo) e por ativo
+    """
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS funds_active_name_idx ON public.funds (name) WHERE is_active",
+        "CREATE INDEX IF NOT EXISTS fund_quotas_fund_id_idx ON public.fund_quotas (fund_id, type, quota_name)",
+        "CREATE INDEX IF NOT EXISTS mappings_fund_id_created_at_idx ON public.mappings (fund_id, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS mapping_entries_chave_idx ON public.mapping_entries (chave) WHERE NOT prefixo",
+        "CREATE INDEX IF NOT EXISTS mapping_entries_prefixo_idx ON public.mapping_entries (chave) WHERE prefixo",
+        "CREATE INDEX IF NOT EXISTS mapping_entries_ativo_idx ON public.mapping_entries (ativo)",
+    ]
     with engine.begin() as connection:
-        connection.execute(
-            text(insert_query),
-            {
-                "id": id,
-                "name": name,
-                "slug": slug,
-                "government_id": government_id,
-                "is_active": is_active,
-            },
-        )
+        for index_query in indexes:
+            connection.execute(text(index_query))
+
+    print("Indexes created successfully.")
 
 
-def insert_fund_quota(engine, id: int, fund_id: int, type: str, quota_name: str, wallet_external_id: str):
-    insert_query = """
-    INSERT INTO public.fund_quotas (id, fund_id, type, quota_name, wallet_external_id)
-    VALUES (:id, :fund_id, :type, :quota_name, :wallet_external_id)
+def create_change_notification_triggers(engine):
+    """
+    Gatilhos que avisam (NOTIFY no canal metadata_changes, com o nome da tabela) a cada alteração em
+    funds, fund_quotas e mappings, para o cache de metadados do aplicativo ser invalidado
     """
     with engine.begin() as connection:
-        connection.execute(
-            text(insert_query),
-            {
-                "id": id,
-                "fund_id": fund_id,
-                "type": type,
-                "quota_name": quota_name,
-                "wallet_external_id": wallet_external_id,
-            },
+        connection.execute(text("""
+        CREATE OR REPLACE FUNCTION public.notify_metadata_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('metadata_changes', TG_TABLE_NAME);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """))
+
+        for table_name in ("funds", "fund_quotas", "mappings"):
+            connection.execute(text(f"DROP TRIGGER IF EXISTS notify_metadata_change ON public.{table_name}"))
+            connection.execute(text(f"""
+            CREATE TRIGGER notify_metadata_change
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.{table_name}
+            FOR EACH STATEMENT EXECUTE FUNCTION public.notify_metadata_change()
+            """))
+
+    print("Change notification triggers created successfully.")
+
+
+def quote_identifier(name: str):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def read_csv_header(csv_file, separator: str):
+    """
+    Lê a linha de header do CSV (arquivo de texto aberto), deixando o arquivo posicionado nos dados
+    Retorna a lista de colunas na ordem do arquivo
+    """
+    header = next(csv.reader([csv_file.readline()], delimiter=separator), [])
+    return [column.strip() for column in header]
+
+
+def copy_csv_to_table(connection, table_name: str, csv_file, separator: str, columns: list[str]):
+    """
+    Envia o CSV (arquivo de texto aberto, já depois do header) para a tabela (nome qualificado ou temporária)
+    com COPY FROM STDIN, na transação da conexão; o arquivo é lido em blocos pelo driver, sem ficar
+    inteiro em memória, e as conversões de tipo são feitas pelo PostgreSQL
+    columns são as colunas do arquivo, na ordem do header
+    Células vazias viram NULL
+    Retorna a quantidade de linhas copiadas
+    """
+    copy_query = (
+        f"COPY {table_name} ({', '.join(quote_identifier(column) for column in columns)}) "
+        f"FROM STDIN WITH (FORMAT csv, DELIMITER '{separator}', NULL '')"
+    )
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert(copy_query, csv_file)
+        return cursor.rowcount
+
+
+def reset_serial_sequence(connection, table_name: str):
+    """
+    Ajusta a sequência do id (SERIAL) ao maior id da tabela, já que a carga insere os ids explicitamente
+    """
+    connection.execute(text(f"""
+    SELECT setval(pg_get_serial_sequence('public.{table_name}', 'id'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL)
+    FROM public.{table_name}
+    """))
+
+
+def create_staging_table(connection, table_name: str, columns: list[str], extra_columns: list[str] = ()):
+    """
+    Tabela temporária (apagada no fim da transação) com as colunas do CSV, nos mesmos tipos da tabela
+    extra_columns são colunas do arquivo que não vão para a tabela (recebidas como texto e ignoradas)
+    Retorna o nome da tabela temporária
+    """
+    staging_table = f"staging_{table_name}"
+    connection.execute(text(f"""
+    CREATE TEMP TABLE {staging_table} ON COMMIT DROP AS
+    SELECT {', '.join(columns)} FROM public.{table_name} WITH NO DATA
+    """))
+    for column in extra_columns:
+        connection.execute(text(f"ALTER TABLE {staging_table} ADD COLUMN {quote_identifier(column)} TEXT"))
+    return staging_table
+
+
+def sync_table_from_staging(connection, table_name: str, staging_table: str, columns: list[str]):
+    """
+    Aplica a diferença entre a tabela temporária e a tabela em um único comando: insere os ids novos,
+    atualiza só as linhas que mudaram e desativa (is_active = false) as linhas ativas que não estão no CSV
+    Sem is_active no CSV, as linhas presentes nele ficam ativas
+    Retorna {"inserted", "updated", "deactivated"}
+    """
+    target_columns = columns if "is_active" in columns else columns + ["is_active"]
+    source_columns = columns if "is_active" in columns else columns + ["true"]
+    data_columns = [column for column in target_columns if column != "id"]
+
+    sync_query = f"""
+    WITH upserted AS (
+        INSERT INTO public.{table_name} AS t ({', '.join(target_columns)})
+        SELECT {', '.join(source_columns)} FROM {staging_table}
+        ON CONFLICT (id) DO UPDATE SET
+            {', '.join(f"{column} = EXCLUDED.{column}" for column in data_columns)},
+            updated_at = CURRENT_TIMESTAMP
+        WHERE ({', '.join(f"t.{column}" for column in data_columns)})
+              IS DISTINCT FROM ({', '.join(f"EXCLUDED.{column}" for column in data_columns)})
+        RETURNING (xmax = 0) AS inserted
+    ),
+    deactivated AS (
+        UPDATE public.{table_name} t
+        SET is_active = false, updated_at = CURRENT_TIMESTAMP
+        WHERE t.is_active AND NOT EXISTS (SELECT 1 FROM {staging_table} s WHERE s.id = t.id)
+        RETURNING t.id
+    )
+    SELECT
+        (SELECT count(*) FROM upserted WHERE inserted),
+        (SELECT count(*) FROM upserted WHERE NOT inserted),
+        (SELECT count(*) FROM deactivated)
+    """
+    inserted, updated, deactivated = connection.execute(text(sync_query)).fetchone()
+    return {"inserted": inserted, "updated": updated, "deactivated": deactivated}
+
+
+def load_table_from_csv(engine, table_name: str, csv_path: str, columns: list[str]):
+    """
+    Carrega um CSV em uma tabela temporária com um único COPY e aplica só a diferença na tabela,
+    em uma única transação (pode ser executado de novo sobre um banco já populado)
+    O arquivo vai direto do disco para o COPY (decodificado no encoding detectado), como texto: sem
+    inferência de tipos, inteiros com células vazias não viram '18.0' e códigos numéricos
+    (ex.: government_id) mantêm zeros à esquerda e a formatação original
+    Retorna {"rows", "inserted", "updated", "deactivated"}
+    """
+    start = time.perf_counter()
+    formato = detectar_formato_arquivo(csv_path, encoding_padrao='cp1252', separador_padrao=',')
+    print(f"Carregando {table_name} do arquivo {csv_path} (encoding {formato['encoding']}, separador {formato['separador']!r})")
+
+    with open(csv_path, encoding=formato['encoding'], newline='') as csv_file, engine.begin() as connection:
+        header = read_csv_header(csv_file, formato['separador'])
+        missing = [column for column in columns if column not in header]
+        if missing:
+            raise ValueError(f"Colunas não encontradas no CSV: {', '.join(missing)}")
+        
+        staging_table = create_staging_table(
+            connection, table_name, columns, [column for column in header if column not in columns]
         )
+        rows = copy_csv_to_table(connection, staging_table, csv_file, formato['separador'], header)
+        connection.execute(text(f"ANALYZE {staging_table}"))
+        counts = sync_table_from_staging(connection, table_name, staging_table, columns)
+        reset_serial_sequence(connection, table_name)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Dados de {table_name} sincronizados com sucesso! {rows} linhas em {elapsed:.2f}s "
+        f"({rows / max(elapsed, 1e-9):,.0f} linhas/s): {counts['inserted']} inseridas, "
+        f"{counts['updated']} atualizadas, {counts['deactivated']} desativadas"
+    )
+    return {"rows": rows, **counts}
 
 
 def load_funds_from_csv(engine, csv_path: str):
@@ -150,22 +343,13 @@ def load_funds_from_csv(engine, csv_path: str):
     CSV deve ter colunas: id, name, slug, government_id, is_active
     """
     try:
-        df = pd.read_csv(csv_path, encoding='cp1252')
-        print(f"Carregando {len(df)} funds do arquivo {csv_path}")
-        
-        for _, row in df.iterrows():
-            insert_fund(
-                engine,
-                id=row['id'],
-                name=row['name'],
-                slug=row['slug'],
-                government_id=row['government_id'],
-                is_active=row['is_active']
-            )
-        print(f"Dados de funds inseridos com sucesso!")
+        return load_table_from_csv(
+            engine, "funds", csv_path, ["id", "name", "slug", "government_id", "is_active"]
+        )
         
     except Exception as e:
         print(f"Erro ao carregar funds do CSV: {e}")
+        return None
 
 
 def load_fund_quotas_from_csv(engine, csv_path: str):
@@ -174,22 +358,13 @@ def load_fund_quotas_from_csv(engine, csv_path: str):
     CSV deve ter colunas: id, fund_id, type, quota_name, wallet_external_id
     """
     try:
-        df = pd.read_csv(csv_path, encoding='cp1252')
-        print(f"Carregando {len(df)} fund_quotas do arquivo {csv_path}")
-        
-        for _, row in df.iterrows():
-            insert_fund_quota(
-                engine,
-                id=row['id'],
-                fund_id=row['fund_id'],
-                type=row['type'],
-                quota_name=row['quota_name'],
-                wallet_external_id=row['wallet_external_id']
-            )
-        print(f"Dados de fund_quotas inseridos com sucesso!")
+        return load_table_from_csv(
+            engine, "fund_quotas", csv_path, ["id", "fund_id", "type", "quota_name", "wallet_external_id"]
+        )
         
     except Exception as e:
         print(f"Erro ao carregar fund_quotas do CSV: {e}")
+        return None
 
 
 def fix_encoding_in_database(engine):
@@ -234,6 +409,13 @@ def populate_tables(engine, funds_csv_path: str | None = None, fund_quotas_csv_p
     create_funds_table_if_not_exists(engine)
     create_fund_quotas_table_if_not_exists(engine)
     create_mappings_table_if_not_exists(engine)
+    create_mapping_entries_table_if_not_exists(engine)
+    create_indexes(engine)
+    create_change_notification_triggers(engine)
+    
+    migrated = migrate_mapping_entries(engine)
+    if migrated:
+        print(f"🔄 {migrated} mapeamento(s) convertido(s) para mapping_entries")
     
     if funds_csv_path and os.path.exists(funds_csv_path):
         load_funds_from_csv(engine, funds_csv_path)
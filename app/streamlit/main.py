@@ -9,6 +9,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from pages.lancamento import lancamento
 from pages.carteira import carteira
 from pages.conciliador import conciliador
+from memoria import formatar_bytes, resumo_memoria
+from database import get_metadata_cache_stats, get_pool_stats
 
 # Definição das páginas importadas
 def page_lancamento():
@@ -45,3 +47,17 @@ pg = st.navigation(pages)
 # Executar a página
 pg.run()
 
+# Memória ocupada pelos dados desta sessão
+df_memoria = resumo_memoria(st.session_state)
+with st.sidebar.expander(f"💾 Dados da sessão: {formatar_bytes(int(df_memoria['Bytes'].sum()))}"):
+    df_memoria['Tamanho'] = df_memoria['Bytes'].map(formatar_bytes)
+    st.dataframe(df_memoria[['Chave', 'Tamanho']], use_container_width=True, hide_index=True)
+
+# Uso do pool de conexões com o banco neste processo
+pool_stats = get_pool_stats()
+st.sidebar.caption(f"🔌 Conexões ao banco: {pool_stats['pool_hits']} reutilizadas, {pool_stats['new_connections']} novas")
+cache_stats = get_metadata_cache_stats()
+st.sidebar.caption(
+    f"🗂️ Cache de metadados: {cache_stats['hits']} acertos, {cache_stats['misses']} consultas"
+    + ("" if cache_stats['listening'] else " (inativo)")
+)
@@ -1,6 +1,15 @@
 import streamlit as st
 import pandas as pd
 import io
+import sys
+import os
+
+# Adicionar o diretório pai da pasta streamlit ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from leitura import ler_carteira_com_relatorio, ErroLeitura
+from cache_leitura import ler_com_cache
+from encoding_utils import CONFIANCA_MINIMA
+from memoria import compactar_carteira, hash_do_upload, registrar_impressao
 
 def carteira():
     st.title("Carteira de Ativos")
@@ -27,13 +36,15 @@ def carteira():
                 resultado = _process_carteira_file(uploaded_file)
                 
                 if resultado is not None:
-                    df_carteira_dados, total_registros_antes = resultado
+                    df_carteira_dados, total_registros_antes, chave_arquivo = resultado
                     
-                    # Armazenar no session state para usar na página conciliador
-                    st.session_state['df_carteira'] = df_carteira_dados
+                    # Armazenar no session state para usar na página conciliador (o hash do arquivo
+                    # identifica a carteira no cache da conciliação)
+                    st.session_state['df_carteira'] = compactar_carteira(df_carteira_dados)
+                    registrar_impressao(st.session_state, 'df_carteira', st.session_state['df_carteira'], f"carteira:{chave_arquivo}")
                     
                     # Configurar formatação para exibição
-                    df_carteira_display = df_carteira_dados.copy()
+                    df_carteira_display = df_carteira_dados[['ativo', 'valor']].copy()
                     df_carteira_display['valor'] = df_carteira_display['valor'].apply(
                         lambda x: f"R$ {x:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
                     )
@@ -177,104 +188,39 @@ def _process_carteira_file(carteira_file):
     """
     Processa o arquivo CSV da carteira com header na penúltima linha
     Agrupa títulos repetidos somando seus valores
-    Retorna: (df_carteira_dados, total_registros_antes)
+    Retorna: (df_carteira_dados, total_registros_antes, chave_arquivo) - chave_arquivo é o hash do conteúdo
     """
     try:
-        # Usar sempre iso-8859-15 (latin-9) e separador ';'
-        encoding = 'iso-8859-15'
-        separator = ';'
-        
-        # Reset do ponteiro do arquivo para o início
-        carteira_file.seek(0)
-        
-        # Ler todas as linhas do arquivo
-        lines = []
-        for line in carteira_file:
-            try:
-                decoded_line = line.decode(encoding).strip()
-                if decoded_line:  # Se a linha não está vazia
-                    lines.append(decoded_line)
-            except:
-                break
-        
-        if len(lines) < 2:
-            st.error("Arquivo deve ter pelo menos 2 linhas (dados + header).")
-            return None
-        
-        # O header está na última linha
-        header_line = lines[-1]
-        data_lines = lines[:-1]  # Todas as linhas exceto a última
-        
-        # Dividir o header usando o separador
-        columns = [col.strip() for col in header_line.split(separator)]
-        
-        # Verificar se as colunas necessárias existem
-        col_titulo = None
-        col_valor = None
-        
-        for col in columns:
-            col_lower = col.lower().strip()
-            if 'titulo' in col_lower:
-                col_titulo = col
-            elif 'vlmrc' in col_lower:
-                col_valor = col
-        
-        if col_titulo is None:
-            st.error("❌ Coluna 'Titulo' não encontrada no header")
-            st.info(f"Colunas disponíveis: {columns}")
-            return None
-            
-        if col_valor is None:
-            st.error("❌ Coluna 'VlMrc' não encontrada no header")
-            st.info(f"Colunas disponíveis: {columns}")
-            return None
-        
-        # Processar as linhas de dados
-        data_rows = []
-        for line in data_lines:
-            if line.strip():  # Se a linha não está vazia
-                row_data = [cell.strip() for cell in line.split(separator)]
-                # Garantir que a linha tem o mesmo número de colunas que o header
-                if len(row_data) == len(columns):
-                    data_rows.append(row_data)
-        
-        # Criar DataFrame temporário
-        df_temp = pd.DataFrame(data_rows, columns=columns)
-        
-        # Processar valores numéricos (considerando formato brasileiro)
-        df_temp[col_valor] = df_temp[col_valor].astype(str)
-        df_temp[col_valor] = df_temp[col_valor].str.replace('.', '', regex=False)  # Remover separador de milhares
-        df_temp[col_valor] = df_temp[col_valor].str.replace(',', '.', regex=False)  # Converter separador decimal
-        df_temp[col_valor] = pd.to_numeric(df_temp[col_valor], errors='coerce').fillna(0)
-        
-        # Limpar e padronizar os títulos
-        df_temp[col_titulo] = df_temp[col_titulo].astype(str).str.strip()
-        
-        # Remover linhas com títulos vazios ou nulos
-        df_temp = df_temp[
-            (df_temp[col_titulo].notna()) & 
-            (df_temp[col_titulo].str.strip() != '')
-        ]
-        
-        # SALVAR O TOTAL DE REGISTROS ANTES DO AGRUPAMENTO
-        total_registros_antes = len(df_temp)
+        # Reruns da página e reenvios do mesmo arquivo usam o resultado do cache
+        chave_arquivo = hash_do_upload(st.session_state, carteira_file)
+        df_carteira_dados, total_registros_antes, relatorio = ler_com_cache(
+            carteira_file, 'carteira', ler_carteira_com_relatorio, chave=chave_arquivo
+        )
         
-        # AGRUPAR TÍTULOS REPETIDOS E SOMAR VALORES
-        df_agrupado = df_temp.groupby(col_titulo)[col_valor].sum().reset_index()
+        # Encoding e separador detectados em uma amostra do arquivo
+        formato = relatorio['formato']
+        if formato['confianca'] < CONFIANCA_MINIMA:
+            st.warning(f"⚠️ Arquivo lido como {formato['encoding']} com separador '{formato['separador']}' (confiança de {formato['confianca']:.0%}). Confira acentos e colunas.")
         
-        # Mostrar informações do agrupamento
-        titulos_unicos_antes = df_temp[col_titulo].nunique()
-        titulos_unicos_depois = len(df_agrupado)
-        registros_duplicados = total_registros_antes - titulos_unicos_depois
+        # Linhas com quantidade de campos diferente do header não entram na carteira
+        if relatorio['linhas_invalidas'] > 0:
+            st.warning(f"⚠️ {relatorio['linhas_invalidas']} linha(s) ignorada(s) fora do formato do header (quantidade de colunas ou aspas)")
+            with st.expander("Ver linhas ignoradas"):
+                st.dataframe(pd.DataFrame(relatorio['exemplos']), use_container_width=True, hide_index=True)
         
-        # Criar DataFrame final da carteira
-        df_carteira_dados = pd.DataFrame({
-            'ativo': df_agrupado[col_titulo],
-            'valor': df_agrupado[col_valor]
-        })
+        # Valores de VlMrc que não são números no formato brasileiro entram como zero
+        if relatorio['valores_invalidos'] > 0:
+            st.warning(f"⚠️ {relatorio['valores_invalidos']} valor(es) de VlMrc inválido(s) considerado(s) como zero")
+            with st.expander("Ver valores inválidos"):
+                st.dataframe(pd.DataFrame(relatorio['exemplos_valores']), use_container_width=True, hide_index=True)
         
-        # Retornar tanto o DataFrame quanto o total de registros antes do agrupamento
-        return df_carteira_dados, total_registros_antes
+        return df_carteira_dados, total_registros_antes, chave_arquivo
+    
+    except ErroLeitura as e:
+        st.error(str(e))
+        if e.dica:
+            st.info(e.dica)
+        return None
         
     except Exception as e:
         st.error(f"Erro inesperado ao processar o arquivo CSV: {str(e)}")
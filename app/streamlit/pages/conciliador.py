@@ -1,5 +1,16 @@
 import streamlit as st
-import pandas as pd
+import sys
+import os
+from collections import OrderedDict
+
+# Adicionar o diretório pai da pasta streamlit ao path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from conciliacao import conciliar_com_estado, comparar_status, ErroConciliacao
+from memoria import impressao_da_sessao
+from sugestoes import construir_indice_trigramas, sugerir_contas
+
+# Quantidade máxima de resultados de conciliação mantidos em cache por sessão
+LIMITE_CACHE_CONCILIACAO = 8
 
 def conciliador():
     st.title("Conciliador")
@@ -16,8 +27,8 @@ def conciliador():
     if all(dados_disponiveis.values()):
         st.success("✅ Todos os dados necessários estão carregados!")
         
-        # Realizar a conciliação
-        resultado_conciliacao = realizar_conciliacao(
+        # Realizar a conciliação (ou reaproveitar o resultado de uma execução anterior)
+        resultado_conciliacao, mudancas_status = _obter_conciliacao(
             st.session_state['df_carteira'],
             st.session_state['df_balancete_completo'],
             st.session_state['df_mapeamento']
@@ -25,7 +36,10 @@ def conciliador():
         
         #Exibir o resultado da conciliação se ela foi realizada com sucesso
         if resultado_conciliacao is not None:
+            if mudancas_status is not None:
+                exibir_mudancas_status(mudancas_status)
             exibir_resultado_conciliacao(resultado_conciliacao)
+            exibir_sugestoes(resultado_conciliacao, st.session_state['df_balancete_completo'])
         
     else:
         st.warning("⚠️ Nem todos os dados necessários estão disponíveis.")
@@ -54,205 +68,126 @@ def conciliador():
                 st.error("❌ Mapeamento não carregado")
                 st.info("Vá para a página 'Lançamento de Dados' e carregue o mapeamento")
 
-def realizar_conciliacao(df_carteira, df_balancete, df_mapeamento):
+def _obter_conciliacao(df_carteira, df_balancete, df_mapeamento):
     """
-    Realiza a conciliação entre carteira, balancete e mapeamento
+    Retorna o resultado da conciliação usando um cache LRU no session state
+    A chave é a impressão digital de cada dado da sessão (o hash do arquivo enviado, calculado na leitura),
+    então reruns do Streamlit (filtros, ordenação, troca de página) não refazem a conciliação nem
+    percorrem os DataFrames
+    Quando só o balancete mudou (nova revisão para o mesmo fundo, carteira e mapeamento),
+    apenas os ativos afetados são recalculados
+    Retorna: (df_resultado, df_mudancas_status) - df_mudancas_status é None sem revisão anterior
     """
-    try:
-        # Inverter o DataFrame do mapeamento (de baixo para cima)
-        df_mapeamento = df_mapeamento.iloc[::-1].reset_index(drop=True)
-        
-        # Verificar se o mapeamento tem as colunas necessárias
-        colunas_necessarias = ['Conta', 'Ativo Carteira']
-
-        # Coloca em minúsculas para facilitar a comparação e salva todas as colunas na variável 
-        colunas_mapeamento = [col.lower() for col in df_mapeamento.columns]
-        
-        # Tentar encontrar as colunas com diferentes variações de nome
-        conta_balancete_col = None
-        ativo_carteira_col = None
-        
-        # Roda cada coluna do mapeamento e salva em col_lower para verificar se contém as palavras-chave necessárias
-        for col in df_mapeamento.columns:
-            col_lower = col.lower()
-            if 'conta' in col_lower:
-                conta_balancete_col = col
-            elif 'ativo' in col_lower and 'carteira' in col_lower:
-                ativo_carteira_col = col
-        
-        if conta_balancete_col is None or ativo_carteira_col is None:
-            st.error("❌ Mapeamento não contém as colunas necessárias:")
-            st.error("Colunas necessárias: 'Conta' e 'Ativo Carteira'")
-            return None
+    if 'cache_conciliacao' not in st.session_state:
+        st.session_state['cache_conciliacao'] = OrderedDict()
+    cache = st.session_state['cache_conciliacao']
+    
+    impressao_carteira = impressao_da_sessao(st.session_state, 'df_carteira')
+    impressao_mapeamento = impressao_da_sessao(st.session_state, 'df_mapeamento')
+    chave = (impressao_carteira, impressao_da_sessao(st.session_state, 'df_balancete_completo'), impressao_mapeamento)
+    fund_id = (st.session_state.get('selected_fund') or {}).get('id')
+    
+    if chave in cache:
+        # Marcar como usado mais recentemente
+        cache.move_to_end(chave)
+        entrada = cache[chave]
+    else:
+        # Existe uma conciliação anterior do mesmo fundo, com a mesma carteira e o mesmo mapeamento?
+        anterior = st.session_state.get('estado_conciliacao')
+        mesma_base = (
+            anterior is not None
+            and anterior['fund_id'] == fund_id
+            and anterior['impressao_carteira'] == impressao_carteira
+            and anterior['impressao_mapeamento'] == impressao_mapeamento
+        )
+        estado_anterior = anterior['estado'] if mesma_base else None
         
-        # Criar dicionário agrupado: ativo_carteira -> [lista de contas do balancete]
-        mapeamento_agrupado = {}
-        for i, row in df_mapeamento.iterrows():
-            conta_bal = row[conta_balancete_col]
-            ativo_cart = row[ativo_carteira_col]
-            
-            # Verificar se ambos os valores são válidos
-            if pd.notna(conta_bal) and pd.notna(ativo_cart) and str(conta_bal).strip() != '' and str(ativo_cart).strip() != '':
-                ativo_limpo = str(ativo_cart).strip()
-                conta_bal_limpo = str(conta_bal).strip()
-                
-                if ativo_limpo not in mapeamento_agrupado:
-                    mapeamento_agrupado[ativo_limpo] = []
-                
-                # Evitar duplicatas
-                if conta_bal_limpo not in mapeamento_agrupado[ativo_limpo]:
-                    mapeamento_agrupado[ativo_limpo].append(conta_bal_limpo)
+        resultado, estado = realizar_conciliacao(
+            df_carteira,
+            df_balancete,
+            df_mapeamento,
+            estado_anterior,
+            _mapeamento_compilado_atual(df_mapeamento)
+        )
         
-        # Preparar dados para conciliação
-        resultados = []
+        if resultado is None:
+            return None, None
         
-        # Detectar qual coluna de conta usar no balancete
-        conta_col_balancete = None
-        if 'Conta' in df_balancete.columns:
-            conta_col_balancete = 'Conta'
-        elif 'Nome' in df_balancete.columns:
-            conta_col_balancete = 'Nome'
-        else:
-            st.error("❌ Balancete não contém coluna 'Conta' nem 'Nome'")
-            st.info(f"Colunas disponíveis no balancete: {list(df_balancete.columns)}")
-            return None
+        mudancas = None
+        if estado_anterior is not None:
+            st.info(f"♻️ Nova revisão do balancete: {estado['recalculados']} de {len(resultado)} ativos recalculados")
+            mudancas = comparar_status(estado_anterior['resultado'], resultado)
         
-        # Detectar qual coluna de saldo usar no balancete
-        saldo_col_balancete = None
-        if 'SldAtu' in df_balancete.columns:
-            saldo_col_balancete = 'SldAtu'
-        elif 'SldAnt' in df_balancete.columns:
-            saldo_col_balancete = 'SldAnt'
-        else:
-            st.error("❌ Balancete não contém coluna 'SldAtu' nem 'SldAnt'")
-            st.info(f"Colunas disponíveis no balancete: {list(df_balancete.columns)}")
-            return None
+        # Só guardar conciliações bem-sucedidas, descartando as menos usadas recentemente
+        entrada = {'resultado': resultado, 'mudancas': mudancas, 'estado': estado}
+        cache[chave] = entrada
+        while len(cache) > LIMITE_CACHE_CONCILIACAO:
+            cache.popitem(last=False)
+    
+    # Guardar os agregados desta conciliação para a próxima revisão do balancete
+    st.session_state['estado_conciliacao'] = {
+        'fund_id': fund_id,
+        'impressao_carteira': impressao_carteira,
+        'impressao_mapeamento': impressao_mapeamento,
+        'estado': entrada['estado']
+    }
+    
+    return entrada['resultado'], entrada['mudancas']
+
+def _mapeamento_compilado_atual(df_mapeamento):
+    """
+    Retorna o mapeamento compilado carregado do banco, se ele corresponde ao df_mapeamento atual
+    """
+    compilado = st.session_state.get('mapeamento_compilado')
+    if compilado is not None and compilado['df'] is df_mapeamento:
+        return compilado['compilado']
+    return None
+
+def realizar_conciliacao(df_carteira, df_balancete, df_mapeamento, estado_anterior=None, mapeamento_compilado=None):
+    """
+    Realiza a conciliação entre carteira, balancete e mapeamento
+    Com mapeamento_compilado (carregado do banco), o mapeamento não é reagrupado
+    Retorna: (df_resultado, estado) ou (None, None) em caso de erro
+    """
+    try:
+        df_resultado, estado = conciliar_com_estado(
+            df_carteira,
+            df_balancete,
+            df_mapeamento,
+            estado_anterior,
+            mapeamento_compilado
+        )
         
         # Mostrar quais colunas estão sendo usadas
+        _, _, conta_col_balancete, saldo_col_balancete = estado['colunas']
         st.info(f"📋 Usando coluna '{conta_col_balancete}' para contas e '{saldo_col_balancete}' para saldos")
         
-        # Criar uma versão do balancete com contas normalizadas para busca
-        df_balancete_normalizado = df_balancete.copy()
-        
-        # Função para normalizar números (tanto do mapeamento quanto do balancete)
-        def normalizar_conta(conta):
-            if pd.isna(conta):
-                return ''
-            conta_str = str(conta).strip()
-            # Converter vírgula para ponto para padronizar
-            conta_str = conta_str.replace(',', '.')
-            # Tentar converter para float e depois para int se for número inteiro
-            try:
-                conta_float = float(conta_str)
-                if conta_float.is_integer():
-                    return str(int(conta_float))
-                else:
-                    return str(conta_float)
-            except ValueError:
-                return conta_str
-        
-        # Normalizar as contas do balancete
-        df_balancete_normalizado['Conta_Normalizado'] = df_balancete_normalizado[conta_col_balancete].apply(normalizar_conta)
-        
-        # Iterar pelos itens da carteira
-        for i, (_, row_carteira) in enumerate(df_carteira.iterrows()):
-            ativo_carteira = row_carteira['ativo']
-            valor_carteira = row_carteira['valor']
-            
-            # Verificar se o ativo da carteira está no mapeamento
-            if ativo_carteira not in mapeamento_agrupado:
-                # Ativo da carteira não encontrado no mapeamento
-                resultados.append({
-                    'Ativo Carteira': ativo_carteira,
-                    'Conta Balancete': 'NÃO MAPEADO',
-                    'Valor Carteira': valor_carteira,
-                    'Saldo Balancete': 0.0,
-                    'Diferença': valor_carteira,
-                    'Numero de Registros': 0,
-                    'Status': 'NÃO MAPEADO'
-                })
-                continue
-            
-            # Obter todos os nomes do balancete que correspondem a este ativo da carteira
-            contas_balancete = mapeamento_agrupado[ativo_carteira]
-            
-            # Buscar e somar TODOS os registros no balancete para TODOS os nomes mapeados
-            saldo_total_balancete = 0.0
-            contas_encontrados = []
-            total_registros_encontrados = 0
-            
-            for conta_balancete in contas_balancete:
-                # Normalizar a conta do mapeamento da mesma forma que o balancete
-                conta_balancete_normalizado = normalizar_conta(conta_balancete)
-                
-                # Procurar TODOS os registros no balancete com esta conta (busca exata apenas)
-                balancete_matches = df_balancete_normalizado[
-                    df_balancete_normalizado['Conta_Normalizado'] == conta_balancete_normalizado
-                ]
-                
-                # Se encontrou registros para esta conta, somar os valores
-                if not balancete_matches.empty:
-                    contas_encontrados.append(f"{conta_balancete}")
-                    total_registros_encontrados += len(balancete_matches)
-                    
-                    for _, match_row in balancete_matches.iterrows():
-                        saldo_atual = match_row[saldo_col_balancete]
-                        
-                        # Verificar se o valor é válido (não é NaN ou None)
-                        if pd.isna(saldo_atual):
-                            saldo_atual = 0.0
-                        
-                        # Converter para float se necessário
-                        try:
-                            saldo_atual = float(saldo_atual)
-                            saldo_total_balancete += saldo_atual
-                        except (ValueError, TypeError):
-                            continue  # Pular valores inválidos
-            
-            # Se não encontrou nenhum nome no balancete
-            if len(contas_encontrados) == 0:
-                resultados.append({
-                    'Ativo Carteira': ativo_carteira,
-                    'Conta Balancete': f"NÃO ENCONTRADO", #({len(contas_balancete)} nomes mapeados)",
-                    'Valor Carteira': valor_carteira,
-                    'Saldo Balancete': 0.0,
-                    'Diferença': valor_carteira,
-                    'Numero de Registros': 0,
-                    'Status': 'NÃO MAPEADO'
-                })
-            else:
-                # Calcular diferença
-                diferenca = valor_carteira - saldo_total_balancete
-                
-                # Determinar status
-                if abs(diferenca) < 0.01:  # Considerar diferenças menores que 1 centavo como iguais
-                    status = 'CONCILIADO'
-                else:
-                    status = 'DIVERGENTE'
-                
-                # Criar descrição dos nomes encontrados
-                if len(contas_encontrados) == 1:
-                    conta_exibicao = contas_encontrados[0]
-                else:
-                    conta_exibicao = f"MÚLTIPLOS: {', '.join(contas_encontrados[:2])}"
-                    if len(contas_encontrados) > 2:
-                        conta_exibicao += f" + {len(contas_encontrados) - 2} outros"
-                
-                resultados.append({
-                    'Ativo Carteira': ativo_carteira,
-                    'Conta Balancete': conta_exibicao,
-                    'Saldo Balancete': saldo_total_balancete,
-                    'Valor Carteira': valor_carteira,
-                    'Diferença': diferenca,
-                    'Numero de Registros': total_registros_encontrados,
-                    'Status': status
-                })
-        
-        return pd.DataFrame(resultados)
+        return df_resultado, estado
+    
+    except ErroConciliacao as e:
+        st.error(str(e))
+        if e.dica:
+            st.info(e.dica)
+        return None, None
         
     except Exception as e:
         st.error(f"Erro ao realizar conciliação: {str(e)}")
-        return None
+        return None, None
+
+def exibir_mudancas_status(df_mudancas):
+    """
+    Exibe os ativos que mudaram de status em relação à revisão anterior do balancete
+    """
+    with st.expander(f"🔁 Mudanças de status em relação à revisão anterior ({len(df_mudancas)})", expanded=len(df_mudancas) > 0):
+        if df_mudancas.empty:
+            st.info("Nenhum ativo mudou de status com a nova revisão do balancete.")
+            return
+        
+        df_display = df_mudancas.copy()
+        for col in ['Diferença Anterior', 'Diferença Atual']:
+            df_display[col] = df_display[col].apply(lambda x: f"R$ {x:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.'))
+        
+        st.dataframe(df_display, use_container_width=True, hide_index=True)
 
 def exibir_resultado_conciliacao(df_resultado):
     """
@@ -329,6 +264,48 @@ def exibir_resultado_conciliacao(df_resultado):
         hide_index=True
     )
 
+def _obter_indice_sugestoes(df_balancete):
+    """
+    Retorna o índice de trigramas do balancete, montado uma única vez por balancete
+    """
+    impressao = impressao_da_sessao(st.session_state, 'df_balancete_completo')
+    cache = st.session_state.get('indice_sugestoes')
+    
+    if cache is None or cache['impressao'] != impressao:
+        cache = {'impressao': impressao, 'indice': construir_indice_trigramas(df_balancete)}
+        st.session_state['indice_sugestoes'] = cache
+    
+    return cache['indice']
+
+def exibir_sugestoes(df_resultado, df_balancete):
+    """
+    Exibe sugestões de contas do balancete para os ativos não mapeados
+    """
+    ativos_nao_mapeados = df_resultado.loc[df_resultado['Status'] == 'NÃO MAPEADO', 'Ativo Carteira'].unique()
+    
+    if len(ativos_nao_mapeados) == 0:
+        return
+    
+    st.subheader("💡 Sugestões para Ativos Não Mapeados")
+    
+    if not st.checkbox(f"Sugerir contas do balancete para os {len(ativos_nao_mapeados)} ativos não mapeados", key="mostrar_sugestoes"):
+        return
+    
+    quantidade = st.slider("Sugestões por ativo:", min_value=1, max_value=10, value=3, key="quantidade_sugestoes")
+    
+    df_sugestoes = sugerir_contas(_obter_indice_sugestoes(df_balancete), ativos_nao_mapeados, quantidade)
+    
+    if df_sugestoes.empty:
+        st.info("🔍 Nenhuma conta parecida encontrada no balancete.")
+        return
+    
+    # Formatação da tabela para exibição
+    df_display = df_sugestoes.copy()
+    df_display['Saldo'] = df_display['Saldo'].apply(lambda x: f"R$ {x:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.'))
+    df_display['Similaridade'] = df_display['Similaridade'].apply(lambda x: f"{x:.0%}")
+    
+    st.dataframe(df_display, use_container_width=True, hide_index=True)
+
 # Função para ser chamada pelo main.py
 if __name__ == "__main__":
     conciliador()
\ No newline at end of file
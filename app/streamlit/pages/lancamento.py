@@ -6,7 +6,13 @@ import os
 
 # Adicionar o diretório pai da pasta streamlit ao path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from database import get_funds_list, get_fund_info, get_fund_quotas, save_mapping_to_db, get_mappings_by_fund, load_mapping_from_db, check_mapping_exists, delete_mapping_from_db, delete_all_mappings_from_fund
+from database import get_active_funds, get_funds_list, get_fund_details, save_mapping_to_db, get_mappings_by_fund, load_compiled_mapping_from_db, check_mapping_exists, delete_mapping_from_db, delete_all_mappings_from_fund, invalidate_metadata_cache
+from leitura import ler_balancete_com_relatorio, listar_abas_mapeamento, ler_aba_mapeamento, ErroLeitura
+from conciliacao import mapeamento_compilado_para_dataframe
+from cache_leitura import ler_com_cache
+from encoding_utils import CONFIANCA_MINIMA
+from ingestao_lote import agrupar_por_fundo, ler_zip_de_fundos
+from memoria import compactar_balancete, compactar_mapeamento, hash_do_upload, registrar_impressao
 
 # Página de lançamento de dados
 
@@ -18,6 +24,7 @@ def lancamento():
     
     # Buscar lista de fundos
     funds_list = get_funds_list()
+    fund_details = None
     
     if not funds_list:
         st.warning("⚠️ Nenhum fundo encontrado no banco de dados. Verifique se os dados foram populados corretamente.")
@@ -33,7 +40,9 @@ def lancamento():
         
         # Se um fundo foi selecionado, mostrar informações
         if selected_fund and selected_fund != "Selecione um fundo...":
-            fund_info = get_fund_info(selected_fund)
+            # Fundo, cotas e mapeamentos em uma única consulta
+            fund_details = get_fund_details(selected_fund)
+            fund_info = fund_details["fund"] if fund_details else None
             
             if fund_info:
                 with st.expander("ℹ️ Informações do Fundo Selecionado", expanded=True):
@@ -48,7 +57,7 @@ def lancamento():
                         st.write(f"**CNPJ:** {fund_info['government_id']}")
                         
                     st.subheader("📋 Cotas do Fundo")
-                    quotas = get_fund_quotas(fund_info["id"])
+                    quotas = fund_details["quotas"]
 
                     if quotas:
                         df_quotas = pd.DataFrame(quotas, columns=['ID', 'Tipo', 'Nome da Cota', 'wallet_external_id'])
@@ -97,7 +106,7 @@ def lancamento():
                 mapeamento_file = st.file_uploader(
                     "Carregar arquivo Excel (.xlsx) do mapeamento",
                     type=["xlsx"],
-                    help="Selecione um arquivo Excel no formato .xlsx (máximo 500MB)",
+                    help="Selecione um arquivo Excel no formato .xlsx (máximo 500MB). Contas terminadas em '*' (ex.: 112*) mapeiam todas as contas do balancete que começam com esse código",
                     key="mapeamento_uploader"
                 )
                 
@@ -105,11 +114,13 @@ def lancamento():
                 if mapeamento_file is not None:
                     try:
                         # Processar o arquivo
-                        df_mapeamento = _process_mapeamento_file(mapeamento_file)
+                        df_mapeamento, impressao_mapeamento = _process_mapeamento_file(mapeamento_file)
                         
                         if df_mapeamento is not None:
-                            # Salvar no session state
-                            st.session_state['df_mapeamento'] = df_mapeamento
+                            # Salvar no session state (o mapeamento do arquivo substitui o compilado do banco)
+                            st.session_state['df_mapeamento'] = compactar_mapeamento(df_mapeamento)
+                            registrar_impressao(st.session_state, 'df_mapeamento', st.session_state['df_mapeamento'], impressao_mapeamento)
+                            st.session_state.pop('mapeamento_compilado', None)
                             st.success("✅ Mapeamento processado com sucesso!")
                             
                             # Opção para salvar no banco
@@ -153,9 +164,6 @@ def lancamento():
                                                 # Limpar o nome padrão para próximo upload
                                                 if 'default_mapping_name' in st.session_state:
                                                     del st.session_state['default_mapping_name']
-                                                # Force refresh da lista de mapeamentos
-                                                if 'cached_mappings' in st.session_state:
-                                                    del st.session_state['cached_mappings']
                                             else:
                                                 st.error("❌ Erro ao salvar mapeamento no banco")
                                         else:
@@ -173,13 +181,15 @@ def lancamento():
             else:  # Usar mapeamento salvo no banco
                 st.info("📋 Mapeamentos salvos para este fundo:")
                 
-                # Buscar mapeamentos do fundo (usar cache para melhor performance)
-                cache_key = f"mappings_{fund_id}"
-                if cache_key not in st.session_state or st.button("🔄 Atualizar Lista", key="refresh_mappings"):
+                # Mapeamentos do fundo (já vêm com os detalhes do fundo selecionado)
+                # O botão descarta o cache de mapeamentos, caso um aviso de alteração não tenha chegado
+                if st.button("🔄 Atualizar Lista", key="refresh_mappings"):
+                    invalidate_metadata_cache("mappings")
                     mappings = get_mappings_by_fund(fund_id)
-                    st.session_state[cache_key] = mappings
+                elif fund_details and fund_details["fund"]["id"] == fund_id:
+                    mappings = fund_details["mappings"]
                 else:
-                    mappings = st.session_state[cache_key]
+                    mappings = get_mappings_by_fund(fund_id)
                 
                 if mappings:
                     # Criar opções para o selectbox
@@ -204,12 +214,17 @@ def lancamento():
                         
                         with col_load:
                             if st.button(f"📥 Carregar '{selected_mapping['name']}'", key="load_mapping_btn"):
-                                # Carregar mapeamento do banco
-                                df_mapeamento, mapping_name = load_mapping_from_db(selected_mapping['id'])
+                                # Carregar a forma compilada do mapeamento (usada diretamente na conciliação)
+                                mapeamento_compilado, mapping_name = load_compiled_mapping_from_db(selected_mapping['id'])
                                 
-                                if df_mapeamento is not None:
-                                    # Salvar no session state
+                                if mapeamento_compilado is not None:
+                                    # Salvar no session state (o DataFrame só com Conta/Ativo Carteira serve para o preview)
+                                    df_mapeamento = compactar_mapeamento(mapeamento_compilado_para_dataframe(mapeamento_compilado))
                                     st.session_state['df_mapeamento'] = df_mapeamento
+                                    st.session_state['mapeamento_compilado'] = {
+                                        'df': df_mapeamento,
+                                        'compilado': mapeamento_compilado
+                                    }
                                     st.success(f"✅ Mapeamento '{mapping_name}' carregado com sucesso!")
                                     # Rerun para atualizar a interface
                                     st.rerun()
@@ -235,9 +250,7 @@ def lancamento():
                                     
                                     if success:
                                         st.success(f"✅ Mapeamento '{selected_mapping['name']}' excluído com sucesso!")
-                                        # Limpar cache e session state
-                                        if cache_key in st.session_state:
-                                            del st.session_state[cache_key]
+                                        # Limpar session state
                                         if 'confirm_delete' in st.session_state:
                                             del st.session_state['confirm_delete']
                                         st.rerun()
@@ -300,9 +313,7 @@ def lancamento():
                                     
                                     if deleted_count > 0:
                                         st.success(f"✅ {deleted_count} mapeamento(s) excluído(s) com sucesso!")
-                                        # Limpar cache e session state
-                                        if cache_key in st.session_state:
-                                            del st.session_state[cache_key]
+                                        # Limpar session state
                                         if 'confirm_delete_all' in st.session_state:
                                             del st.session_state['confirm_delete_all']
                                         st.rerun()
@@ -332,12 +343,14 @@ def lancamento():
         try:
             
             # Processar o arquivo
-            df_balancete = _process_balancete_file(balancete_file)
+            df_balancete, chave_arquivo = _process_balancete_file(balancete_file)
             
             # Retorno do processamento
             if df_balancete is not None:
-                # Salvar no session state
-                st.session_state['df_balancete_completo'] = df_balancete
+                # Salvar no session state só as colunas usadas, em formato compacto (o hash do arquivo
+                # identifica o balancete nos caches da conciliação e das sugestões)
+                st.session_state['df_balancete_completo'] = compactar_balancete(df_balancete)
+                registrar_impressao(st.session_state, 'df_balancete_completo', st.session_state['df_balancete_completo'], f"balancete:{chave_arquivo}")
                 st.success("✅ Balancete processado e salvo com sucesso!")
             else:
                 st.error("Erro ao processar o arquivo do balancete.")
@@ -351,89 +364,132 @@ def lancamento():
     if balancete_file is None:
         st.warning("⚠️ Arquivo do balancete ainda não foi carregado.")
     
-def _process_balancete_file(balancete_file):
-    try:
-        # Usar Latin-9 (ISO-8859-15) para melhor suporte a caracteres acentuados
-        encoding = 'iso-8859-15'
-        separator = ';'
-        
-        # Reset do ponteiro do arquivo para o início
-        balancete_file.seek(0)
-        
-        # Ler todas as linhas do arquivo
-        lines = []
-        for line in balancete_file:
-            try:
-                decoded_line = line.decode(encoding).strip()
-                if decoded_line:  # Se a linha não está vazia
-                    lines.append(decoded_line)
-            except:
-                break
-        
-        if len(lines) == 0:
-            st.error("Arquivo vazio ou não foi possível ler as linhas.")
-            return None
-        
-        # O header está na última linha
-        header_line = lines[-1]
-        data_lines = lines[:-1]  # Todas as linhas exceto a última
-        
-        # Dividir o header usando o separador
-        columns = [col.strip() for col in header_line.split(separator)]
-        
-        # Processar as linhas de dados
-        data_rows = []
-        for line in data_lines:
-            if line.strip():  # Se a linha não está vazia
-                row_data = [cell.strip() for cell in line.split(separator)]
-                # Garantir que a linha tem o mesmo número de colunas que o header
-                if len(row_data) == len(columns):
-                    data_rows.append(row_data)
-        
-        # Criar DataFrame
-        df = pd.DataFrame(data_rows, columns=columns)
+    st.divider()
+    _lancamento_lote()
+    
+def _lancamento_lote():
+    """
+    Upload de um .zip com carteiras e balancetes de vários fundos, lidos em paralelo
+    Os dados lidos ficam no session state e um fundo pode ser levado para a conciliação
+    """
+    st.header("📦 Lote de Arquivos (.zip)")
+    st.caption("Os arquivos devem ter no nome 'carteira' ou 'balancete' e o ID, slug, CNPJ ou nome do fundo (ex.: fidc-pagaleve_carteira.csv)")
+    
+    zip_file = st.file_uploader(
+        "Carregar arquivo .zip com carteiras e balancetes",
+        type=["zip"],
+        help="Os CSVs são lidos direto do .zip, sem extração",
+        key="lote_uploader"
+    )
+    
+    if zip_file is None:
+        st.session_state.pop('lote_fundos', None)
+        return
+    
+    # Ler o .zip uma única vez por arquivo enviado (reruns da página reaproveitam o resultado)
+    chave_lote = hash_do_upload(st.session_state, zip_file)
+    lote = st.session_state.get('lote_fundos')
+    if lote is None or lote['chave'] != chave_lote:
+        fundos = get_active_funds()
+        if not fundos:
+            st.warning("⚠️ Nenhum fundo encontrado no banco de dados para identificar os arquivos.")
+            return
         
-        # Converter a coluna SldAnt para numérico (se existir)
-        if 'SldAnt' in df.columns:
-            # Limpar e converter valores numéricos
-            df['SldAnt'] = df['SldAnt'].str.replace('.', '', regex=False)  # Remover separador de milhares
-            df['SldAnt'] = df['SldAnt'].str.replace(',', '.', regex=False)  # Converter separador decimal
-            df['SldAnt'] = pd.to_numeric(df['SldAnt'], errors='coerce').fillna(0.0)
+        resultados = []
+        progresso = st.progress(0.0, text="Lendo arquivos do .zip...")
+        try:
+            for resultado, concluidos, total in ler_zip_de_fundos(zip_file, fundos):
+                resultados.append(resultado)
+                progresso.progress(concluidos / total, text=f"{concluidos}/{total} arquivo(s) lido(s) - {resultado['arquivo']}")
+        except Exception as e:
+            st.error(f"Erro ao ler o arquivo .zip: {e}")
+            return
+        progresso.empty()
         
-        # Converter a coluna SldAtu para numérico (se existir)
-        if 'SldAtu' in df.columns:
-            # Limpar e converter valores numéricos
-            df['SldAtu'] = df['SldAtu'].str.replace('.', '', regex=False)  # Remover separador de milhares
-            df['SldAtu'] = df['SldAtu'].str.replace(',', '.', regex=False)  # Converter separador decimal
-            df['SldAtu'] = pd.to_numeric(df['SldAtu'], errors='coerce').fillna(0.0)
+        fundos_lidos, df_resumo = agrupar_por_fundo(resultados)
+        lote = {'chave': chave_lote, 'fundos': fundos_lidos, 'resumo': df_resumo}
+        st.session_state['lote_fundos'] = lote
+    
+    df_resumo = lote['resumo']
+    erros = df_resumo['Erro'].notna().sum()
+    st.success(f"✅ {len(df_resumo) - erros} de {len(df_resumo)} arquivo(s) lido(s) para {len(lote['fundos'])} fundo(s)")
+    if erros > 0:
+        st.warning(f"⚠️ {erros} arquivo(s) com erro ou não identificado(s)")
+    st.dataframe(df_resumo, use_container_width=True, hide_index=True)
+    
+    # Fundos com carteira e balancete podem ir para a conciliação
+    completos = {fund_id: dados for fund_id, dados in lote['fundos'].items() if dados['carteira'] is not None and dados['balancete'] is not None}
+    if not completos:
+        st.info("Nenhum fundo com carteira e balancete no .zip.")
+        return
+    
+    fund_id = st.selectbox(
+        "Fundo para conciliar:",
+        options=list(completos),
+        format_func=lambda fund_id: completos[fund_id]['fundo']['name'],
+        key="lote_fundo_selector"
+    )
+    
+    if st.button("➡️ Usar carteira e balancete deste fundo na conciliação", key="lote_usar_btn"):
+        dados = completos[fund_id]
+        st.session_state['df_carteira'] = dados['carteira']
+        st.session_state['df_balancete_completo'] = dados['balancete']
+        st.session_state.selected_fund = dados['fundo']
         
-        # Verificar colunas obrigatórias (pelo menos uma das opções deve existir)
-        required_columns_conta = {"Conta", "Nome"}  # Pelo menos uma dessas
-        required_columns_saldo = {"SldAnt", "SldAtu"}  # Pelo menos uma dessas
+        # Mapeamento mais recente salvo para o fundo (get_mappings_by_fund já vem do mais recente para o mais antigo)
+        mappings = get_mappings_by_fund(fund_id)
+        mapeamento_compilado, mapping_name = load_compiled_mapping_from_db(mappings[0]['id']) if mappings else (None, None)
+        if mapeamento_compilado is not None:
+            df_mapeamento = compactar_mapeamento(mapeamento_compilado_para_dataframe(mapeamento_compilado))
+            st.session_state['df_mapeamento'] = df_mapeamento
+            st.session_state['mapeamento_compilado'] = {
+                'df': df_mapeamento,
+                'compilado': mapeamento_compilado
+            }
+            st.success(f"✅ Dados de '{dados['fundo']['name']}' prontos para a conciliação com o mapeamento '{mapping_name}'")
+        else:
+            st.warning(f"⚠️ Dados de '{dados['fundo']['name']}' carregados, mas o fundo não tem mapeamento salvo. Carregue um mapeamento acima.")
+    
+def _process_balancete_file(balancete_file):
+    """
+    Retorna: (df, chave_arquivo) - chave_arquivo é o hash do conteúdo; (None, None) em caso de erro
+    """
+    try:
+        # Reruns da página e reenvios do mesmo arquivo usam o resultado do cache
+        chave_arquivo = hash_do_upload(st.session_state, balancete_file)
+        df, relatorio = ler_com_cache(balancete_file, 'balancete', ler_balancete_com_relatorio, chave=chave_arquivo)
         
-        # Converter nomes das colunas para strings e remover espaços extras
-        df.columns = df.columns.str.strip()
+        # Mostrar quais colunas foram encontradas
         df_columns = set(str(col) for col in df.columns)
+        conta_cols_found = {"Conta", "Nome"}.intersection(df_columns)
+        saldo_cols_found = {"SldAnt", "SldAtu"}.intersection(df_columns)
+        st.success(f"✅ Colunas de conta encontradas: {conta_cols_found}")
+        st.success(f"✅ Colunas de saldo encontradas: {saldo_cols_found}")
         
-        # Verificar se pelo menos uma coluna de conta existe
-        conta_cols_found = required_columns_conta.intersection(df_columns)
-        if not conta_cols_found:
-            st.error(f"O arquivo deve conter pelo menos uma das seguintes colunas de conta: {required_columns_conta}")
-            st.info(f"Colunas encontradas: {list(df.columns)}")
-            return None
+        # Encoding e separador detectados em uma amostra do arquivo
+        formato = relatorio['formato']
+        if formato['confianca'] < CONFIANCA_MINIMA:
+            st.warning(f"⚠️ Arquivo lido como {formato['encoding']} com separador '{formato['separador']}' (confiança de {formato['confianca']:.0%}). Confira acentos e colunas.")
         
-        # Verificar se pelo menos uma coluna de saldo existe
-        saldo_cols_found = required_columns_saldo.intersection(df_columns)
-        if not saldo_cols_found:
-            st.error(f"O arquivo deve conter pelo menos uma das seguintes colunas de saldo: {required_columns_saldo}")
-            st.info(f"Colunas encontradas: {list(df.columns)}")
-            return None
+        # Linhas com quantidade de campos diferente do header não entram no balancete
+        if relatorio['linhas_invalidas'] > 0:
+            st.warning(f"⚠️ {relatorio['linhas_invalidas']} linha(s) ignorada(s) fora do formato do header (quantidade de colunas ou aspas)")
+            with st.expander("Ver linhas ignoradas"):
+                st.dataframe(pd.DataFrame(relatorio['exemplos']), use_container_width=True, hide_index=True)
         
-        # Mostrar quais colunas foram encontradas
-        st.success(f"✅ Colunas de conta encontradas: {conta_cols_found}")
-        st.success(f"✅ Colunas de saldo encontradas: {saldo_cols_found}")
+        # Saldos que não são números no formato brasileiro entram como zero
+        if relatorio['valores_invalidos'] > 0:
+            st.warning(f"⚠️ {relatorio['valores_invalidos']} valor(es) de saldo inválido(s) considerado(s) como zero")
+            with st.expander("Ver valores inválidos"):
+                st.dataframe(pd.DataFrame(relatorio['exemplos_valores']), use_container_width=True, hide_index=True)
         
-        return df
+        return df, chave_arquivo
+    
+    except ErroLeitura as e:
+        st.error(str(e))
+        if e.dica:
+            st.info(e.dica)
+        return None, None
         
     except Exception as e:
         st.error(f"Erro inesperado ao processar o arquivo CSV: {str(e)}")
@@ -448,36 +504,44 @@ def _process_balancete_file(balancete_file):
         except:
             pass
         
-        return None
+        return None, None
     
 def _process_mapeamento_file(mapeamento_file):
+    """
+    Retorna: (df, impressao) - impressao identifica o arquivo e a aba lida; (None, None) em caso de erro
+    """
     try:
-        # Ler o arquivo Excel (sheet_name=None retorna um dicionário com todas as abas)
-        all_sheets = pd.read_excel(mapeamento_file, sheet_name=None)
+        # Listar as abas só pelos metadados do Excel (nenhuma aba é lida aqui)
+        sheet_names = listar_abas_mapeamento(mapeamento_file)
         
         # Se há múltiplas abas, permitir que o usuário escolha
-        if len(all_sheets) > 1:
-            sheet_names = list(all_sheets.keys())
+        if len(sheet_names) > 1:
             selected_sheet = st.selectbox(
                 "Selecione a aba do Excel de mapeamento para processar:",
                 sheet_names,
                 index=0,
                 key="mapeamento_sheet_selector"
             )
-            df = all_sheets[selected_sheet]
             st.info(f"Processando aba do mapeamento: {selected_sheet}")
-            # Salvar nome da aba no session state
-            st.session_state['selected_sheet_name'] = selected_sheet
         else:
             # Se há apenas uma aba, usar ela diretamente
-            sheet_name = list(all_sheets.keys())[0]
-            df = all_sheets[sheet_name]
-            # Salvar nome da aba no session state
-            st.session_state['selected_sheet_name'] = sheet_name
+            selected_sheet = sheet_names[0]
+        
+        # Ler só a aba escolhida (e só as colunas Conta e Ativo Carteira)
+        chave_arquivo = hash_do_upload(st.session_state, mapeamento_file)
+        df = ler_com_cache(
+            mapeamento_file,
+            'mapeamento',
+            lambda arquivo: ler_aba_mapeamento(arquivo, selected_sheet),
+            variante=selected_sheet,
+            chave=chave_arquivo
+        )
+        # Salvar nome da aba no session state
+        st.session_state['selected_sheet_name'] = selected_sheet
         
-        return df
+        return df, f"mapeamento:{chave_arquivo}:{selected_sheet}"
         
     except Exception as e:
         st.error(f"Erro ao processar o arquivo de mapeamento: {e}")
-        return None
+        return None, None
 
@@ -0,0 +1,100 @@
+"""
+Sugestões de contas do balancete para ativos não mapeados (sem dependência do Streamlit)
+As sugestões vêm de um índice invertido de trigramas montado uma vez por balancete
+"""
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from conciliacao import detectar_colunas_balancete
+
+COLUNAS_SUGESTOES = ['Ativo Carteira', 'Sugestão', 'Conta', 'Nome', 'Saldo', 'Similaridade']
+
+
+def normalizar_texto(texto):
+    """
+    Remove acentos e pontuação e coloca o texto em maiúsculas (ex.: 'Títulos-Públicos' -> 'TITULOS PUBLICOS')
+    """
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r'[^A-Z0-9]+', ' ', texto.upper()).strip()
+
+
+def trigramas(texto):
+    """
+    Conjunto de trigramas do texto normalizado (com espaços nas pontas para pesar o início das palavras)
+    """
+    texto = f"  {normalizar_texto(texto)} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def construir_indice_trigramas(df_balancete):
+    """
+    Monta o índice invertido de trigramas das contas do balancete (uma entrada por Conta/Nome distintos)
+    Retorna: dicionário com 'documentos' (Conta, Nome e Saldo de cada conta), 'postings'
+    (trigrama -> ids das contas) e 'tamanhos' (quantidade de trigramas de cada conta)
+    """
+    conta_col, saldo_col = detectar_colunas_balancete(df_balancete)
+    nome_col = 'Nome' if 'Nome' in df_balancete.columns else conta_col
+    colunas = list(dict.fromkeys([conta_col, nome_col]))
+
+    df_docs = pd.DataFrame({col: df_balancete[col] for col in colunas})
+    df_docs['Saldo'] = pd.to_numeric(df_balancete[saldo_col], errors='coerce').fillna(0.0) if saldo_col else 0.0
+    df_docs = df_docs.groupby(colunas, sort=False, dropna=False, observed=True)['Saldo'].sum().reset_index()
+    df_docs = pd.DataFrame({
+        'Conta': df_docs[conta_col],
+        'Nome': df_docs[nome_col],
+        'Saldo': df_docs['Saldo']
+    })
+
+    postings = {}
+    tamanhos = np.zeros(len(df_docs), dtype=np.int32)
+    for doc_id, texto in enumerate(df_docs['Nome']):
+        trigramas_doc = trigramas(texto)
+        tamanhos[doc_id] = len(trigramas_doc)
+        for trigrama in trigramas_doc:
+            postings.setdefault(trigrama, []).append(doc_id)
+
+    return {
+        'documentos': df_docs,
+        'postings': {trigrama: np.array(ids, dtype=np.int32) for trigrama, ids in postings.items()},
+        'tamanhos': tamanhos
+    }
+
+
+def sugerir_contas(indice, ativos, quantidade=3, similaridade_minima=0.1):
+    """
+    Sugere as contas mais parecidas com cada ativo (similaridade de Jaccard entre trigramas)
+    Só as contas que compartilham algum trigrama com o ativo são avaliadas
+    Retorna: DataFrame com as colunas de COLUNAS_SUGESTOES
+    """
+    documentos = indice['documentos']
+    linhas = []
+
+    for ativo in ativos:
+        trigramas_ativo = trigramas(ativo)
+        listas = [indice['postings'][t] for t in trigramas_ativo if t in indice['postings']]
+        if not listas:
+            continue
+
+        # Quantidade de trigramas em comum com cada conta candidata
+        candidatos, em_comum = np.unique(np.concatenate(listas), return_counts=True)
+        similaridade = em_comum / (len(trigramas_ativo) + indice['tamanhos'][candidatos] - em_comum)
+
+        melhores = np.argsort(-similaridade, kind='stable')[:quantidade]
+        for posicao, melhor in enumerate(melhores, start=1):
+            if similaridade[melhor] < similaridade_minima:
+                break
+            documento = documentos.iloc[candidatos[melhor]]
+            linhas.append({
+                'Ativo Carteira': ativo,
+                'Sugestão': posicao,
+                'Conta': documento['Conta'],
+                'Nome': documento['Nome'],
+                'Saldo': documento['Saldo'],
+                'Similaridade': float(similaridade[melhor])
+            })
+
+    return pd.DataFrame(linhas, columns=COLUNAS_SUGESTOES)
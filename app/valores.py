@@ -0,0 +1,204 @@
+"""
+Valores monetários em centavos inteiros (int64)
+Os leitores guardam, ao lado de cada coluna de valor em reais, a coluna '<coluna>_centavos'
+usada nas somas e comparações da conciliação, que ficam exatas
+"""
+import numpy as np
+import pandas as pd
+
+SUFIXO_CENTAVOS = '_centavos'
+
+# Classes dos caracteres de um número no formato brasileiro (tabela indexada pelo código do caractere)
+INVALIDO, DIGITO, VIRGULA, MENOS, ABRE_PARENTESES, FECHA_PARENTESES, IGNORADO = range(7)
+CLASSES_CARACTERES = np.full(256, INVALIDO, dtype=np.uint8)
+CLASSES_CARACTERES[ord('0'):ord('9') + 1] = DIGITO
+CLASSES_CARACTERES[ord(',')] = VIRGULA
+CLASSES_CARACTERES[ord('-')] = MENOS
+CLASSES_CARACTERES[ord('(')] = ABRE_PARENTESES
+CLASSES_CARACTERES[ord(')')] = FECHA_PARENTESES
+# Espaços (inclusive o '\r' das quebras de linha do Windows), separador de milhares, sinal de positivo
+# e o preenchimento do array de textos
+for _caractere in ' \t\r\n\v\f.+\xa0\x00':
+    CLASSES_CARACTERES[ord(_caractere)] = IGNORADO
+
+# Maior quantidade de dígitos na parte inteira que cabe em centavos int64
+MAXIMO_DIGITOS_INTEIRO = 16
+
+# Maior quantidade de caracteres de um valor (com espaços e separadores)
+LARGURA_MAXIMA = 64
+
+# Valores convertidos por vez (a matriz de caracteres de cada lote fica em memória)
+TAMANHO_LOTE_CONVERSAO = 65536
+
+
+def coluna_centavos(coluna):
+    """
+    Nome da coluna em centavos correspondente a uma coluna em reais (ex.: 'SldAtu' -> 'SldAtu_centavos')
+    """
+    return f"{coluna}{SUFIXO_CENTAVOS}"
+
+
+def _validar_sinal(classes, digito, tem_digito):
+    """
+    Valida o sinal dos valores que têm '-', '(' ou ')': um único '-' antes ou depois dos
+    dígitos, ou o valor inteiro entre parênteses
+    Retorna: (negativo, invalido)
+    """
+    largura = classes.shape[1]
+    colunas = np.arange(largura)
+    primeiro = np.where(tem_digito, digito.argmax(axis=1), largura)
+    ultimo = np.where(tem_digito, largura - 1 - digito[:, ::-1].argmax(axis=1), -1)
+    antes = colunas < primeiro[:, None]
+    depois = colunas > ultimo[:, None]
+
+    menos = classes == MENOS
+    abre = classes == ABRE_PARENTESES
+    fecha = classes == FECHA_PARENTESES
+    quantidade_menos = np.count_nonzero(menos, axis=1)
+    quantidade_abre = np.count_nonzero(abre, axis=1)
+    quantidade_fecha = np.count_nonzero(fecha, axis=1)
+
+    invalido = ~tem_digito
+    invalido |= (menos & ~(antes | depois)).any(axis=1)
+    invalido |= (abre & ~antes).any(axis=1) | (fecha & ~depois).any(axis=1)
+    invalido |= (quantidade_menos > 1) | (quantidade_abre > 1) | (quantidade_abre != quantidade_fecha)
+    invalido |= (quantidade_menos > 0) & (quantidade_abre > 0)
+
+    return (quantidade_menos > 0) | (quantidade_abre > 0), invalido
+
+
+def _converter_lote(texto):
+    """
+    Converte um array de textos (numpy 'U') para centavos, operando sobre a matriz de caracteres
+    (uma linha por valor, uma coluna por posição do caractere)
+    Retorna: (centavos, invalidos)
+    """
+    quantidade = len(texto)
+    if quantidade == 0 or texto.dtype.itemsize == 0:
+        return np.zeros(quantidade, dtype=np.int64), np.zeros(quantidade, dtype=bool)
+
+    # Textos maiores que LARGURA_MAXIMA não são números válidos; cortá-los limita a largura da matriz
+    longos = np.zeros(quantidade, dtype=bool)
+    if texto.dtype.itemsize > LARGURA_MAXIMA * 4:
+        longos = np.char.str_len(texto) > LARGURA_MAXIMA
+        texto = texto.astype(f'<U{LARGURA_MAXIMA}')
+
+    # Códigos acima de 255 viram 255 (inválido)
+    caracteres = np.minimum(texto.view(np.uint32).reshape(quantidade, -1), 255).astype(np.uint8)
+    classes = CLASSES_CARACTERES[caracteres]
+    largura = caracteres.shape[1]
+
+    digito = classes == DIGITO
+    tem_digito = digito.any(axis=1)
+    invalidos = longos | (classes == INVALIDO).any(axis=1)
+
+    # Vírgula decimal: no máximo uma
+    virgula = classes == VIRGULA
+    virgulas = np.count_nonzero(virgula, axis=1)
+    invalidos |= virgulas > 1
+    posicao_virgula = np.where(virgulas > 0, virgula.argmax(axis=1), largura)
+
+    # Sinal (só nas linhas que têm '-' ou parênteses); sem dígitos nem sinal o valor é vazio (0)
+    negativo = np.zeros(quantidade, dtype=bool)
+    com_sinal = np.flatnonzero(((classes >= MENOS) & (classes <= FECHA_PARENTESES)).any(axis=1))
+    if len(com_sinal) > 0:
+        negativo[com_sinal], invalido_sinal = _validar_sinal(classes[com_sinal], digito[com_sinal], tem_digito[com_sinal])
+        invalidos[com_sinal] |= invalido_sinal
+    invalidos |= ~tem_digito & (virgulas > 0)
+
+    inteiro = np.zeros(quantidade, dtype=np.int64)
+    digitos_inteiro = np.zeros(quantidade, dtype=np.int64)
+    milesimos = np.zeros(quantidade, dtype=np.int64)
+    casas = np.zeros(quantidade, dtype=np.int64)
+
+    # Uma passada pelas colunas de caracteres, vetorizada nas linhas
+    for coluna in range(largura):
+        digito_coluna = digito[:, coluna]
+        if not digito_coluna.any():
+            continue
+        valor = caracteres[:, coluna].astype(np.int64) - ord('0')
+
+        # Parte inteira
+        antes = digito_coluna & (coluna < posicao_virgula)
+        inteiro = np.where(antes, inteiro * 10 + valor, inteiro)
+        digitos_inteiro += antes
+
+        # Até três casas decimais (a terceira só para arredondar)
+        depois = digito_coluna & (coluna > posicao_virgula) & (casas < 3)
+        milesimos = np.where(depois, milesimos * 10 + valor, milesimos)
+        casas += depois
+
+    invalidos |= digitos_inteiro > MAXIMO_DIGITOS_INTEIRO
+
+    milesimos = milesimos * 10 ** (3 - casas)
+    centavos = inteiro * 100 + (milesimos + 5) // 10
+    centavos = np.where(negativo, -centavos, centavos)
+    centavos[invalidos] = 0
+
+    return centavos, invalidos
+
+
+def converter_numeros_brasileiros(serie):
+    """
+    Converte valores no formato brasileiro (1.234.567,89; -1.234,56; 1.234,56-; (1.234,56))
+    direto para centavos inteiros, de forma vetorizada e sem passar por float
+    Casas além da segunda são arredondadas (metade para cima); células vazias valem 0
+    Retorna: (centavos, invalidos) - Series int64 com o mesmo índice e máscara (array booleano)
+    das células que não puderam ser convertidas (elas valem 0)
+    """
+    texto = serie.where(serie.notna(), '').to_numpy(dtype=str)
+
+    centavos = np.zeros(len(texto), dtype=np.int64)
+    invalidos = np.zeros(len(texto), dtype=bool)
+
+    # Em lotes, para limitar a memória da matriz de caracteres
+    for inicio in range(0, len(texto), TAMANHO_LOTE_CONVERSAO):
+        fim = inicio + TAMANHO_LOTE_CONVERSAO
+        centavos[inicio:fim], invalidos[inicio:fim] = _converter_lote(texto[inicio:fim])
+
+    return pd.Series(centavos, index=serie.index), invalidos
+
+
+def texto_para_centavos(serie):
+    """
+    Converte valores no formato brasileiro para centavos (ver converter_numeros_brasileiros)
+    Valores inválidos viram 0
+    Retorna: Series int64 com o mesmo índice
+    """
+    centavos, _ = converter_numeros_brasileiros(serie)
+    return centavos
+
+
+def reais_para_centavos(serie):
+    """
+    Converte valores numéricos em reais para centavos (arredondando para o centavo mais próximo)
+    Valores inválidos (NaN ou não numéricos) viram 0
+    """
+    reais = pd.to_numeric(serie, errors='coerce').fillna(0.0).to_numpy(dtype=float)
+    return pd.Series(np.rint(reais * 100).astype(np.int64), index=serie.index)
+
+
+def centavos_para_reais(centavos):
+    """
+    Converte centavos para reais (float) para exibição e exportação
+    """
+    return centavos / 100
+
+
+def valores_invalidos(df, coluna):
+    """
+    Máscara (array booleano) dos valores em reais da coluna que não são números: células que a leitura
+    não conseguiu converter (NaN, e 0 em centavos) ou, em dados sem a coluna em centavos, NaN e textos
+    """
+    return pd.to_numeric(df[coluna], errors='coerce').isna().to_numpy()
+
+
+def valores_em_centavos(df, coluna):
+    """
+    Valores de uma coluna em centavos: usa a coluna '<coluna>_centavos' gerada na leitura
+    ou, se ela não existir (ex.: dados de exemplo), converte os valores em reais
+    """
+    nome_centavos = coluna_centavos(coluna)
+    if nome_centavos in df.columns:
+        return df[nome_centavos].astype(np.int64)
+    return reais_para_centavos(df[coluna])
@@ -0,0 +1,152 @@
+"""
+Benchmark das etapas de leitura e conciliação
+
+Uso:
+    python benchmarks/benchmark_conciliacao.py [--tamanhos 1000 10000 ...] [--repeticoes N]
+                                               [--comparar resultados/anterior.json] [--tolerancia 0.2]
+
+Para cada tamanho, mede o tempo (melhor de N repetições) e o pico de memória (tracemalloc,
+em uma execução separada para não distorcer o tempo) de cada etapa, e salva o resultado em JSON
+em benchmarks/resultados. Com --comparar, aponta as etapas que ficaram mais lentas ou usaram mais
+memória que o resultado anterior além da tolerância e termina com código de saída 1.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+DIRETORIO_BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(DIRETORIO_BENCHMARKS), 'app'))
+
+from conciliacao import conciliar_dataframes
+from leitura import ler_aba_mapeamento, ler_balancete, ler_carteira, listar_abas_mapeamento
+from gerar_dados import gerar_conjunto
+
+TAMANHOS_PADRAO = [1_000, 10_000, 100_000, 1_000_000]
+DIRETORIO_DADOS = os.path.join(DIRETORIO_BENCHMARKS, 'dados')
+DIRETORIO_RESULTADOS = os.path.join(DIRETORIO_BENCHMARKS, 'resultados')
+
+
+def _ler_arquivo(leitor, caminho):
+    with open(caminho, 'rb') as arquivo:
+        return leitor(arquivo)
+
+
+def _medir(funcao, repeticoes):
+    """
+    Mede o melhor tempo entre as repetições e o pico de memória de uma execução
+    Retorna: (resultado, tempo_s, pico_memoria_mb)
+    """
+    melhor = float('inf')
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+
+    tracemalloc.start()
+    funcao()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return resultado, melhor, pico / 1024 / 1024
+
+
+def executar_benchmark(tamanhos, repeticoes=3, diretorio_dados=DIRETORIO_DADOS):
+    """
+    Executa todas as etapas para cada tamanho
+    Retorna: lista de medições {'tamanho', 'etapa', 'tempo_s', 'pico_memoria_mb'}
+    """
+    medicoes = []
+
+    for tamanho in tamanhos:
+        print(f"📁 Gerando/reaproveitando dados com {tamanho} linhas...")
+        caminhos = gerar_conjunto(diretorio_dados, tamanho)
+
+        etapas = [
+            ('ler_carteira', lambda caminhos=caminhos: _ler_arquivo(ler_carteira, caminhos['carteira'])[0]),
+            ('ler_balancete', lambda caminhos=caminhos: _ler_arquivo(ler_balancete, caminhos['balancete'])),
+            ('ler_mapeamento', lambda caminhos=caminhos: ler_aba_mapeamento(caminhos['mapeamento'], listar_abas_mapeamento(caminhos['mapeamento'])[0])),
+        ]
+
+        dados = {}
+        for etapa, funcao in etapas:
+            dados[etapa], tempo, pico = _medir(funcao, repeticoes)
+            medicoes.append({'tamanho': tamanho, 'etapa': etapa, 'tempo_s': tempo, 'pico_memoria_mb': pico})
+            print(f"   ⏱️  {etapa}: {tempo:.3f}s, pico de {pico:.1f} MB")
+
+        _, tempo, pico = _medir(
+            lambda dados=dados: conciliar_dataframes(dados['ler_carteira'], dados['ler_balancete'], dados['ler_mapeamento']),
+            repeticoes
+        )
+        medicoes.append({'tamanho': tamanho, 'etapa': 'conciliacao', 'tempo_s': tempo, 'pico_memoria_mb': pico})
+        print(f"   ⏱️  conciliacao: {tempo:.3f}s, pico de {pico:.1f} MB")
+
+    return medicoes
+
+
+def salvar_resultados(medicoes, diretorio=DIRETORIO_RESULTADOS):
+    """
+    Salva as medições em JSON junto com informações do ambiente
+    Retorna: caminho do arquivo salvo
+    """
+    os.makedirs(diretorio, exist_ok=True)
+    agora = datetime.now()
+    caminho = os.path.join(diretorio, f"benchmark_{agora.strftime('%Y%m%d_%H%M%S')}.json")
+
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        json.dump({
+            'data': agora.isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'maquina': platform.node(),
+            'medicoes': medicoes
+        }, arquivo, indent=2, ensure_ascii=False)
+
+    return caminho
+
+
+def comparar_resultados(medicoes, caminho_anterior, tolerancia=0.2):
+    """
+    Compara as medições com um resultado anterior
+    Retorna: DataFrame da comparação e lista de regressões (etapas acima da tolerância)
+    """
+    with open(caminho_anterior, encoding='utf-8') as arquivo:
+        anteriores = json.load(arquivo)['medicoes']
+
+    chave = ['tamanho', 'etapa']
+    df = pd.DataFrame(medicoes).merge(pd.DataFrame(anteriores), on=chave, suffixes=('', '_anterior'))
+    df['variacao_tempo'] = df['tempo_s'] / df['tempo_s_anterior'] - 1
+    df['variacao_memoria'] = df['pico_memoria_mb'] / df['pico_memoria_mb_anterior'] - 1
+
+    regressoes = df[(df['variacao_tempo'] > tolerancia) | (df['variacao_memoria'] > tolerancia)]
+    return df, regressoes[chave].to_dict('records')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark das etapas de leitura e conciliação")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=TAMANHOS_PADRAO, help="Quantidade de linhas da carteira e do balancete")
+    parser.add_argument("--repeticoes", type=int, default=3, help="Repetições por etapa (vale o melhor tempo)")
+    parser.add_argument("--dados", default=DIRETORIO_DADOS, help="Diretório dos arquivos gerados")
+    parser.add_argument("--comparar", default=None, help="JSON de um benchmark anterior para comparação")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="Piora relativa aceita antes de acusar regressão (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    print("🚀 Iniciando benchmark...")
+    medicoes = executar_benchmark(args.tamanhos, args.repeticoes, args.dados)
+    caminho = salvar_resultados(medicoes)
+    print(f"💾 Resultados salvos em {caminho}")
+
+    if args.comparar:
+        df_comparacao, regressoes = comparar_resultados(medicoes, args.comparar, args.tolerancia)
+        print(df_comparacao.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+        if regressoes:
+            for regressao in regressoes:
+                print(f"❌ Regressão em {regressao['etapa']} com {regressao['tamanho']} linhas")
+            sys.exit(1)
+        print("✅ Nenhuma regressão encontrada")
@@ -0,0 +1,152 @@
+"""
+Geradores determinísticos de carteira, balancete e mapeamento sintéticos para benchmarks
+
+Os arquivos seguem o formato esperado pelos leitores do app:
+CSV em iso-8859-15, separador ';', números no formato brasileiro (1.234.567,89) e header
+na última linha; mapeamento em Excel com as colunas 'Conta' e 'Ativo Carteira'.
+"""
+import os
+
+import numpy as np
+from openpyxl import Workbook
+
+ENCODING = 'iso-8859-15'
+SEPARADOR = ';'
+
+HEADER_BALANCETE = ['Conta', 'Nome', 'SldAnt', 'Debito', 'Credito', 'SldAtu']
+HEADER_CARTEIRA = ['Codigo', 'Titulo', 'Quantidade', 'PuMrc', 'VlMrc']
+
+NOMES_CONTA = ['BANCOS', 'APLICAÇÕES', 'TÍTULOS PÚBLICOS', 'DIREITOS CREDITÓRIOS', 'PROVISÃO',
+               'VALORES A RECEBER', 'TAXA DE ADMINISTRAÇÃO', 'COTAS DE FUNDOS', 'DESPESAS', 'PATRIMÔNIO']
+
+
+def formatar_numero_brasileiro(centavos):
+    """
+    Formata um array de centavos (int64) como texto no formato brasileiro: -1.234.567,89
+    """
+    return [f"{valor / 100:,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.') for valor in centavos]
+
+
+def dimensoes(linhas):
+    """
+    Dimensões dos dados gerados para um tamanho (em linhas do balancete e da carteira)
+    Retorna: (quantidade_contas, quantidade_ativos)
+    """
+    quantidade_contas = max(linhas // 10, 20)
+    quantidade_ativos = max(linhas // 20, 10)
+    return quantidade_contas, quantidade_ativos
+
+
+def gerar_codigos_conta(quantidade, rng):
+    """
+    Gera códigos de conta hierárquicos de 8 dígitos (grupo, subgrupo, ..., conta analítica)
+    """
+    grupos = rng.integers(1, 10, size=quantidade)
+    subgrupos = rng.integers(1, 10, size=quantidade)
+    titulos = rng.integers(1, 10, size=quantidade)
+    subtitulos = rng.integers(0, 100, size=quantidade)
+    analiticas = np.arange(quantidade) % 1000
+    codigos = grupos * 10_000_000 + subgrupos * 1_000_000 + titulos * 100_000 + subtitulos * 1_000 + analiticas
+    return np.unique(codigos)
+
+
+def _escrever_csv(caminho, linhas_dados, header):
+    """
+    Grava o CSV com o header na última linha
+    """
+    with open(caminho, 'w', encoding=ENCODING, newline='\n') as arquivo:
+        arquivo.write('\n'.join(linhas_dados))
+        arquivo.write('\n')
+        arquivo.write(SEPARADOR.join(header))
+        arquivo.write('\n')
+
+
+def gerar_balancete(caminho, linhas, codigos_conta, semente=0):
+    """
+    Gera um balancete com 'linhas' lançamentos distribuídos entre as contas
+    """
+    rng = np.random.default_rng(semente)
+    contas = rng.choice(codigos_conta, size=linhas)
+    nomes = rng.choice(NOMES_CONTA, size=linhas)
+    sld_ant = rng.integers(-10_000_000_00, 10_000_000_00, size=linhas)
+    debitos = rng.integers(0, 1_000_000_00, size=linhas)
+    creditos = rng.integers(0, 1_000_000_00, size=linhas)
+    sld_atu = sld_ant + debitos - creditos
+
+    colunas = [
+        contas.astype(str),
+        [f"{nome} {conta}" for nome, conta in zip(nomes, contas)],
+        formatar_numero_brasileiro(sld_ant),
+        formatar_numero_brasileiro(debitos),
+        formatar_numero_brasileiro(creditos),
+        formatar_numero_brasileiro(sld_atu),
+    ]
+    _escrever_csv(caminho, [SEPARADOR.join(campos) for campos in zip(*colunas)], HEADER_BALANCETE)
+
+
+def gerar_carteira(caminho, linhas, quantidade_ativos, semente=1):
+    """
+    Gera uma carteira com 'linhas' posições distribuídas entre os ativos (títulos repetidos são comuns)
+    """
+    rng = np.random.default_rng(semente)
+    ativos = rng.integers(0, quantidade_ativos, size=linhas)
+    quantidades = rng.integers(1, 100_000, size=linhas)
+    precos = rng.integers(1_00, 10_000_00, size=linhas)
+    valores = quantidades * precos
+
+    colunas = [
+        [f"{ativo:08d}" for ativo in ativos],
+        [f"ATIVO {ativo:06d}" for ativo in ativos],
+        quantidades.astype(str),
+        formatar_numero_brasileiro(precos),
+        formatar_numero_brasileiro(valores),
+    ]
+    _escrever_csv(caminho, [SEPARADOR.join(campos) for campos in zip(*colunas)], HEADER_CARTEIRA)
+
+
+def gerar_mapeamento(caminho, codigos_conta, quantidade_ativos, semente=2):
+    """
+    Gera o Excel de mapeamento: cada ativo aponta para 1 a 5 contas
+    Cerca de 5% dos ativos ficam sem mapeamento e algumas contas não existem no balancete
+    """
+    rng = np.random.default_rng(semente)
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Mapeamento")
+    sheet.append(['Conta', 'Ativo Carteira', 'Descrição'])
+
+    for ativo in range(quantidade_ativos):
+        if rng.random() < 0.05:
+            continue
+        for conta in rng.choice(codigos_conta, size=int(rng.integers(1, 6))):
+            # Contas inexistentes no balancete
+            if rng.random() < 0.02:
+                conta = 99_999_999 - int(conta) % 1000
+            sheet.append([int(conta), f"ATIVO {ativo:06d}", f"Mapeamento do ativo {ativo}"])
+
+    workbook.save(caminho)
+
+
+def gerar_conjunto(diretorio, linhas, semente=0):
+    """
+    Gera (ou reaproveita, se já existirem) os três arquivos de um tamanho
+    Retorna: dicionário com os caminhos de 'carteira', 'balancete' e 'mapeamento'
+    """
+    os.makedirs(diretorio, exist_ok=True)
+    caminhos = {
+        'carteira': os.path.join(diretorio, f"carteira_{linhas}.csv"),
+        'balancete': os.path.join(diretorio, f"balancete_{linhas}.csv"),
+        'mapeamento': os.path.join(diretorio, f"mapeamento_{linhas}.xlsx"),
+    }
+    if all(os.path.exists(caminho) for caminho in caminhos.values()):
+        return caminhos
+
+    quantidade_contas, quantidade_ativos = dimensoes(linhas)
+    rng = np.random.default_rng(semente)
+    codigos_conta = gerar_codigos_conta(quantidade_contas, rng)
+
+    gerar_balancete(caminhos['balancete'], linhas, codigos_conta, semente + 1)
+    gerar_carteira(caminhos['carteira'], linhas, quantidade_ativos, semente + 2)
+    gerar_mapeamento(caminhos['mapeamento'], codigos_conta, quantidade_ativos, semente + 3)
+
+    return caminhos
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os módulos do aplicativo são importados pelo nome (como no Streamlit e nos benchmarks)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
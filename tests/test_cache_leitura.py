@@ -0,0 +1,72 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache_leitura import ler_com_cache
+from memoria import hash_do_upload
+
+
+def _ler_duas_vezes(tmp_path, valor, tipo='mapeamento'):
+    chamadas = []
+
+    def leitor(arquivo):
+        chamadas.append(arquivo)
+        return valor
+
+    diretorio = str(tmp_path / 'cache')
+    primeira = ler_com_cache(io.BytesIO(b'conteudo'), tipo, leitor, diretorio=diretorio)
+    segunda = ler_com_cache(io.BytesIO(b'conteudo'), tipo, leitor, diretorio=diretorio)
+    return primeira, segunda, len(chamadas)
+
+
+def test_mapeamento_com_tipos_misturados(tmp_path):
+    # 'Conta' com números, textos e prefixos ('112*'), como nas planilhas de mapeamento
+    df_mapeamento = pd.DataFrame({
+        'Conta': [112, '112*', '1.1.2', np.nan],
+        'Ativo Carteira': ['LFT', 'LTN', 'NTN', 'CDB']
+    })
+
+    _, df_cache, leituras = _ler_duas_vezes(tmp_path, df_mapeamento)
+
+    assert leituras == 1
+    pd.testing.assert_frame_equal(df_cache, df_mapeamento)
+    assert [type(conta) for conta in df_cache['Conta'][:3]] == [int, str, str]
+
+
+def test_tupla_com_relatorio_e_indice(tmp_path):
+    df = pd.DataFrame({'ativo': ['A', 'B'], 'valor': [1.5, 2.0]}, index=[10, 20])
+    valor = (df, 3, {'formato': {'encoding': 'utf-8', 'separador': ';'}, 'linhas_invalidas': []})
+
+    _, em_cache, leituras = _ler_duas_vezes(tmp_path, valor, tipo='carteira')
+
+    assert leituras == 1
+    pd.testing.assert_frame_equal(em_cache[0], df)
+    assert em_cache[1:] == valor[1:]
+
+
+def test_diretorio_privado(tmp_path):
+    _ler_duas_vezes(tmp_path, pd.DataFrame({'a': [1]}))
+
+    assert os.stat(tmp_path / 'cache').st_mode & 0o077 == 0
+
+
+class _Upload(io.BytesIO):
+    # Como o UploadedFile do Streamlit: file_id, name e size identificam o envio
+    def __init__(self, dados, file_id):
+        super().__init__(dados)
+        self.file_id = file_id
+        self.name = 'arquivo.csv'
+        self.size = len(dados)
+
+
+def test_hash_do_upload_calculado_uma_vez():
+    estado = {}
+    upload = _Upload(b'abc', 'id-1')
+
+    primeiro = hash_do_upload(estado, upload)
+    # Mesmo envio: o hash guardado é usado sem ler o conteúdo
+    upload.getbuffer = None
+    assert hash_do_upload(estado, upload) == primeiro
+    assert hash_do_upload(estado, _Upload(b'abd', 'id-2')) != primeiro
@@ -0,0 +1,89 @@
+import pandas as pd
+
+from conciliacao import conciliar_com_estado, conciliar_dataframes
+
+
+def _conciliar(contas_mapeamento, ativos_mapeamento):
+    df_carteira = pd.DataFrame({'ativo': ['LFT', 'LTN'], 'valor': [10.0, 20.0]})
+    df_balancete = pd.DataFrame({'Conta': ['112', '113', '114'], 'Nome': ['a', 'b', 'c'], 'SldAtu': [10.0, 15.0, 5.0]})
+    df_mapeamento = pd.DataFrame({'Conta': contas_mapeamento, 'Ativo Carteira': ativos_mapeamento})
+    df_resultado, _, _ = conciliar_dataframes(df_carteira, df_balancete, df_mapeamento)
+    return df_resultado.set_index('Ativo Carteira')
+
+
+def test_mapeamento_um_para_um():
+    # Nenhum ativo com mais de 2 contas (a descrição '+ N outros' não é usada)
+    df_resultado = _conciliar(['112', '113'], ['LFT', 'LTN'])
+
+    assert df_resultado.loc['LFT', 'Conta Balancete'] == '112'
+    assert df_resultado.loc['LTN', 'Conta Balancete'] == '113'
+    assert df_resultado.loc['LFT', 'Status'] == 'CONCILIADO'
+    assert df_resultado.loc['LTN', 'Status'] == 'DIVERGENTE'
+
+
+def test_mapeamento_com_duas_contas():
+    df_resultado = _conciliar(['112', '113', '114'], ['LFT', 'LTN', 'LTN'])
+
+    assert df_resultado.loc['LTN', 'Conta Balancete'] == 'MÚLTIPLOS: 114, 113'
+    assert df_resultado.loc['LTN', 'Status'] == 'CONCILIADO'
+
+
+def test_mapeamento_com_mais_de_duas_contas():
+    df_resultado = _conciliar(['112', '113', '114'], ['LTN', 'LTN', 'LTN'])
+
+    assert df_resultado.loc['LTN', 'Conta Balancete'] == 'MÚLTIPLOS: 114, 113 + 1 outros'
+    assert df_resultado.loc['LFT', 'Status'] == 'NÃO MAPEADO'
+
+
+def test_valor_invalido_nunca_conciliado():
+    # Valor que não é número: 0 em centavos, mas divergente mesmo com saldo 0 no balancete
+    df_carteira = pd.DataFrame({'ativo': ['LFT', 'LTN'], 'valor': [float('nan'), 0.0]})
+    df_balancete = pd.DataFrame({'Conta': ['112', '113'], 'Nome': ['a', 'b'], 'SldAtu': [0.0, 0.0]})
+    df_mapeamento = pd.DataFrame({'Conta': ['112', '113'], 'Ativo Carteira': ['LFT', 'LTN']})
+    df_resultado, _, _ = conciliar_dataframes(df_carteira, df_balancete, df_mapeamento)
+    df_resultado = df_resultado.set_index('Ativo Carteira')
+
+    assert df_resultado.loc['LFT', 'Status'] == 'DIVERGENTE'
+    assert df_resultado.loc['LTN', 'Status'] == 'CONCILIADO'
+
+
+def test_prefixo_soma_a_subarvore():
+    df_carteira = pd.DataFrame({'ativo': ['LFT', 'LTN'], 'valor': [25.0, 7.0]})
+    df_balancete = pd.DataFrame({
+        'Conta': ['1.1.2', '1.1.3', '1.2.1', '11'],
+        'Nome': ['a', 'b', 'c', 'd'],
+        'SldAtu': [10.0, 15.0, 7.0, 100.0]
+    })
+    # '1.1*' não pega '11' (só contas que começam com '1.1')
+    df_mapeamento = pd.DataFrame({'Conta': ['1.1*', '1.2.1'], 'Ativo Carteira': ['LFT', 'LTN']})
+    df_resultado, _, _ = conciliar_dataframes(df_carteira, df_balancete, df_mapeamento)
+    df_resultado = df_resultado.set_index('Ativo Carteira')
+
+    assert df_resultado.loc['LFT', 'Saldo Balancete'] == 25.0
+    assert df_resultado.loc['LFT', 'Numero de Registros'] == 2
+    assert df_resultado.loc['LFT', 'Status'] == 'CONCILIADO'
+    assert df_resultado.loc['LTN', 'Status'] == 'CONCILIADO'
+
+
+def test_incremental_igual_a_completa():
+    df_carteira = pd.DataFrame({'ativo': ['LFT', 'LTN', 'NTN', 'CDB'], 'valor': [25.0, 7.0, 3.0, 1.0]})
+    df_mapeamento = pd.DataFrame({
+        'Conta': ['1.1*', '1.2.1', '2*', '3.1', '3.2'],
+        'Ativo Carteira': ['LFT', 'LTN', 'NTN', 'CDB', 'CDB']
+    })
+    revisoes = [
+        {'1.1.2': 10.0, '1.1.3': 15.0, '1.2.1': 7.0, '2.1': 3.0, '3.1': 1.0},
+        # Saldo alterado, conta nova dentro de um prefixo e conta removida
+        {'1.1.2': 11.0, '1.1.3': 15.0, '1.2.1': 7.0, '2.1': 3.0, '2.2': -3.0},
+        # Volta ao original
+        {'1.1.2': 10.0, '1.1.3': 15.0, '1.2.1': 7.0, '2.1': 3.0, '3.1': 1.0},
+    ]
+
+    estado = None
+    for saldos in revisoes:
+        df_balancete = pd.DataFrame({'Conta': list(saldos), 'Nome': 'x', 'SldAtu': list(saldos.values())})
+        df_incremental, estado = conciliar_com_estado(df_carteira, df_balancete, df_mapeamento, estado)
+        df_completo, _ = conciliar_com_estado(df_carteira, df_balancete, df_mapeamento)
+
+        pd.testing.assert_frame_equal(df_incremental, df_completo, check_dtype=False)
+    assert estado['recalculados'] < len(df_carteira)
@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from conciliacao import VERSAO_MAPEAMENTO_COMPILADO
+from database import _load_mapping_entries
+
+
+class _Resultado:
+    def __init__(self, linhas):
+        self.linhas = linhas
+
+    def fetchone(self):
+        return self.linhas[0] if self.linhas else None
+
+    def fetchall(self):
+        return self.linhas
+
+    def scalar(self):
+        return self.linhas[0][0]
+
+
+class _Conexao:
+    # Responde às consultas de _load_mapping_entries e falha em qualquer escrita
+    def __init__(self, entries_version, mapping_data=None, entries=()):
+        self.entries_version = entries_version
+        self.mapping_data = mapping_data
+        self.entries = list(entries)
+
+    def execute(self, clausula, parametros=None):
+        comando = " ".join(str(clausula).split())
+        assert comando.startswith("SELECT"), comando
+        if "entries_version" in comando:
+            return _Resultado([("Mapa", self.entries_version)])
+        if "mapping_data" in comando:
+            return _Resultado([(self.mapping_data,)])
+        return _Resultado(self.entries)
+
+
+def test_mapeamento_legado_lido_do_json_sem_gravar():
+    conexao = _Conexao(None, mapping_data='[{"Conta": 112, "Ativo Carteira": "LFT"}, {"Conta": "11*", "Ativo Carteira": "LTN"}]')
+
+    linhas, nome = _load_mapping_entries(conexao, 1)
+
+    assert nome == "Mapa"
+    # Na ordem de precedência: a última linha da planilha vem primeiro
+    assert [tuple(linha) for linha in linhas] == [("LTN", "11*", "11", True), ("LFT", "112", "112", False)]
+
+
+def test_mapeamento_convertido_lido_de_mapping_entries():
+    entradas = [("LFT", "112", "112", False)]
+
+    linhas, _ = _load_mapping_entries(_Conexao(VERSAO_MAPEAMENTO_COMPILADO, entries=entradas), 1)
+
+    assert linhas == entradas
@@ -0,0 +1,36 @@
+from encoding_utils import detectar_formato
+
+
+def test_utf8_com_ponto_e_virgula():
+    formato = detectar_formato(['Conta;Nome;SldAtu\n1;Ação;1,00\n2;Caixa;2,00\n'.encode('utf-8')])
+
+    assert formato['encoding'] == 'utf-8'
+    assert formato['separador'] == ';'
+
+
+def test_utf8_com_bom():
+    formato = detectar_formato(['﻿Conta;Nome\n1;Ação\n'.encode('utf-8')])
+
+    assert formato['encoding'] == 'utf-8-sig'
+
+
+def test_cp1252_pelos_caracteres_da_faixa_0x80():
+    # Aspas curvas só existem no cp1252 (no latin-9 a faixa 0x80-0x9F é de controle)
+    formato = detectar_formato(['Conta;Nome\n1;Ação “x”\n2;Caixa\n'.encode('cp1252')])
+
+    assert formato['encoding'] == 'cp1252'
+    assert formato['confianca'] == 1.0
+
+
+def test_latin9_e_virgula_fora_das_aspas():
+    formato = detectar_formato(['Conta,Nome,SldAtu\n1,Ação,"1,00"\n2,Caixa,"2,00"\n'.encode('iso-8859-15')])
+
+    assert formato['encoding'] == 'iso-8859-15'
+    assert formato['separador'] == ','
+
+
+def test_amostra_vazia_usa_o_padrao():
+    formato = detectar_formato([b''], encoding_padrao='cp1252', separador_padrao=';')
+
+    assert (formato['encoding'], formato['separador']) == ('cp1252', ';')
+    assert formato['confianca_separador'] == 0.0
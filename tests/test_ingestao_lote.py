@@ -0,0 +1,32 @@
+from ingestao_lote import identificar_fundo
+
+FUNDOS = [
+    {'id': 18, 'name': 'PAGALEVE FIDC', 'slug': 'fidc-pagaleve', 'government_id': '50059866000146'},
+    {'id': 29, 'name': 'FACIO FIDC', 'slug': 'fidc-facio', 'government_id': '51119641000109'},
+    {'id': 30, 'name': 'FACIO FIDC II', 'slug': 'fidc-facio-ii', 'government_id': None},
+]
+
+
+def _id(nome_arquivo):
+    fundo = identificar_fundo(nome_arquivo, FUNDOS)
+    return fundo['id'] if fundo is not None else None
+
+
+def test_formato_da_conciliacao_em_lote():
+    assert _id('18_carteira.csv') == 18
+    assert _id('fidc-facio_balancete.csv') == 29
+    assert _id('51119641000109_carteira.csv') == 29
+
+
+def test_cnpj_formatado_no_caminho():
+    assert _id('2024-06/50.059.866-0001-46/carteira.csv') == 18
+
+
+def test_slug_ou_nome_mais_longo_vence():
+    assert _id('dados/fidc-facio-ii/balancete.csv') == 30
+    assert _id('dados/FACIO FIDC II - balancete.csv') == 30
+    assert _id('dados/Facio FIDC - carteira.csv') == 29
+
+
+def test_sem_fundo_correspondente():
+    assert _id('outro/carteira.csv') is None
@@ -0,0 +1,111 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from populate_tables import create_staging_table, load_table_from_csv, sync_table_from_staging
+
+
+class _Conexao:
+    # Guarda os comandos em vez de executá-los
+    def __init__(self):
+        self.comandos = []
+
+    def execute(self, clausula, parametros=None):
+        self.comandos.append(" ".join(str(clausula).split()))
+        return self
+
+    def fetchone(self):
+        return (1, 2, 3)
+
+
+def test_tabela_temporaria_com_as_colunas_do_csv():
+    conexao = _Conexao()
+
+    assert create_staging_table(conexao, "funds", ["id", "name"]) == "staging_funds"
+    assert "CREATE TEMP TABLE staging_funds ON COMMIT DROP AS SELECT id, name FROM public.funds WITH NO DATA" in conexao.comandos[0]
+
+
+def test_sync_sem_is_active_no_csv():
+    conexao = _Conexao()
+
+    contagens = sync_table_from_staging(conexao, "fund_quotas", "staging_fund_quotas", ["id", "fund_id", "type"])
+
+    assert contagens == {"inserted": 1, "updated": 2, "deactivated": 3}
+    comando = conexao.comandos[0]
+    # Linhas do CSV ficam ativas; o id não é atualizado
+    assert "INSERT INTO public.fund_quotas AS t (id, fund_id, type, is_active) SELECT id, fund_id, type, true FROM staging_fund_quotas" in comando
+    assert "fund_id = EXCLUDED.fund_id, type = EXCLUDED.type, is_active = EXCLUDED.is_active" in comando
+    assert "id = EXCLUDED.id" not in comando
+    # Só linhas alteradas são atualizadas e as ausentes do CSV são desativadas
+    assert "IS DISTINCT FROM" in comando
+    assert "NOT EXISTS (SELECT 1 FROM staging_fund_quotas s WHERE s.id = t.id)" in comando
+
+
+def test_sync_com_is_active_no_csv():
+    conexao = _Conexao()
+
+    sync_table_from_staging(conexao, "funds", "staging_funds", ["id", "name", "is_active"])
+
+    assert "SELECT id, name, is_active FROM staging_funds" in conexao.comandos[0]
+
+
+class _Cursor:
+    def __init__(self, copias):
+        self.copias = copias
+        self.rowcount = 2
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excecao):
+        return False
+
+    def copy_expert(self, comando, arquivo):
+        self.copias.append((comando, arquivo.read()))
+
+
+class _Engine:
+    def __init__(self):
+        self.conexao = _Conexao()
+        self.copias = []
+        self.conexao.connection = self
+
+    def cursor(self):
+        return _Cursor(self.copias)
+
+    def begin(self):
+        engine = self
+
+        class _Transacao:
+            def __enter__(self):
+                return engine.conexao
+
+            def __exit__(self, *excecao):
+                return False
+
+        return _Transacao()
+
+
+def test_csv_vai_direto_para_o_copy(tmp_path):
+    caminho = tmp_path / "funds.csv"
+    caminho.write_bytes("id,name,slug,is_active,government_id,extra\n18,AÇÃO FIDC,fidc,true,00123,x\n19,,b,,,y\n".encode("cp1252"))
+    engine = _Engine()
+
+    load_table_from_csv(engine, "funds", str(caminho), ["id", "name", "slug", "government_id", "is_active"])
+
+    (comando, dados), = engine.copias
+    # Colunas na ordem do arquivo, células vazias como NULL e o conteúdo sem conversões
+    assert comando == (
+        'COPY staging_funds ("id", "name", "slug", "is_active", "government_id", "extra") '
+        "FROM STDIN WITH (FORMAT csv, DELIMITER ',', NULL '')"
+    )
+    assert dados == "18,AÇÃO FIDC,fidc,true,00123,x\n19,,b,,,y\n"
+    assert 'ALTER TABLE staging_funds ADD COLUMN "extra" TEXT' in engine.conexao.comandos
+
+
+def test_csv_sem_coluna_obrigatoria(tmp_path):
+    caminho = tmp_path / "funds.csv"
+    caminho.write_text("id,name\n1,a\n")
+
+    with pytest.raises(ValueError, match="slug"):
+        load_table_from_csv(_Engine(), "funds", str(caminho), ["id", "name", "slug"])
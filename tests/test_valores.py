@@ -0,0 +1,36 @@
+import pandas as pd
+
+from valores import converter_numeros_brasileiros
+
+
+def _converter(*textos):
+    centavos, invalidos = converter_numeros_brasileiros(pd.Series(list(textos), dtype=object))
+    return list(centavos), list(invalidos)
+
+
+def test_formatos_brasileiros():
+    centavos, invalidos = _converter('1.234.567,89', '12', '0,5', '-1.234,56', '1.234,56-', '(1.234,56)')
+
+    assert centavos == [123456789, 1200, 50, -123456, -123456, -123456]
+    assert not any(invalidos)
+
+
+def test_terceira_casa_arredonda_metade_para_cima():
+    centavos, _ = _converter('1,005', '1,004', '-1,005')
+
+    assert centavos == [101, 100, -101]
+
+
+def test_celulas_vazias_valem_zero():
+    centavos, invalidos = _converter('', None, '  ')
+
+    assert centavos == [0, 0, 0]
+    assert not any(invalidos)
+
+
+def test_valores_invalidos():
+    # Notação científica não é um formato da carteira nem do balancete
+    centavos, invalidos = _converter('abc', '1e3', '1,2,3', '--1', '(1,00', '1-0')
+
+    assert centavos == [0] * 6
+    assert all(invalidos)